@@ -33,6 +33,7 @@ INSERT INTO val_event_type VALUES('RecordAddFailed', 'Partial feed, record addit
 INSERT INTO val_event_type VALUES('RecordRemoveFailed', 'Partial feed, record removal failed');
 INSERT INTO val_event_type VALUES('RecordModifyFailed', 'Partial feed, record modification failed');
 INSERT INTO val_event_type VALUES('ExecutionError', 'Major execution error');
+INSERT INTO val_event_type VALUES('ExecutionProgress', 'Progress of a long running script or feed');
 --subsystems - uncomment to add
 --INSERT INTO val_subsystem VALUES ('PostgreSQL');
 --INSERT INTO val_subsystem VALUES ('MySQL');
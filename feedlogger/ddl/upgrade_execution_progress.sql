@@ -0,0 +1,18 @@
+-- Copyright 2017 Ryan D. Williams
+-- 
+-- Licensed under the Apache License, Version 2.0 (the "License");
+-- you may not use this file except in compliance with the License.
+-- You may obtain a copy of the License at
+-- 
+--     http://www.apache.org/licenses/LICENSE-2.0
+-- 
+-- Unless required by applicable law or agreed to in writing, software
+-- distributed under the License is distributed on an "AS IS" BASIS,
+-- WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+-- See the License for the specific language governing permissions and
+-- limitations under the License.
+
+--adds the ExecutionProgress event type to feedlogs DBs bootstrapped before it
+--existed. safe to run more than once
+INSERT INTO val_event_type VALUES('ExecutionProgress', 'Progress of a long running script or feed')
+    ON CONFLICT (event_type) DO NOTHING;
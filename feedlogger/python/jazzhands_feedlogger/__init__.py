@@ -25,6 +25,7 @@ Exceptions:
 import os
 import re
 import sys
+import time
 import socket
 import getpass
 import logging
@@ -42,6 +43,19 @@ DEFAULT_APPAUTHAL_NAME = 'feedlogger'
 
 LOG = logging.getLogger(__name__ + '.FeedLogger')
 
+_monotonic = getattr(time, 'monotonic', time.time)
+
+_host_name = None
+
+
+def host_name():
+    """Returns the fully qualified name of this host. The DNS lookup is done
+    the first time it is needed and reused for the life of the process"""
+    global _host_name                                                   # pylint: disable=global-statement
+    if _host_name is None:
+        _host_name = socket.getfqdn()
+    return _host_name
+
 
 class FeedLogger(object):
     """Class to log feed events to the feedlogs DB
@@ -69,11 +83,17 @@ class FeedLogger(object):
         'key_type', 'attribute_value', 'attribute_new_value']
 
 
-    def __init__(self, conf):
+    def __init__(self, conf, connection_factory=None, metrics=None):
         """Requires a config dictionary
 
         Args:
             conf (dict): configuration dictionary
+            connection_factory (callable, optional): takes the appauthal app name and returns
+                a DB connection. Used to share connections between feeds. Defaults to
+                connecting through AppAuthAL
+            metrics (object, optional): metrics registry providing counter(name, help, labels)
+                and histogram(name, help, labels) such as jh_recsynclib.metrics.MetricsRegistry.
+                Event counts and log_event latency are recorded in it
 
         Configuration:
             source_subsystem (str): the subsystem where the data is being synced from.
@@ -89,10 +109,13 @@ class FeedLogger(object):
             allow_partial_updates (bool, optional): instructs the logger to log events immiedately.
                 Turns on autocommit. Default False
             log_queries (bool, optional): logs queries to syslog. default False
-            start_session: (bool, optional): tells the FeedLogger to start the session upon init.
-                Default True
+            start_session: (bool, optional): tells the FeedLogger to start the session when
+                it is first needed, by the first log_event or end_session. Default True
+            host_name (str, optional): host name recorded in the session. Default the fully
+                qualified name of this host, which needs a DNS lookup when the session starts
         """
         self._conf = conf
+        self._metrics = metrics
         try:
             self._src_subsys = conf['source_subsystem']
             self._dst_subsys = conf['destination_subsystem']
@@ -101,20 +124,27 @@ class FeedLogger(object):
                 'Configuration dictionary must include: {}'.format(exc))
         appauthal_app_name = conf.get('appauthal_app_name', DEFAULT_APPAUTHAL_NAME)
         LOG.debug('connecting to DB using AppAuthAL: %s', appauthal_app_name)
-        self._dbh = DatabaseConnection(appauthal_app_name).connect()
+        if connection_factory:
+            self._dbh = connection_factory(appauthal_app_name)
+        else:
+            self._dbh = DatabaseConnection(appauthal_app_name).connect()
         self._dry_run = bool(conf.get('dry_run', False))
         self._log_qry = bool(conf.get('log_queries', False))
         if self._dry_run:
             LOG.debug('set to dry_run mode, no changes will be commited to the DB')
-        #turn on autocommit only if requested AND NOT dry_run flagged
-        if conf.get('allow_partial_updates') and not self._dry_run:
+        #turn on autocommit only if requested AND NOT dry_run flagged. a shared
+        #connection may have been left in either mode by its previous user
+        autocommit = bool(conf.get('allow_partial_updates') and not self._dry_run)
+        if self._dbh.autocommit != autocommit:
             self._dbh.rollback()
-            self._dbh.autocommit = True
+            self._dbh.autocommit = autocommit
+        if autocommit:
             LOG.debug('set to allow partial updates. will commit all events immiedately')
-        if self._conf.get('start_session', True):
-            self._session_id = self.start_session()
-        else:
-            self._session_id = None
+        self._session_ended = False
+        self._event_types = {}
+        # the session row, and the host name lookup it needs, wait until the
+        # first event so loggers that never log cost nothing
+        self._session_id = None
 
     def commit(self):
         """Commits all open statements to JazzHands"""
@@ -136,6 +166,8 @@ class FeedLogger(object):
             LOG.debug(u'Executing query: %s', re.sub(r'\s+', ' ', qry))
 
     def _check_session(self):
+        if not self._session_id and self._conf.get('start_session', True):
+            self._session_id = self.start_session()
         if not self._session_id:
             raise FeedLoggerException(
                 'No session_id found. You must run start_session() before other actions')
@@ -152,7 +184,7 @@ class FeedLogger(object):
             'program_name': os.path.basename(sys.argv[0]),
             'username': getpass.getuser(),
             'pid': os.getpid(),
-            'host_name': socket.getfqdn()
+            'host_name': self._conf.get('host_name') or host_name()
         }
         dbc = self._dbh.cursor()
         dbc.execute(qry, vals)
@@ -173,6 +205,30 @@ class FeedLogger(object):
         LOG.debug('Feed session ended. session_id: %s', self._session_id)
         self.commit()
         dbc.close()
+        self._session_ended = True
+
+    def ensure_session(self):
+        """Starts a new session if there is none or the current one has ended.
+        Used by long running processes that log many feed runs"""
+        if not self._session_id or self._session_ended:
+            self._session_id = self.start_session()
+            self._session_ended = False
+
+    def close(self):
+        """Closes the connection to the DB"""
+        if not self._dbh.closed:
+            self._dbh.close()
+
+    def has_event_type(self, event_type):
+        """Returns True if event_type exists in val_event_type. Used for event
+        types added after a feedlogs DB may have been deployed"""
+        if event_type not in self._event_types:
+            dbc = self._dbh.cursor()
+            dbc.execute('SELECT 1 FROM val_event_type WHERE event_type = %s', (event_type,))
+            self._syslog_qry(dbc.query)
+            self._event_types[event_type] = dbc.fetchone() is not None
+            dbc.close()
+        return self._event_types[event_type]
 
     def log_event(self, event_type, event_priority, message, event_attrs=None):
         """Logs an event to the database.
@@ -187,6 +243,7 @@ class FeedLogger(object):
                     attribute_value, attribute_new_value
         """
         self._check_session()
+        start = _monotonic()
         if not event_attrs:
             event_attrs = list()
         event_qry = build_ins_query('event', self.EVENT_COLUMNS, ['event_id'])
@@ -216,6 +273,16 @@ class FeedLogger(object):
             attr.update({'event_id': event_id})
             dbc.execute(attr_qry, attr)
             self._syslog_qry(dbc.query)
+        if self._metrics:
+            self._metrics.counter(
+                'jh_feedlogger_events', 'Events logged to the feedlogs DB',
+                ['event_type']).inc(event_type=event_type)
+            self._metrics.counter(
+                'jh_feedlogger_event_attributes', 'Event attributes logged to the feedlogs DB',
+                ['event_type']).inc(len(event_attrs), event_type=event_type)
+            self._metrics.histogram(
+                'jh_feedlogger_log_event_seconds', 'Time taken to log a single event',
+                ['event_type']).observe(_monotonic() - start, event_type=event_type)
 
 
 class FeedLoggerException(Exception):
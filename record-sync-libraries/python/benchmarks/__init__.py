@@ -0,0 +1,24 @@
+# Copyright 2017 Ryan D. Williams
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""jh_recsynclib benchmarks
+
+Times the record, diff, sync and event logging paths against synthetic
+datasets and in-memory stand-ins for the destination and the feedlogs DB.
+
+Run from the record-sync-libraries/python directory:
+    python -m benchmarks.run --size 10000 --output bench.json
+    python -m benchmarks.run --size 10000 --compare bench.json
+    python -m benchmarks.startup
+"""
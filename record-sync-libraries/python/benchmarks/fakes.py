@@ -0,0 +1,131 @@
+# Copyright 2017 Ryan D. Williams
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-memory stand-ins used by the benchmarks"""
+
+__author__ = 'Ryan D. Williams <rdw@drws-office.com>'
+
+# Standard library imports
+import os
+import json
+
+# Local imports
+from jh_recsynclib.sync import SyncBase, SyncOptions
+
+
+def write_sync_conf(directory, conf=None):
+    """Writes a minimal sync configuration file into directory and returns
+    its path. Event logging to the DB and syslog is disabled unless overridden"""
+    sync_conf = {
+        'record_sync_logger_conf': {
+            'dblog': False,
+            'syslog': False,
+            'source_subsystem': 'benchmark',
+            'destination_subsystem': 'memory'}}
+    sync_conf.update(conf or {})
+    path = os.path.join(directory, 'sync.json')
+    with open(path, 'w') as _fh:
+        json.dump(sync_conf, _fh)
+    return path
+
+
+class MemorySync(SyncBase):
+    """SyncBase subclass syncing between two in-memory datasets"""
+
+    def __init__(self, record_type, source, dest, conf_file, argv=()):
+        self._source = source
+        self._dest = {rec.primary_key: rec for rec in dest}
+        args = SyncOptions().parse_opts(['--conf-file', conf_file, '--force'] + list(argv))
+        super(MemorySync, self).__init__(record_type, args)
+
+    def _get_source_dataset(self):
+        return self._source
+
+    def _get_destination_dataset(self):
+        return set(self._dest.values())
+
+    def _add_record(self, obj):
+        self._dest[obj.primary_key] = obj
+        return obj
+
+    def _rm_record(self, obj):
+        del self._dest[obj.primary_key]
+
+    def _modify_record(self, obj):
+        self._dest[obj.primary_key].update(obj.items())
+
+    def _update_destination(self, records):
+        self._dest = {rec.primary_key: rec for rec in records}
+
+
+class FakeCursor(object):
+    """Cursor accepting anything FeedLogger executes"""
+
+    def __init__(self, conn):
+        self._conn = conn
+        self.query = None
+        self.rowcount = 1
+
+    def execute(self, qry, vals=None):
+        self.query = qry
+        self._conn.statements += 1
+
+    def fetchone(self):
+        self._conn.sequence += 1
+        return (self._conn.sequence,)
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+    """psycopg2 style connection that only counts statements"""
+
+    def __init__(self):
+        self.autocommit = False
+        self.closed = False
+        self.statements = 0
+        self.sequence = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class FakeDictRow(list):
+    """Row behaving like the psycopg2 DictRow, indexable by position or by
+    column name through a python level __getitem__"""
+
+    __slots__ = ('_index',)
+
+    def __init__(self, index, values):
+        super(FakeDictRow, self).__init__(values)
+        self._index = index
+
+    def __getitem__(self, key):
+        if not isinstance(key, (int, slice)):
+            key = self._index[key]
+        return super(FakeDictRow, self).__getitem__(key)
+
+    def keys(self):
+        """Returns an iterator of the column names"""
+        return iter(self._index)
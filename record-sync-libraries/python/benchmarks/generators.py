@@ -0,0 +1,93 @@
+# Copyright 2017 Ryan D. Williams
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Synthetic record definitions and datasets for benchmarks"""
+
+__author__ = 'Ryan D. Williams <rdw@drws-office.com>'
+
+# Standard library imports
+import random
+
+# Local imports
+from jh_recsynclib.utils import JHRecordFactory
+
+
+def make_record_definition(attributes=10, key_arity=1):
+    """Returns a record definition dictionary.
+
+    Args:
+        attributes: int. number of non key attributes
+        key_arity: int. number of attributes making up the primary key
+    """
+    keys = ['key_{}'.format(i) for i in range(key_arity)]
+    attrs = ['attr_{}'.format(i) for i in range(attributes)]
+    half = len(attrs) // 2
+    return {
+        'primary_keys': keys,
+        'required_attributes': keys + attrs[:half],
+        'optional_attributes': attrs[half:]}
+
+
+def make_factory(attributes=10, key_arity=1, record_type='bench_record'):
+    """Returns a JHRecordFactory for a synthetic record definition"""
+    return JHRecordFactory(
+        record_type, rec_def=make_record_definition(attributes, key_arity))
+
+
+def make_rows(factory, size, seed=0):
+    """Returns a list of row dictionaries matching the factory's template"""
+    rnd = random.Random(seed)
+    keys = factory.primary_keys
+    rows = []
+    for num in range(size):
+        row = {key: '{}-{}'.format(key, num) for key in keys}
+        for attr in factory.attribute_template:
+            if attr not in row:
+                row[attr] = 'v{}'.format(rnd.randint(0, 1000000))
+        rows.append(row)
+    return rows
+
+
+def make_datasets(factory, size, add_ratio=0.01, remove_ratio=0.01, modify_ratio=0.05,
+                  modified_attributes=1, seed=0):
+    """Returns a (source, destination) tuple of JHRecord sets.
+
+    The destination is built from the same rows as the source with the
+    requested share of records added, removed and modified.
+
+    Args:
+        factory: JHRecordFactory used to create the records
+        size: int. number of records in the source
+        add_ratio: float. share of source records missing from the destination
+        remove_ratio: float. share of extra records in the destination
+        modify_ratio: float. share of records that differ
+        modified_attributes: int. number of attributes changed per modified record
+        seed: int. random seed so runs are repeatable
+    """
+    rnd = random.Random(seed)
+    rows = make_rows(factory, size, seed)
+    source = {factory.create(row) for row in rows}
+    n_add = int(size * add_ratio)
+    n_mod = int(size * modify_ratio)
+    attrs = [attr for attr in factory.attribute_template if attr not in factory.primary_keys]
+    dest_rows = []
+    for num, row in enumerate(rows[n_add:]):
+        row = dict(row)
+        if num < n_mod:
+            for attr in rnd.sample(attrs, min(modified_attributes, len(attrs))):
+                row[attr] = 'changed-{}'.format(row[attr])
+        dest_rows.append(row)
+    extra = make_rows(factory, size + int(size * remove_ratio), seed + 1)[size:]
+    dest = {factory.create(row) for row in dest_rows + extra}
+    return source, dest
@@ -0,0 +1,245 @@
+# Copyright 2017 Ryan D. Williams
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Runs the benchmarks and writes the results as JSON
+
+Examples:
+    python -m benchmarks.run --size 10000 --output before.json
+    python -m benchmarks.run --size 10000 --compare before.json
+"""
+
+__author__ = 'Ryan D. Williams <rdw@drws-office.com>'
+
+# Standard library imports
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import argparse
+import subprocess
+from collections import OrderedDict
+
+# Local imports
+from jh_recsynclib.sync import JHRecordSyncer
+from benchmarks.generators import make_factory, make_datasets, make_rows
+from benchmarks.fakes import MemorySync, FakeConnection, FakeDictRow, write_sync_conf
+
+monotonic = getattr(time, 'monotonic', time.time)
+
+
+class Benchmark(object):
+    """A named piece of work timed over a number of repeats.
+
+    setup is called before every repeat and its return value is passed to
+    func.  Only func is timed.
+    """
+
+    def __init__(self, name, func, setup=None, ops=1):
+        self.name = name
+        self.func = func
+        self.setup = setup
+        self.ops = ops
+
+    def run(self, repeat):
+        """Returns a dictionary of timing results"""
+        times = []
+        for _ in range(repeat):
+            state = self.setup() if self.setup else None
+            start = monotonic()
+            self.func(state)
+            times.append(monotonic() - start)
+        times.sort()
+        median = times[len(times) // 2]
+        return OrderedDict((
+            ('ops', self.ops),
+            ('repeat', repeat),
+            ('min_seconds', round(times[0], 6)),
+            ('median_seconds', round(median, 6)),
+            ('mean_seconds', round(sum(times) / len(times), 6)),
+            ('ops_per_second', round(self.ops / median, 1) if median else None)))
+
+
+def _copy_records(factory, records):
+    return {factory.create(dict(rec.all_items())) for rec in records}
+
+
+def build_benchmarks(opts, workdir):
+    """Returns the list of Benchmarks for the options given. Files they need
+    are written to workdir"""
+    factory = make_factory(opts.attributes, opts.key_arity)
+    rows = make_rows(factory, opts.size)
+    columns = factory.attribute_template
+    tuple_rows = [tuple(row[col] for col in columns) for row in rows]
+    index = {col: num for num, col in enumerate(columns)}
+    dict_rows = [FakeDictRow(index, values) for values in tuple_rows]
+    src, dst = make_datasets(
+        factory, opts.size, opts.add_ratio, opts.remove_ratio, opts.modify_ratio)
+    syncer = JHRecordSyncer(src, dst)
+    mods = list(syncer.get_modifications())
+    conf_file = write_sync_conf(workdir)
+    benchmarks = [
+        Benchmark(
+            'factory_create',
+            lambda _: [factory.create(row) for row in rows], ops=len(rows)),
+        Benchmark(
+            'factory_create_many', lambda _: factory.create_many(rows), ops=len(rows)),
+        Benchmark(
+            'factory_create_many_dictrows',
+            lambda _: factory.create_many(dict_rows), ops=len(rows)),
+        Benchmark(
+            'factory_create_many_tuples',
+            lambda _: factory.create_many(tuple_rows, columns), ops=len(rows)),
+        Benchmark(
+            'templated_dict_diff',
+            lambda _: [d_rec.diff(s_rec) for s_rec, d_rec in mods], ops=len(mods)),
+        Benchmark('syncer_index', lambda _: JHRecordSyncer(src, dst), ops=len(src) + len(dst)),
+        Benchmark('syncer_additions', lambda _: syncer.get_additions(), ops=len(src)),
+        Benchmark('syncer_removals', lambda _: syncer.get_removals(), ops=len(dst)),
+        Benchmark('syncer_modifications', lambda _: syncer.get_modifications(), ops=len(src)),
+        Benchmark(
+            'changes_sync',
+            lambda sync: sync.run_sync('changes'),
+            setup=lambda: MemorySync(
+                factory.record_type, src, _copy_records(factory, dst), conf_file),
+            ops=len(src)),
+        Benchmark(
+            'changes_sync_dry_run',
+            lambda sync: sync.run_sync('changes'),
+            setup=lambda: MemorySync(
+                factory.record_type, src, _copy_records(factory, dst), conf_file, ['-n']),
+            ops=len(src)),
+    ]
+    feedlogger = feedlogger_benchmark(opts)
+    if feedlogger:
+        benchmarks.append(feedlogger)
+    return benchmarks
+
+
+def feedlogger_benchmark(opts):
+    """Returns the FeedLogger.log_event benchmark. Uses a fake connection
+    unless a feedlogs appauthal app name is given. None if the feedlogger
+    package is not installed"""
+    try:
+        from jazzhands_feedlogger import FeedLogger
+    except ImportError as exc:
+        sys.stderr.write('skipping feedlogger_log_event: {}\n'.format(exc))
+        return None
+    conf = {'source_subsystem': 'benchmark', 'destination_subsystem': 'memory'}
+    if opts.feedlog_app:
+        conf['appauthal_app_name'] = opts.feedlog_app
+        conf['dry_run'] = True
+        connection_factory = None
+    else:
+        connection_factory = lambda app_name: FakeConnection()
+    attrs = [{
+        'entity_name': 'bench_record',
+        'entity_location': 'destination',
+        'attribute_name': 'attr_{}'.format(num),
+        'key_type': 'not_a_key',
+        'attribute_value': 'old',
+        'attribute_new_value': 'new'} for num in range(opts.attributes)]
+    events = min(opts.size, opts.max_events)
+
+    def log_events(flgr):
+        for _ in range(events):
+            flgr.log_event('RecordModified', 'info', 'benchmark event', attrs)
+        flgr.rollback()
+
+    return Benchmark(
+        'feedlogger_log_event', log_events,
+        setup=lambda: FeedLogger(conf, connection_factory=connection_factory), ops=events)
+
+
+def git_revision():
+    """Returns the current git commit or None"""
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'], stderr=devnull).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Prints the ratio of each median to the baseline. Returns the names of
+    benchmarks slower than threshold times the baseline"""
+    slower = []
+    base = baseline['results']
+    print('{:<28} {:>14} {:>14} {:>8}'.format('benchmark', 'baseline', 'current', 'ratio'))
+    for name, result in results.items():
+        if name not in base:
+            continue
+        old, new = base[name]['median_seconds'], result['median_seconds']
+        ratio = new / old if old else float('inf')
+        if ratio > threshold:
+            slower.append(name)
+        print('{:<28} {:>14.6f} {:>14.6f} {:>7.2f}x{}'.format(
+            name, old, new, ratio, ' SLOWER' if ratio > threshold else ''))
+    return slower
+
+
+def main(argv=None):
+    """Parses arguments, runs the benchmarks and writes or compares results"""
+    parser = argparse.ArgumentParser(description='jh_recsynclib benchmarks')
+    parser.add_argument('--size', type=int, default=10000, help='records in the source')
+    parser.add_argument('--attributes', type=int, default=10, help='non key attributes')
+    parser.add_argument('--key-arity', type=int, default=1, help='attributes in the primary key')
+    parser.add_argument('--add-ratio', type=float, default=0.01)
+    parser.add_argument('--remove-ratio', type=float, default=0.01)
+    parser.add_argument('--modify-ratio', type=float, default=0.05)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-events', type=int, default=1000,
+                        help='cap on events logged by feedlogger_log_event')
+    parser.add_argument('--feedlog-app', help='appauthal app name of a real feedlogs DB')
+    parser.add_argument('--only', action='append', help='run only the named benchmark(s)')
+    parser.add_argument('--output', help='write the JSON results to this file')
+    parser.add_argument('--compare', help='JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='ratio to the baseline considered a regression')
+    opts = parser.parse_args(argv)
+
+    results = OrderedDict()
+    workdir = tempfile.mkdtemp(prefix='jh_recsync_bench')
+    try:
+        for bench in build_benchmarks(opts, workdir):
+            if opts.only and bench.name not in opts.only:
+                continue
+            results[bench.name] = bench.run(opts.repeat)
+            sys.stderr.write('{:<28} {:.6f}s\n'.format(
+                bench.name, results[bench.name]['median_seconds']))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    output = OrderedDict((
+        ('revision', git_revision()),
+        ('python', platform.python_version()),
+        ('time', time.time()),
+        ('params', OrderedDict(sorted(vars(opts).items()))),
+        ('results', results)))
+    if opts.output:
+        with open(opts.output, 'w') as _fh:
+            json.dump(output, _fh, indent=2)
+    elif not opts.compare:
+        print(json.dumps(output, indent=2))
+    if opts.compare:
+        with open(opts.compare, 'r') as _fh:
+            if compare(results, json.load(_fh), opts.threshold):
+                return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+# Copyright 2017 Ryan D. Williams
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Checks the import time of the library against a budget
+
+Each module is imported in a fresh interpreter and the median time over the
+repeats is compared against the budget.  The run also fails if an import pulls
+in a module that is meant to be loaded lazily.  The library and the feedlogger
+of this checkout are imported, not installed copies.  Modules whose third party
+dependencies are not installed fail the run unless skipping them is allowed.
+
+Examples:
+    python -m benchmarks.startup
+    python -m benchmarks.startup --budget-ms 50 --module jh_recsynclib.sync
+    python -m benchmarks.startup --allow-skipped
+"""
+
+__author__ = 'Ryan D. Williams <rdw@drws-office.com>'
+
+# Standard library imports
+import os
+import sys
+import json
+import argparse
+import subprocess
+from collections import OrderedDict
+
+
+LIBRARY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FEEDLOGGER_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(LIBRARY_PATH)), 'feedlogger', 'python')
+
+DEFAULT_MODULES = [
+    'jh_recsynclib.utils',
+    'jh_recsynclib.sync',
+    'jh_recsynclib.db',
+    'jazzhands_feedlogger',
+]
+
+# modules that no import of the library should load on its own
+LAZY_MODULES = [
+    'pkg_resources',
+    'jsonschema',
+    'jh_recsynclib.table_pkeys_map',
+]
+
+IMPORT_SCRIPT = """
+import sys, json, time
+timer = getattr(time, 'perf_counter', time.time)
+start = timer()
+try:
+    __import__(sys.argv[1])
+except ImportError as exc:
+    print(json.dumps({'skipped': str(exc)}))
+    sys.exit(0)
+seconds = timer() - start
+print(json.dumps({'seconds': seconds, 'loaded': [m for m in sys.argv[2:] if m in sys.modules]}))
+"""
+
+
+def time_import(module, repeat):
+    """Returns a dictionary with the median import time of module in
+    milliseconds and any lazy modules it loaded, or the reason it was skipped"""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [LIBRARY_PATH, FEEDLOGGER_PATH] + [path for path in [env.get('PYTHONPATH')] if path])
+    times = []
+    for _ in range(repeat):
+        out = subprocess.check_output(
+            [sys.executable, '-c', IMPORT_SCRIPT, module] + LAZY_MODULES, env=env)
+        result = json.loads(out.decode('utf-8'))
+        if 'skipped' in result:
+            return result
+        times.append(result['seconds'])
+    times.sort()
+    return OrderedDict((
+        ('median_ms', round(times[len(times) // 2] * 1000, 3)),
+        ('min_ms', round(times[0] * 1000, 3)),
+        ('loaded', result['loaded'])))
+
+
+def main(argv=None):
+    """Times the imports and returns 1 if any is over budget"""
+    parser = argparse.ArgumentParser(description='jh_recsynclib import time budget')
+    parser.add_argument('--module', action='append', help='module to import. repeatable')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=100.0,
+                        help='median import time allowed per module')
+    parser.add_argument('--allow-skipped', action='store_true',
+                        help='do not fail on modules whose dependencies are not installed')
+    opts = parser.parse_args(argv)
+
+    failed = False
+    results = OrderedDict()
+    for module in opts.module or DEFAULT_MODULES:
+        result = results[module] = time_import(module, opts.repeat)
+        if 'skipped' in result:
+            sys.stderr.write('{:<28} skipped: {}\n'.format(module, result['skipped']))
+            failed = failed or not opts.allow_skipped
+            continue
+        problems = []
+        if result['median_ms'] > opts.budget_ms:
+            problems.append('over the {}ms budget'.format(opts.budget_ms))
+        if result['loaded']:
+            problems.append('loaded {}'.format(', '.join(result['loaded'])))
+        failed = failed or bool(problems)
+        sys.stderr.write('{:<28} {:>9.3f}ms {}\n'.format(
+            module, result['median_ms'], '; '.join(problems)))
+    print(json.dumps(results, indent=2))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
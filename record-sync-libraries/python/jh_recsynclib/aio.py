@@ -0,0 +1,331 @@
+# Copyright 2017 Ryan D. Williams
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""asyncio database interface
+
+Counterparts of JHDBI and JHDBRecordInterface for feeds built on asyncio,
+using psycopg 3 AsyncConnections checked out of psycopg_pool pools that are
+shared by every object talking to the same database from the same event loop.
+Await close_pools before the event loop is closed.  Python 3.7 or later.
+
+Example:
+    async def sync_department(dept):
+        async with AsyncJHDBRecordInterface('jh-feed', 'department', table_map=tmap) as jhdbi:
+            for rec in await jhdbi.query_jh_record(qry):
+                await jhdbi.update_jh_record(rec, calling_user='feed')
+            await jhdbi.commit()
+
+    async def main():
+        try:
+            await asyncio.gather(*(sync_department(dept) for dept in departments))
+        finally:
+            await close_pools()
+
+    asyncio.run(main())
+"""
+
+__author__ = 'Ryan D. Williams <rdw@drws-office.com>'
+
+# Standard library imports
+import weakref
+import asyncio
+import logging
+import itertools
+
+# Third-party imports
+from psycopg_pool import AsyncConnectionPool
+
+# Local imports
+from jh_recsynclib.db import JHDBRecordInterface, JHDBIException, update_query
+from jh_recsynclib.pg3 import appauthal_conninfo, dict_row
+from jh_recsynclib.pkeys import PRIMARY_KEYS_QRY, SCHEMA_VERSION_QRY, pkeys_from_rows
+from jh_recsynclib.utils import JHRecordFactory
+
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_POOL_MIN_SIZE = 1
+DEFAULT_POOL_MAX_SIZE = 10
+
+# event loop to {conninfo: future of the pool}, a pool only works on the
+# loop it was opened on
+_pools = weakref.WeakKeyDictionary()
+_cursor_names = itertools.count()
+
+
+async def _open_pool(conninfo, min_size, max_size):
+    pool = AsyncConnectionPool(
+        conninfo, min_size=min_size, max_size=max_size,
+        kwargs={'row_factory': dict_row}, open=False)
+    await pool.open()
+    LOG.debug('opened connection pool of %s to %s connections', min_size, max_size)
+    return pool
+
+
+async def get_pool(conninfo, min_size=DEFAULT_POOL_MIN_SIZE, max_size=DEFAULT_POOL_MAX_SIZE):
+    """Returns the pool for conninfo on the running event loop, opening it
+    on first use. Sizes only apply to the first call for a conninfo"""
+    pools = _pools.setdefault(asyncio.get_running_loop(), {})
+    if conninfo not in pools:
+        # concurrent callers wait on the same task instead of opening their own
+        pools[conninfo] = asyncio.ensure_future(_open_pool(conninfo, min_size, max_size))
+    future = pools[conninfo]
+    try:
+        return await future
+    except Exception:
+        if pools.get(conninfo) is future:
+            del pools[conninfo]
+        raise
+
+
+async def close_pools():
+    """Closes every pool get_pool opened on the running event loop. Must be
+    awaited before the loop is closed, the connections are leaked otherwise"""
+    pools = list(_pools.pop(asyncio.get_running_loop(), {}).values())
+    for pool in pools:
+        try:
+            await (await pool).close()
+        except Exception as exc:                                        # pylint: disable=broad-except
+            LOG.warning('unable to close connection pool: %s', exc)
+
+
+class AsyncJHDBI(object):
+    """asyncio counterpart of JHDBI.
+
+    Each object holds one pooled connection from when it is connected until
+    it is closed, so concurrent work should use an object each.  Use it as an
+    async context manager, which rolls back on an exception and returns the
+    connection to the pool on exit.
+    """
+
+    def __init__(self, app_name, conninfo=None, min_size=DEFAULT_POOL_MIN_SIZE,
+                 max_size=DEFAULT_POOL_MAX_SIZE, **kwargs):
+        """Inits an AsyncJHDBI. Nothing is connected until connect_db
+
+        Args:
+            app_name: appauthal application name to use for connection to JH
+            conninfo: optional. libpq connection string used instead of the
+                connection parameters of app_name
+            min_size: optional. int. minimum connections kept in the pool
+            max_size: optional. int. maximum connections in the pool
+            **kwargs: conf is used by AsyncJHDBRecordInterface, others are ignored
+        """
+        self._app_name = app_name
+        self._conninfo = conninfo
+        self._pool_sizes = (min_size, max_size)
+        self._args = kwargs
+        self._pool = None
+        self._dbh = None
+
+    async def __aenter__(self):
+        await self._check_db_handle()
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        if exc_type and self._dbh is not None:
+            await self.rollback()
+        await self.close()
+
+    async def connect_db(self):
+        """checks a connection out of the pool for this object"""
+        if not self._conninfo:
+            # appauthal connects with psycopg2, keep that off the event loop
+            loop = asyncio.get_running_loop()
+            self._conninfo = await loop.run_in_executor(
+                None, appauthal_conninfo, self._app_name)
+        self._pool = await get_pool(self._conninfo, *self._pool_sizes)
+        self._dbh = await self._pool.getconn()
+
+    async def commit(self):
+        "Commit transaction to DB"
+        await self._dbh.commit()
+
+    async def rollback(self):
+        "Rollback transaction"
+        await self._dbh.rollback()
+
+    async def close(self):
+        "Returns the connection to the pool, which rolls back anything uncommited"
+        if self._dbh is None:
+            return
+        await self._pool.putconn(self._dbh)
+        self._dbh = None
+
+    async def _check_db_handle(self):
+        if self._dbh is None or self._dbh.closed:
+            await self.connect_db()
+
+    async def _set_session_user(self, user):
+        "Sets the jazzhands.appuser session variable for auditing"
+        dbc = await self.get_cursor()
+        await dbc.execute("SELECT set_config('jazzhands.appuser', %s, true)", (user,))
+
+    async def get_cursor(self, calling_user=None, name=None):
+        """Returns a psycopg AsyncCursor. Giving a name returns a server side
+        cursor, which only lives until the end of the current transaction"""
+        await self._check_db_handle()
+        if calling_user:
+            await self._set_session_user(calling_user)
+        if name:
+            return self._dbh.cursor(name=name)
+        return self._dbh.cursor()
+
+
+class AsyncJHDBRecordInterface(AsyncJHDBI):
+    """asyncio counterpart of JHDBRecordInterface with query_jh_record,
+    iter_jh_records and update_jh_record.
+
+    Primary keys are read from the catalog once per database and schema
+    version and looked up like JHDBRecordInterface does, falling back to
+    table_pkey_map and then to the default_pkey conf key.  The schema version
+    is the pkey_schema_version conf key or is read from the catalog once per
+    object, so objects created after DDL see the new primary keys.
+    """
+
+    DEFAULT_ITERSIZE = JHDBRecordInterface.DEFAULT_ITERSIZE
+
+    _catalog_pkeys = {}
+
+    def __init__(self, app_name, record_type=None, table_map=None, **kwargs):
+        """Inits an AsyncJHDBRecordInterface
+
+        Args:
+            app_name: appauthal application name to use for connection to JH
+            record_type: optional. JHRecord type
+            table_map: optional. table_map dictionary. see set_table_map
+        """
+        super(AsyncJHDBRecordInterface, self).__init__(app_name, **kwargs)
+        self.record_type = record_type
+        self._table_map = table_map
+        self._pkeys_map = None
+
+    def set_table_map(self, table_map=None):
+        """Sets the attribute map. see JHDBRecordInterface.set_table_map"""
+        self._table_map = table_map
+
+    async def query_jh_record(self, qry, record_type=None):
+        """Queries JH and returns a set of JHRecords
+
+        Args:
+            qry: String. The query you wish to execute, column names must
+                match attribute names in the output JHRecord
+            record_type: Optional string. object type of the JHRecords to
+                be created. defaults to one set during init
+
+        Returns:
+            A set of JHRecords using the values returned from the query
+        """
+        rec_factory = await self._get_record_factory(record_type or self.record_type)
+        dbc = await self.get_cursor()
+        await dbc.execute(qry)
+        records = set(rec_factory.create_many(await dbc.fetchall()))
+        await dbc.close()
+        await self.commit()
+        return records
+
+    async def iter_jh_records(self, qry, record_type=None, itersize=None):
+        """Queries JH with a server side cursor and yields lists of JHRecords
+        as the rows arrive, itersize rows at a time. The transaction is
+        commited once all rows have been read
+
+        Args:
+            qry: String. The query you wish to execute, column names must
+                match attribute names in the output JHRecord
+            record_type: Optional string. object type of the JHRecords to
+                be created. defaults to one set during init
+            itersize: Optional int. rows fetched from the server per round trip.
+                defaults to DEFAULT_ITERSIZE
+        """
+        itersize = itersize or self.DEFAULT_ITERSIZE
+        rec_factory = await self._get_record_factory(record_type or self.record_type)
+        dbc = await self.get_cursor(name='jh_recsync_async_{}'.format(next(_cursor_names)))
+        try:
+            await dbc.execute(qry)
+            while True:
+                rows = await dbc.fetchmany(itersize)
+                if not rows:
+                    break
+                yield rec_factory.create_many(rows)
+        finally:
+            await dbc.close()
+        await self.commit()
+
+    async def update_jh_record(self, rec, table_map=None, pkeys_arr=None, calling_user=None):
+        """Updates JHRecord in JH. see JHDBRecordInterface.update_jh_record
+
+        Args:
+            rec: JHRecord with the attrs you wish to update.
+            table_map: optional. dictionary. see set_table_map.
+            pkeys_arr: optional. list of primary key columns used for every table
+            calling_user: optional. to be used when user initating action is not the db user
+        """
+        if not self._table_map and not table_map:
+            raise JHDBIException('You must set the table_map')
+        tmap = table_map if table_map else self._table_map
+        upd = JHDBRecordInterface._get_table_upd_dict(rec, tmap)         # pylint: disable=protected-access
+        dbc = await self.get_cursor(calling_user)
+        for table, avt in upd.items():
+            pkeys = list(pkeys_arr) if pkeys_arr else await self._get_table_pkeys(table)
+            fqry, val_arr = update_query(table, avt, rec, pkeys)
+            await dbc.execute(fqry, val_arr)
+            if dbc.rowcount != 1:
+                await self.rollback()
+                raise JHDBIException('update of {} effected {} rows.'.format(
+                    table, dbc.rowcount))
+
+    async def _get_record_factory(self, record_type):
+        """Returns a JHRecordFactory for record_type, querying JH for the
+        definition if it has not been cached"""
+        rec_def = JHRecordFactory.get_cached_definition(record_type)
+        if not rec_def:
+            dbc = await self.get_cursor()
+            await dbc.execute(
+                'SELECT feed_recsynclib.get_record_definition(%s)', (record_type,))
+            row = await dbc.fetchone()
+            if row[0] is None:
+                raise JHDBIException('no jh-recsynclib_rec_def found for {}'.format(record_type))
+            rec_def = row[0]
+            JHRecordFactory.cache_definition(record_type, rec_def)
+        return JHRecordFactory(record_type, rec_def=rec_def)
+
+    async def _get_table_pkeys(self, t_name):
+        """Returns the primary key columns of t_name from the catalog, the
+        static table_pkey_map or the default_pkey conf key, in that order"""
+        if self._pkeys_map is None:
+            self._pkeys_map = await self._load_catalog_pkeys()
+        pkeys = list(self._pkeys_map.get(t_name) or [])
+        if not pkeys:
+            from jh_recsynclib.table_pkeys_map import table_pkeys_map
+            pkeys = list(table_pkeys_map.get(t_name, []))
+        if not pkeys:
+            default_pkey = (self._args.get('conf') or {}).get('default_pkey')
+            if not default_pkey:
+                raise JHDBIException('No primary key found for table {}'.format(t_name))
+            pkeys = [default_pkey]
+        return pkeys
+
+    async def _load_catalog_pkeys(self):
+        """Returns the primary keys of the catalog for the current schema
+        version, only querying them if no other object already has"""
+        version = (self._args.get('conf') or {}).get('pkey_schema_version')
+        if not version:
+            dbc = await self.get_cursor()
+            await dbc.execute(SCHEMA_VERSION_QRY)
+            version = (await dbc.fetchone())[0]
+        key = (self._conninfo, version)
+        if key not in self._catalog_pkeys:
+            dbc = await self.get_cursor()
+            await dbc.execute(PRIMARY_KEYS_QRY)
+            self._catalog_pkeys[key] = pkeys_from_rows(await dbc.fetchall())
+        return self._catalog_pkeys[key]
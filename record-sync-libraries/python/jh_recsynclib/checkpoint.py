@@ -0,0 +1,246 @@
+# Copyright 2017 Ryan D. Williams
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Sync checkpoints
+
+Persists the progress of a partial update changes sync so that an
+interrupted run can resume with the records it had not applied yet.
+"""
+
+__author__ = 'Ryan D. Williams <rdw@drws-office.com>'
+
+# Standard library imports
+import os
+import json
+import zlib
+import hashlib
+import logging
+
+from builtins import str as text
+
+
+LOG = logging.getLogger(__name__)
+
+CHECKPOINT_VERSION = 2
+
+
+def record_key(record):
+    """Returns a stable string representation of a JHRecord primary key.
+
+    Composite keys are emitted as JSON lists so the result can be stored
+    and compared between runs.
+    """
+    return json.dumps(record.primary_key, default=text)
+
+
+def fingerprint_records(records, exclude_keys=None):
+    """Computes an order independent digest of a set of JHRecords.
+
+    Each record is checksummed on its own and the checksums are summed, so
+    the dataset never has to be sorted. Only attributes found in the record
+    template are included, which matches the way records are compared
+    during a sync. This detects a changed dataset, it is not a secure hash.
+
+    Args:
+        records: sequence of JHRecords
+        exclude_keys: optional. set of record_key strings to leave out
+
+    Returns:
+        string of the record count and checksum sum
+    """
+    exclude_keys = exclude_keys or set()
+    count = total = 0
+    for record in records:
+        key = record_key(record)
+        if key in exclude_keys:
+            continue
+        line = key + json.dumps(sorted(record.items()), default=text)
+        total += zlib.crc32(line.encode('utf-8')) & 0xffffffff
+        count += 1
+    return '{}:{:x}'.format(count, total)
+
+
+class SyncCheckpoint(object):
+    """Tracks committed changes of a changes sync in a local file.
+
+    The file is a JSON document per line.  The first line describes the
+    planned change set and the fingerprints of the datasets it was
+    computed from, every following line records one change that has been
+    committed to the destination.
+
+    Example:
+        ckpt = SyncCheckpoint('/var/tmp/ldap_user.ckpt')
+        pending = ckpt.resume(src, dst, operations)
+        if pending is None:
+            ckpt.begin(src, dst, operations, adds, rms, mods)
+        ckpt.mark_done('add', rec)
+        ckpt.flush()
+        ckpt.clear()
+    """
+
+    def __init__(self, path, fsync=False):
+        """Inits a SyncCheckpoint
+
+        Args:
+            path: string. location of the checkpoint file
+            fsync: bool. sync the file to disk on every flush. without it a
+                checkpoint survives the sync being killed but not the host
+                going down
+        """
+        self.path = path
+        self._fsync = fsync
+        self._pending = []
+        self._source_fingerprint = (None, None)
+
+    def begin(self, source, dest, operations, adds, rms, mods):
+        """Records a new change set, replacing any existing checkpoint.
+
+        Args:
+            source: set of source JHRecords
+            dest: set of destination JHRecords
+            operations: sequence of operations requested for the run
+            adds: set of JHRecords to add
+            rms: set of JHRecords to remove
+            mods: set of (source, destination) JHRecord tuples to modify
+        """
+        changes = {
+            'add': sorted(record_key(rec) for rec in adds),
+            'remove': sorted(record_key(rec) for rec in rms),
+            'modify': sorted(record_key(s_rec) for s_rec, _ in mods)}
+        header = {
+            'version': CHECKPOINT_VERSION,
+            'operations': sorted(operations),
+            'changes': changes,
+            'change_digest': self._change_digest(changes)}
+        header.update(self._fingerprints(source, dest, changes))
+        self._source_fingerprint = (None, None)
+        self._pending = []
+        tmp_path = '{}.tmp'.format(self.path)
+        with open(tmp_path, 'w') as _fh:
+            _fh.write(json.dumps(header) + '\n')
+            _fh.flush()
+            os.fsync(_fh.fileno())
+        os.rename(tmp_path, self.path)
+        LOG.debug('checkpoint started at %s. change_digest: %s', self.path, header['change_digest'])
+
+    def resume(self, source, dest, operations):
+        """Loads the remaining change set if the checkpoint matches the datasets.
+
+        Args:
+            source: set of source JHRecords
+            dest: set of destination JHRecords
+            operations: sequence of operations requested for the run
+
+        Returns:
+            tuple of (adds, rms, mods) still to be applied or None if there is
+            no usable checkpoint
+        """
+        header, completed = self._load()
+        if not header:
+            return None
+        if header.get('version') != CHECKPOINT_VERSION or \
+                header['operations'] != sorted(operations):
+            LOG.info('checkpoint at %s does not match this run. ignoring', self.path)
+            return None
+        changes = header['changes']
+        if self._change_digest(changes) != header['change_digest']:
+            LOG.warning('checkpoint at %s is corrupt. ignoring', self.path)
+            return None
+        if self._fingerprints(source, dest, changes) != {
+                'source_fingerprint': header['source_fingerprint'],
+                'destination_fingerprint': header['destination_fingerprint']}:
+            LOG.info('datasets changed since checkpoint at %s was taken. ignoring', self.path)
+            return None
+        s_pk_dict = {record_key(rec): rec for rec in source}
+        d_pk_dict = {record_key(rec): rec for rec in dest}
+        try:
+            adds = {s_pk_dict[key] for key in changes['add'] if key not in completed['add']}
+            rms = {d_pk_dict[key] for key in changes['remove'] if key not in completed['remove']}
+            mods = {
+                (s_pk_dict[key], d_pk_dict[key])
+                for key in changes['modify'] if key not in completed['modify']}
+        except KeyError:
+            LOG.warning('checkpoint at %s references unknown records. ignoring', self.path)
+            return None
+        self._source_fingerprint = (None, None)
+        LOG.info(
+            'resuming from checkpoint %s. %s of %s changes already applied', self.path,
+            sum(len(keys) for keys in completed.values()),
+            sum(len(keys) for keys in changes.values()))
+        return adds, rms, mods
+
+    def mark_done(self, opr, record):
+        """Queues a change as complete. Written to disk on the next flush"""
+        self._pending.append({'op': opr, 'key': record_key(record)})
+
+    def flush(self):
+        """Appends changes marked as done to the checkpoint file. Should
+        only be called once those changes are commited"""
+        if not self._pending:
+            return
+        with open(self.path, 'a') as _fh:
+            for entry in self._pending:
+                _fh.write(json.dumps(entry) + '\n')
+            if self._fsync:
+                _fh.flush()
+                os.fsync(_fh.fileno())
+        self._pending = []
+
+    def discard(self):
+        """Forgets changes marked as done that have not been flushed"""
+        self._pending = []
+
+    def clear(self):
+        """Removes the checkpoint file"""
+        self._pending = []
+        if os.path.exists(self.path):
+            os.remove(self.path)
+            LOG.debug('removed checkpoint %s', self.path)
+
+    def _load(self):
+        """Returns the header and completed keys from the checkpoint file"""
+        completed = {'add': set(), 'remove': set(), 'modify': set()}
+        if not os.path.exists(self.path):
+            return None, completed
+        with open(self.path, 'r') as _fh:
+            try:
+                header = json.loads(_fh.readline())
+                for line in _fh:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # a partially written trailing line. anything after it is lost
+                        break
+                    completed[entry['op']].add(entry['key'])
+            except (ValueError, KeyError):
+                LOG.warning('unable to read checkpoint %s. ignoring', self.path)
+                return None, completed
+        return header, completed
+
+    @staticmethod
+    def _change_digest(changes):
+        return hashlib.sha1(json.dumps(changes, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _fingerprints(self, source, dest, changes):
+        """The destination fingerprint leaves out the records in the change
+        set as these are the ones this sync writes to. The source fingerprint
+        is kept so a begin after a failed resume does not compute it again"""
+        changed = set(changes['add']) | set(changes['remove']) | set(changes['modify'])
+        fingerprinted, source_fingerprint = self._source_fingerprint
+        if fingerprinted is not source:
+            source_fingerprint = fingerprint_records(source)
+            self._source_fingerprint = (source, source_fingerprint)
+        return {
+            'source_fingerprint': source_fingerprint,
+            'destination_fingerprint': fingerprint_records(dest, changed)}
@@ -0,0 +1,149 @@
+# Copyright 2017 Ryan D. Williams
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Long running syncs
+
+Runs a sync on an interval in a single process so connections, record
+definitions and validators stay loaded between runs.
+"""
+
+__author__ = 'Ryan D. Williams <rdw@drws-office.com>'
+
+# Standard library imports
+import os
+import json
+import time
+import signal
+import logging
+import threading
+
+
+LOG = logging.getLogger(__name__)
+
+
+class SyncDaemon(object):
+    """Runs SyncBase.run_sync on an interval.
+
+    The sync object is created once and reused for every run.  SIGHUP
+    reloads the sync configuration file before the next run, SIGTERM and
+    SIGINT stop the daemon once the current run is done.  After every run
+    the health of the daemon is logged and, if health_file is given, written
+    to that file as JSON.
+
+    Example:
+        args = SyncOptions().parse_opts()
+        daemon = SyncDaemon(DeptSync(args), interval=60,
+                            health_file='/var/run/dept_sync.health')
+        daemon.run()
+    """
+
+    def __init__(self, sync, interval, health_file=None, sync_type=None,
+                 operations=('add', 'remove', 'modify')):
+        """Inits a SyncDaemon
+
+        Args:
+            sync: SyncBase object to run
+            interval: int. seconds between the start of two runs. a run that
+                takes longer than this is followed by the next one immediately
+            health_file: optional. path the health report is written to
+            sync_type: optional. passed to SyncBase.run_sync
+            operations: optional. passed to SyncBase.run_sync
+        """
+        self._sync = sync
+        self._interval = interval
+        self._health_file = health_file
+        self._run_kwargs = {'sync_type': sync_type, 'operations': operations}
+        self._wake = threading.Event()
+        self._stopping = False
+        self._reload = False
+        self.health = {
+            'state': 'starting',
+            'pid': os.getpid(),
+            'runs': 0,
+            'failures': 0,
+            'consecutive_failures': 0,
+            'last_run_start': None,
+            'last_run_seconds': None,
+            'last_success': None,
+            'last_error': None}
+
+    def run(self, max_runs=None, handle_signals=True):
+        """Runs the sync until stopped.
+
+        Args:
+            max_runs: optional. int. stop after this many runs
+            handle_signals: bool. install SIGHUP, SIGTERM and SIGINT handlers.
+                only possible from the main thread
+        """
+        if handle_signals:
+            signal.signal(signal.SIGHUP, lambda signum, frame: self.reload())
+            signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+            signal.signal(signal.SIGINT, lambda signum, frame: self.stop())
+        next_run = time.time()
+        while not self._stopping:
+            if self._reload:
+                self._reload = False
+                self._sync.reload_conf()
+            self._wake.clear()
+            start = time.time()
+            self._run_once(start)
+            if max_runs and self.health['runs'] >= max_runs:
+                break
+            next_run = max(next_run + self._interval, time.time())
+            self._set_state('sleeping')
+            while not self._stopping and not self._reload and time.time() < next_run:
+                self._wake.wait(next_run - time.time())
+        self._set_state('stopped')
+
+    def reload(self):
+        """Reloads the sync configuration before the next run. Starts that run
+        right away"""
+        LOG.info('reload requested')
+        self._reload = True
+        self._wake.set()
+
+    def stop(self):
+        """Stops the daemon once the current run completes"""
+        LOG.info('stop requested')
+        self._stopping = True
+        self._wake.set()
+
+    def _run_once(self, start):
+        self.health['last_run_start'] = start
+        self._set_state('running')
+        try:
+            self._sync.run_sync(**self._run_kwargs)
+        except Exception as exc:                                        # pylint: disable=broad-except
+            LOG.error('sync run failed: %s', exc)
+            self.health['failures'] += 1
+            self.health['consecutive_failures'] += 1
+            self.health['last_error'] = str(exc)
+        else:
+            self.health['consecutive_failures'] = 0
+            self.health['last_success'] = time.time()
+        self.health['runs'] += 1
+        self.health['last_run_seconds'] = round(time.time() - start, 3)
+        LOG.info('sync health: %s', json.dumps(self.health, sort_keys=True))
+
+    def _set_state(self, state):
+        self.health['state'] = state
+        if not self._health_file:
+            return
+        tmp_file = '{}.tmp'.format(self._health_file)
+        try:
+            with open(tmp_file, 'w') as _fh:
+                json.dump(self.health, _fh, sort_keys=True)
+            os.rename(tmp_file, self._health_file)
+        except (IOError, OSError) as exc:
+            LOG.warning('unable to write health file %s: %s', self._health_file, exc)
@@ -20,51 +20,269 @@ Classes for interacting with JazzHands database
 __author__ = 'Ryan D. Williams <rdw@drws-office.com>'
 
 # Standard library imports
-from copy import deepcopy
+import io
+import re
+import json
+import logging
+import itertools
+from collections import OrderedDict
+from copy import copy, deepcopy
 
 # Third-party imports
+from builtins import str as text
 from jazzhands_appauthal.db import DatabaseConnection
+from psycopg2.extensions import cursor as tuple_cursor
+from psycopg2.extras import execute_values
 
 # Local imports
+from jh_recsynclib.pkeys import PrimaryKeyResolver
+from jh_recsynclib.pool import POOL
 from jh_recsynclib.utils import JHRecordFactory
 
-from .table_pkeys_map import table_pkeys_map
+LOG = logging.getLogger(__name__)
+
+_cursor_names = itertools.count()
+
+# quoted literals and identifiers, escaped percent signs and placeholders
+_PLACEHOLDERS = re.compile(r"""'(?:[^']|'')*'|"(?:[^"]|"")*"|%%|%s""")
+
+
+def _array_literal(values):
+    """Formats a list as a PostgreSQL array literal, nested lists becoming
+    multidimensional arrays"""
+    items = []
+    for value in values:
+        if value is None:
+            items.append(u'NULL')
+        elif isinstance(value, (list, tuple)):
+            items.append(_array_literal(value))
+        else:
+            if isinstance(value, bool):
+                value = u't' if value else u'f'
+            elif isinstance(value, dict):
+                value = json.dumps(value)
+            items.append(u'"{}"'.format(
+                text(value).replace(u'\\', u'\\\\').replace(u'"', u'\\"')))
+    return u'{' + u','.join(items) + u'}'
+
+
+def _copy_value(value):
+    """Formats a value for COPY text format"""
+    if value is None:
+        return u'\\N'
+    if isinstance(value, bool):
+        return u't' if value else u'f'
+    if isinstance(value, dict):
+        value = json.dumps(value)
+    elif isinstance(value, (list, tuple)):
+        value = _array_literal(value)
+    return text(value).replace(u'\\', u'\\\\').replace(u'\t', u'\\t').replace(
+        u'\n', u'\\n').replace(u'\r', u'\\r')
+
+def _number_placeholders(qry):
+    """Rewrites the %s placeholders of a psycopg2 query to the $n ones used
+    by PREPARE.  %% becomes %, a %s inside quotes is left as it is"""
+    nums = itertools.count(1)
+
+    def _replace(match):
+        token = match.group(0)
+        if token == '%s':
+            return '${}'.format(next(nums))
+        return token.replace('%%', '%')
+    return _PLACEHOLDERS.sub(_replace, qry)
+
+
+def update_query(table, avt, rec, pkeys):
+    """Returns the UPDATE of table setting the attribute/value tuples avt
+    for the row of rec matched on pkeys, and its parameters"""
+    qry = 'UPDATE {t_name} SET {a_names} = {vals} WHERE {w}'
+    val_arr = []
+    if len(avt) == 1:
+        atr_str = avt[0][0]
+        val_str = '%s'
+        val_arr.append(avt[0][1])
+    else:
+        atr_str = '(' + ','.join((i[0] for i in avt)) + ')'
+        val_str = '(' + ('%s,'*len(avt))[:-1] + ')'
+        val_arr += [i[1] for i in avt]
+    if len(pkeys) == 1:
+        pkey = pkeys[0]
+        w_str = '{} = %s'.format(pkey)
+        val_arr.append(rec[pkey])
+    else:
+        w_l = []
+        for pkey in pkeys:
+            w_l.append('{} = %s'.format(pkey))
+            val_arr.append(rec[pkey])
+        w_str = ' AND '.join(w_l)
+    fqry = qry.format(t_name=table, a_names=atr_str, vals=val_str, w=w_str)
+    return fqry, val_arr
+
+
+class PreparedStatementCache(object):
+    """LRU cache of server side prepared statements.
+
+    Statements are keyed by their SQL text, which for generated statements
+    encodes the table, the changed columns and the key columns, and are
+    prepared on first use.  Once max_size statements are prepared the least
+    recently used one is deallocated.  Prepared statements belong to a
+    database session so reset must be called whenever the connection changes.
+
+    Example:
+        cache = PreparedStatementCache(50)
+        cache.execute(dbc, 'UPDATE person SET name = %s WHERE person_id = %s', ['x', 1])
+        cache.stats
+        # {'hits': 0, 'misses': 1, 'evictions': 0}
+    """
+
+    _ids = itertools.count()
+
+    def __init__(self, max_size=100):
+        """Inits a PreparedStatementCache
+
+        Args:
+            max_size: int. max number of statements kept prepared
+        """
+        self.max_size = max_size
+        self._prefix = 'jh_recsync_ps{}_'.format(next(self._ids))
+        self._names = itertools.count()
+        self._statements = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def __len__(self):
+        return len(self._statements)
+
+    def execute(self, dbc, qry, params):
+        """Executes qry with params on cursor dbc as a prepared statement
+
+        Args:
+            dbc: DB cursor
+            qry: string. query using %s placeholders
+            params: sequence of parameter values
+        """
+        name = self._statements.pop(qry, None)
+        if name:
+            self.stats['hits'] += 1
+        else:
+            self.stats['misses'] += 1
+            if len(self._statements) >= self.max_size:
+                _, old = self._statements.popitem(last=False)
+                dbc.execute('DEALLOCATE {}'.format(old))
+                self.stats['evictions'] += 1
+            name = '{}{}'.format(self._prefix, next(self._names))
+            dbc.execute('PREPARE {} AS {}'.format(name, _number_placeholders(qry)))
+        self._statements[qry] = name
+        if params:
+            dbc.execute('EXECUTE {} ({})'.format(name, ', '.join(['%s'] * len(params))), params)
+        else:
+            dbc.execute('EXECUTE {}'.format(name))
+
+    def deallocate(self, dbc):
+        """Deallocates all statements prepared by this cache"""
+        for name in self._statements.values():
+            dbc.execute('DEALLOCATE {}'.format(name))
+        self._statements.clear()
+
+    def reset(self):
+        """Forgets all statements, for use after the connection changed"""
+        self._statements.clear()
+
 
 class JHDBI(object):
     """This class contains all the functions for interacting with JazzHands"""
 
-    def __init__(self, app_name, **kwargs):
+    def __init__(self, app_name, connection_factory=None, pool=POOL, **kwargs):
         """kwargs can represent additional options passed to DB driver.
-        kwargs are stored with this object and used for all subsequent connects"""
+        kwargs are stored with this object and used for all subsequent connects
+
+        connection_factory is an optional callable taking the app_name and the
+        driver kwargs and returning a connection. Used to share connections
+        between syncs. Otherwise connections are checked out of pool, the
+        process wide ConnectionPool by default, and checked back in on close.
+        Pass pool=None to connect through appauthal directly"""
         self._app_name = app_name
         self._appauthal_db = DatabaseConnection(self._app_name)
+        self._connection_factory = connection_factory
+        self._pool = pool
         self._args = kwargs
+        self._savepoints = set()
+        self._dbh = None
+        self.statement_cache = None
         self.connect_db()
 
     def connect_db(self):
         """connects to the db and stores the handle in a private variable"""
-        self._dbh = self._appauthal_db.connect(**self._args)
+        if self.statement_cache:
+            self.statement_cache.reset()
+        if self._connection_factory:
+            self._dbh = self._connection_factory(self._app_name, **self._args)
+        elif self._pool:
+            self._dbh = self._pool.checkout(self._app_name, **self._args)
+        else:
+            self._dbh = self._appauthal_db.connect(**self._args)
 
     def copy(self):
-        """copies this connection and initiates new handle"""
-        new_db = deepcopy(self)
+        """copies this object with a connection of its own"""
+        new_db = copy(self)
+        new_db._args = deepcopy(self._args)
+        new_db._savepoints = set()
+        if self.statement_cache:
+            new_db.statement_cache = PreparedStatementCache(self.statement_cache.max_size)
         new_db.connect_db()
         return new_db
 
     def commit(self):
         "Commit transaction to DB"
         self._dbh.commit()
+        self._savepoints.clear()
 
     def rollback(self):
         "Rollback transaction"
         self._dbh.rollback()
+        self._savepoints.clear()
+
+    def savepoint(self, name):
+        """Sets a savepoint in the current transaction. A savepoint of the
+        same name set earlier in the transaction is released in the same round
+        trip so they do not pile up"""
+        dbc = self.get_cursor()
+        if name in self._savepoints:
+            dbc.execute('RELEASE SAVEPOINT {0}; SAVEPOINT {0}'.format(name))
+        else:
+            dbc.execute('SAVEPOINT {}'.format(name))
+        self._savepoints.add(name)
+
+    def rollback_to_savepoint(self, name):
+        "Rolls back the current transaction to the savepoint. The savepoint stays set"
+        dbc = self.get_cursor()
+        dbc.execute('ROLLBACK TO SAVEPOINT {}'.format(name))
+
+    def release_savepoint(self, name):
+        "Releases the savepoint, keeping the changes made since it was set"
+        dbc = self.get_cursor()
+        dbc.execute('RELEASE SAVEPOINT {}'.format(name))
+        self._savepoints.discard(name)
 
     def close(self):
-        "Close Connection to DB"
-        self._dbh.close()
+        "Close Connection to DB. Pooled connections are returned to the pool"
+        if self._dbh is None:
+            return
+        if self._pool and not self._connection_factory:
+            if self.statement_cache and not self._dbh.closed:
+                # the connection outlives this object, its statements should not
+                try:
+                    self._dbh.rollback()
+                    self.statement_cache.deallocate(self._dbh.cursor())
+                except Exception:                                       # pylint: disable=broad-except
+                    self._dbh.close()
+            self._pool.checkin(self._dbh)
+        else:
+            self._dbh.close()
+        self._dbh = None
 
     def _check_db_handle(self):
-        if self._dbh.closed:
+        if self._dbh is None or self._dbh.closed:
+            self._savepoints.clear()
             self.connect_db()
 
     def _set_session_user(self, user):
@@ -72,21 +290,47 @@ class JHDBI(object):
         dbc = self.get_cursor()
         dbc.execute('SET LOCAL jazzhands.appuser TO %s', (user,))
 
-    def get_cursor(self, calling_user=None):
-        "Returns a psycopg2 DB cursor"
+    def get_cursor(self, calling_user=None, name=None, tuple_rows=False):
+        """Returns a psycopg2 DB cursor. Giving a name returns a server side
+        cursor, which only lives until the end of the current transaction.
+        With tuple_rows the cursor returns plain tuples instead of the rows
+        of the connection's cursor factory"""
         self._check_db_handle()
         if calling_user:
             self._set_session_user(calling_user)
-        return self._dbh.cursor()
+        kwargs = {'cursor_factory': tuple_cursor} if tuple_rows else {}
+        if name:
+            return self._dbh.cursor(name=name, **kwargs)
+        return self._dbh.cursor(**kwargs)
 
 
 class JHDBRecordInterface(JHDBI):
     """Superclass of JHDBI adding helper functions for working with
     JHRecords"""
 
+    DEFAULT_ITERSIZE = 2000
+
     def __init__(self, app_name, record_type=None, table_map=None, **kwargs):
         """Inits a JHDBRecordInterface.
 
+        With prepared_statement_cache_size set in the conf kwarg, the UPDATE
+        statements of update_jh_record are run as server side prepared
+        statements, at most that many at a time. see PreparedStatementCache.
+        Hit and miss counts are in self.statement_cache.stats
+
+        Primary keys come from a PrimaryKeyResolver, cached on disk in the
+        pkey_cache_dir conf directory if set and keyed by pkey_schema_version
+        if set. Without pkey_schema_version every process reads the schema
+        version from the catalog once. Tables it does not know fall back to
+        table_pkey_map and then to the default_pkey conf key
+
+        With tuple_rows set in the conf kwarg, query_jh_record and
+        iter_jh_records fetch plain tuples and build the records from the
+        column names of the result instead of from DictRows
+
+        With combine_table_updates set in the conf kwarg, a record spanning
+        several tables is updated with a single statement. see update_jh_record
+
         Args:
             app_name: appauthal application name to use for connection to JH
             record_type: optional. JHRecord type
@@ -95,11 +339,34 @@ class JHDBRecordInterface(JHDBI):
         self.record_type = record_type
         self._table_map = None
         self.set_table_map(table_map)
-        self.table_pkey_map = table_pkeys_map
+        self._table_pkey_map = None
+        self._column_types = {}
         kwargs.update({
             'psycopg2_cursor_factory': 'DictCursor'
         })
         super(JHDBRecordInterface, self).__init__(app_name, **kwargs)
+        conf = self._args.get('conf') or {}
+        cache_size = conf.get('prepared_statement_cache_size')
+        if cache_size:
+            self.statement_cache = PreparedStatementCache(cache_size)
+        self.combine_table_updates = bool(conf.get('combine_table_updates'))
+        self.tuple_rows = bool(conf.get('tuple_rows'))
+        self.pkey_resolver = PrimaryKeyResolver(
+            self, cache_dir=conf.get('pkey_cache_dir'),
+            schema_version=conf.get('pkey_schema_version'))
+
+    @property
+    def table_pkey_map(self):
+        """Static map of table names to primary keys. It is large so it is only
+        imported the first time a table is not found in the catalog"""
+        if self._table_pkey_map is None:
+            from jh_recsynclib.table_pkeys_map import table_pkeys_map
+            self._table_pkey_map = table_pkeys_map
+        return self._table_pkey_map
+
+    @table_pkey_map.setter
+    def table_pkey_map(self, value):
+        self._table_pkey_map = value
 
     def set_table_map(self, table_map=None):
         """Sets the attribute map
@@ -122,7 +389,7 @@ class JHDBRecordInterface(JHDBI):
         """
         self._table_map = table_map
 
-    def query_jh_record(self, qry, record_type=None):
+    def query_jh_record(self, qry, record_type=None, tuple_rows=None):
         """Queries JH and returns a set of JHRecords
 
         Args:
@@ -130,21 +397,95 @@ class JHDBRecordInterface(JHDBI):
                 match attribute names in the output JHRecord
             record_type: Optional string. object type of the JHRecords to
                 be created. defaults to one set during init
+            tuple_rows: Optional bool. fetch plain tuples and build the records
+                positionally, skipping the DictRow of each row. defaults to the
+                tuple_rows conf key
 
         Returns:
             A set of JHRecords using the values returned from the query
         """
         if not record_type:
             record_type = self.record_type
-        dbc = self.get_cursor()
+        if tuple_rows is None:
+            tuple_rows = self.tuple_rows
+        dbc = self.get_cursor(tuple_rows=tuple_rows)
         dbc.execute(qry)
-        new_dbh = JHDBRecordInterface(self._app_name, record_type=self.record_type, table_map=self._table_map)
-        rec_factory = JHRecordFactory(record_type, db_handle=new_dbh)
-        records = {rec_factory.create(row) for row in dbc.fetchall()}
+        rec_factory = self._get_record_factory(record_type)
+        records = set(rec_factory.create_many(dbc.fetchall(), self._row_columns(dbc, tuple_rows)))
         dbc.close()
         self.commit()
         return records
 
+    def iter_jh_records(self, qry, record_type=None, itersize=None, batch_size=None,
+                        tuple_rows=None):
+        """Queries JH with a server side cursor and yields JHRecords as the
+        rows arrive, so only itersize rows are held by the driver at a time.
+
+        The cursor lives in the current transaction, nothing else should
+        commit or rollback on this handle until the iteration is done. The
+        transaction is commited once all rows have been read.
+
+        Args:
+            qry: String. The query you wish to execute, column names must
+                match attribute names in the output JHRecord
+            record_type: Optional string. object type of the JHRecords to
+                be created. defaults to one set during init
+            itersize: Optional int. rows fetched from the server per round trip.
+                defaults to DEFAULT_ITERSIZE
+            batch_size: Optional int. yield lists of this many JHRecords instead
+                of single records
+            tuple_rows: Optional bool. see query_jh_record
+
+        Yields:
+            JHRecords, or lists of JHRecords if batch_size is given
+        """
+        if not record_type:
+            record_type = self.record_type
+        itersize = itersize or self.DEFAULT_ITERSIZE
+        if tuple_rows is None:
+            tuple_rows = self.tuple_rows
+        rec_factory = self._get_record_factory(record_type)
+        dbc = self.get_cursor(
+            name='jh_recsync_{}'.format(next(_cursor_names)), tuple_rows=tuple_rows)
+        dbc.itersize = itersize
+        try:
+            dbc.execute(qry)
+            columns = None
+            while True:
+                rows = dbc.fetchmany(batch_size or itersize)
+                if not rows:
+                    break
+                # a named cursor only has a description once rows were fetched
+                if columns is None:
+                    columns = self._row_columns(dbc, tuple_rows)
+                records = rec_factory.create_many(rows, columns)
+                if batch_size:
+                    yield records
+                else:
+                    for record in records:
+                        yield record
+        finally:
+            dbc.close()
+        self.commit()
+
+    @staticmethod
+    def _row_columns(dbc, tuple_rows):
+        """Returns the column names of the current result of dbc when it
+        returns tuples, None when its rows carry their own column names"""
+        if not tuple_rows:
+            return None
+        return [column[0] for column in dbc.description]
+
+    def _get_record_factory(self, record_type):
+        """Returns a JHRecordFactory for record_type. Only queries JH for
+        the definition if it has not been cached by an earlier factory. The
+        factory closes the handle it is given, so it gets a copy, which takes a
+        pooled connection"""
+        rec_def = JHRecordFactory.get_cached_definition(record_type)
+        if rec_def:
+            return JHRecordFactory(record_type, rec_def=rec_def)
+        return JHRecordFactory(record_type, db_handle=self.copy())
+
     def update_jh_record(self, rec, table_map=None, pkeys_arr=None, calling_user=None):
         """Updates JHRecord in JH
 
@@ -152,6 +493,16 @@ class JHDBRecordInterface(JHDBI):
         set the table map at init, using the set_table_map method or just
         supply one when calling this function
 
+        With combine_table_updates, a record spanning several tables is
+        written with one statement whose data-modifying CTEs update each
+        table, instead of a round trip per table.  The tables are updated from
+        the same snapshot, so triggers on one table that update another one of
+        the record's tables are not seen by its CTE.
+
+        A JHDBIException is raised if a table did not have exactly one row
+        updated. The transaction is rolled back first unless a savepoint is
+        set, in which case the caller rolls back to it.
+
         Args:
             rec: JHRecord with the attrs you wish to update.
             table_map: optional. dictionary. see set_table_map.
@@ -165,21 +516,319 @@ class JHDBRecordInterface(JHDBI):
         tmap = table_map if table_map else self._table_map
         upd = self._get_table_upd_dict(rec, tmap)
         dbc = self.get_cursor(calling_user)
-        for table, avt in upd.items():
-            # call _prep_qry to get primary keys from the pkeys_arr or the db
-            # otherwise default to the table_pkeys_lookup table
+        if self.combine_table_updates and len(upd) > 1:
             try:
-                fqry, val_arr = self._prep_qry(table, avt, rec, pkeys_arr)
-            except Exception:
-                try:
-                    table_pkeys_lookup = self.table_pkey_map[table]
-                    fqry, val_arr = self._prep_qry(table, avt, rec, table_pkeys_lookup=table_pkeys_lookup)
-                except KeyError:
-                    raise JHDBIException('Table name not found in table_pkey_map') 
-            dbc.execute(fqry, val_arr)
+                self._update_combined(dbc, upd, rec, pkeys_arr)
+            except JHDBIException:
+                if not self._savepoints:
+                    self.rollback()
+                raise
+            return
+        for table, avt in upd.items():
+            fqry, val_arr = self._prep_qry(table, avt, rec, pkeys_arr)
+            if self.statement_cache:
+                self.statement_cache.execute(dbc, fqry, val_arr)
+            else:
+                dbc.execute(fqry, val_arr)
             if dbc.rowcount != 1:
+                # within a savepoint the caller rolls back to it, a full
+                # rollback would undo the records applied before this one
+                if not self._savepoints:
+                    self.rollback()
+                raise JHDBIException('update of {} effected {} rows.'.format(
+                    table, dbc.rowcount))
+
+    def _update_combined(self, dbc, upd, rec, pkeys_arr=None):
+        """Updates every table of rec with one statement, one CTE per table,
+        and checks that each CTE updated exactly one row. Nothing is rolled
+        back when one did not"""
+        tables = sorted(upd)
+        ctes = []
+        vals = []
+        for num, table in enumerate(tables):
+            fqry, val_arr = self._prep_qry(table, upd[table], rec, pkeys_arr)
+            ctes.append('u{} AS ({} RETURNING 1)'.format(num, fqry))
+            vals += val_arr
+        qry = 'WITH {} SELECT {}'.format(', '.join(ctes), ', '.join(
+            '(SELECT count(*) FROM u{})'.format(num) for num in range(len(tables))))
+        if self.statement_cache:
+            self.statement_cache.execute(dbc, qry, vals)
+        else:
+            dbc.execute(qry, vals)
+        for table, count in zip(tables, dbc.fetchone()):
+            if count != 1:
+                # the caller decides whether to roll back the transaction or
+                # only a savepoint, the other CTEs did update their rows
+                raise JHDBIException('update of {} effected {} rows.'.format(table, count))
+
+    def update_jh_records(self, recs, table_map=None, pkeys_arr=None, calling_user=None,
+                          page_size=1000):
+        """Updates many JHRecords in JH with set based updates
+
+        Records are grouped by table and by the set of columns they change and
+        each group is written with UPDATE ... FROM (VALUES ...), page_size rows
+        per statement. Values are cast to the column types of the table. Every
+        VALUES row carries its position in the group, jh_recsync_row, which is
+        returned to tell which records matched a row.
+
+        Args:
+            recs: iterable of JHRecords with the attrs you wish to update,
+                best produced by the diff method
+            table_map: optional. dictionary. see set_table_map.
+            pkeys_arr: optional. list of primary key columns used for every table
+            calling_user: optional. to be used when user initating action is not the db user
+            page_size: optional. int. rows per UPDATE statement
+
+        Returns:
+            list of the records that did not match a row in at least one of
+            their tables. nothing is rolled back for them
+
+        Raises:
+            JHDBIException if a key matched more than one row. the transaction
+            is rolled back
+        """
+        if not self._table_map and not table_map:
+            raise JHDBIException('You must set the table_map')
+        tmap = table_map if table_map else self._table_map
+        groups = {}
+        for rec in recs:
+            for table, avt in self._get_table_upd_dict(rec, tmap).items():
+                cols = tuple(sorted(attr for attr, _ in avt))
+                groups.setdefault((table, cols), []).append(rec)
+        dbc = self.get_cursor(calling_user)
+        unmatched = {}
+        for (table, cols), group in groups.items():
+            pkeys = self._get_update_pkeys(table, group[0], pkeys_arr)
+            types = self._get_column_types(table)
+            # keys are matched on, only set them if nothing else changed
+            set_cols = [col for col in cols if col not in pkeys] or list(cols)
+            v_cols = list(pkeys) + [col for col in set_cols if col not in pkeys]
+            qry = ('UPDATE {t} AS t SET {s} FROM (VALUES %s) AS v (jh_recsync_row, {v}) '
+                   'WHERE {w} RETURNING v.jh_recsync_row').format(
+                       t=table,
+                       s=', '.join('{0} = v.{0}'.format(col) for col in set_cols),
+                       v=', '.join(v_cols),
+                       w=' AND '.join('t.{0} = v.{0}'.format(pkey) for pkey in pkeys))
+            template = '(%s::integer, ' + ', '.join(
+                '%s::{}'.format(types[col]) for col in v_cols) + ')'
+            rows = execute_values(
+                dbc, qry, [[num] + [rec[col] for col in v_cols] for num, rec in enumerate(group)],
+                template=template, page_size=page_size, fetch=True)
+            updated = {}
+            for row in rows:
+                updated[row[0]] = updated.get(row[0], 0) + 1
+            if any(count > 1 for count in updated.values()):
                 self.rollback()
-                raise JHDBIException('update effected more than one row.')
+                raise JHDBIException(
+                    'update of {} effected more than one row for a key'.format(table))
+            for num, rec in enumerate(group):
+                if num not in updated:
+                    unmatched[id(rec)] = rec
+            LOG.debug('updated %s of %s rows in %s', len(rows), len(group), table)
+        if unmatched:
+            LOG.warning('%s records did not match a row', len(unmatched))
+        return list(unmatched.values())
+
+    def bulk_load_jh_records(self, recs, table=None, table_map=None, pkeys_arr=None,
+                             operations=('add', 'modify'), calling_user=None,
+                             safety_check=None):
+        """Loads JHRecords into a JH table through a staging table
+
+        The records are COPYed into a temporary table with the columns the
+        table_map assigns to table, then the table is brought in line with
+        set based SQL: rows whose key is missing from the table are inserted
+        and rows whose values differ are updated.  With 'remove' in operations
+        the records are treated as the complete contents of the table and
+        rows whose key is not among them are deleted, so they must never be
+        a partial set such as one chunk of a source.  Nothing is commited.
+
+        Args:
+            recs: iterable of JHRecords. attribute names must match column names
+            table: optional. table to load. defaults to the only table in table_map
+            table_map: optional. dictionary. see set_table_map.
+            pkeys_arr: optional. list of primary key columns
+            operations: optional. sequence of 'add', 'modify' and 'remove'
+            calling_user: optional. to be used when user initating action is not the db user
+            safety_check: optional. with 'remove', called with the number of rows
+                in the table and the number that would be removed before anything
+                is deleted. raise to abort the load
+
+        Returns:
+            dictionary with the table name and the number of rows staged,
+            added, modified and removed
+        """
+        if not self._table_map and not table_map:
+            raise JHDBIException('You must set the table_map')
+        tmap = table_map if table_map else self._table_map
+        if not table:
+            tables = set(tmap.values())
+            if len(tables) != 1:
+                raise JHDBIException(
+                    'table is required when the table_map spans several tables')
+            table = tables.pop()
+        recs = list(recs)
+        counts = {'table': table, 'staged': len(recs), 'add': 0, 'modify': 0, 'remove': 0}
+        if not recs:
+            if 'remove' in operations:
+                raise JHDBIException(
+                    'refusing to remove every row of {}, no records given'.format(table))
+            return counts
+        cols = sorted(attr for attr, tbl in tmap.items() if tbl == table)
+        # the keys have to be among the staged columns
+        pkeys = self._get_update_pkeys(table, dict.fromkeys(cols), pkeys_arr)
+        cols = pkeys + [col for col in cols if col not in pkeys]
+        stage = 'jh_recsync_stage_{}'.format(next(_cursor_names))
+        col_list = ', '.join(cols)
+        key_match = ' AND '.join('t.{0} = s.{0}'.format(pkey) for pkey in pkeys)
+        dbc = self.get_cursor(calling_user)
+        dbc.execute('CREATE TEMP TABLE {s} ON COMMIT DROP AS SELECT {c} FROM {t} WITH NO DATA'.format(
+            s=stage, c=col_list, t=table))
+        buf = io.StringIO()
+        for rec in recs:
+            buf.write(u'\t'.join(_copy_value(rec.get(col)) for col in cols) + u'\n')
+        buf.seek(0)
+        dbc.copy_expert('COPY {} ({}) FROM STDIN'.format(stage, col_list), buf)
+        dbc.execute('ANALYZE {}'.format(stage))
+        if 'remove' in operations:
+            missing = 'NOT EXISTS (SELECT 1 FROM {s} AS s WHERE {k})'.format(s=stage, k=key_match)
+            if safety_check:
+                dbc.execute('SELECT count(*), count(*) FILTER (WHERE {m}) FROM {t} AS t'.format(
+                    t=table, m=missing))
+                total, removals = dbc.fetchone()
+                safety_check(total, removals)
+            dbc.execute('DELETE FROM {t} AS t WHERE {m}'.format(t=table, m=missing))
+            counts['remove'] = dbc.rowcount
+        upd_cols = [col for col in cols if col not in pkeys]
+        if 'modify' in operations and upd_cols:
+            dbc.execute(
+                'UPDATE {t} AS t SET {a} FROM {s} AS s WHERE {k} '
+                'AND ({tc}) IS DISTINCT FROM ({sc})'.format(
+                    t=table, s=stage, k=key_match,
+                    a=', '.join('{0} = s.{0}'.format(col) for col in upd_cols),
+                    tc=', '.join('t.{}'.format(col) for col in upd_cols),
+                    sc=', '.join('s.{}'.format(col) for col in upd_cols)))
+            counts['modify'] = dbc.rowcount
+        if 'add' in operations:
+            dbc.execute(
+                'INSERT INTO {t} ({c}) SELECT {c} FROM {s} AS s '
+                'WHERE NOT EXISTS (SELECT 1 FROM {t} AS t WHERE {k})'.format(
+                    t=table, s=stage, c=col_list, k=key_match))
+            counts['add'] = dbc.rowcount
+        dbc.execute('DROP TABLE {}'.format(stage))
+        LOG.debug('bulk load of %s: %s', table, counts)
+        return counts
+
+    def diff_jh_records(self, recs, dst_qry, record_type=None,
+                        operations=('add', 'remove', 'modify')):
+        """Compares JHRecords against the rows of a query in JH
+
+        The query is run once into a temporary table and the records are
+        COPYed into another one shaped like it.  The differences are found
+        with anti-joins and IS DISTINCT FROM, so only the differing rows are
+        sent back.  Keys are matched with =, primary keys are never NULL.
+        Values are compared as the column types of the query, not as python
+        values.  Nothing is commited.
+
+        Args:
+            recs: iterable of source JHRecords
+            dst_qry: String. query selecting the destination, column names
+                must match the attribute names of the record type
+            record_type: Optional string. object type of the JHRecords.
+                defaults to one set during init
+            operations: optional. sequence of 'add', 'remove' and 'modify'
+
+        Returns:
+            tuple of (additions, removals, modifications, destination count)
+            shaped like the results of JHRecordSyncer. additions are the source
+            records themselves, removals and the destination half of the
+            modifications are built from the query rows
+        """
+        if not record_type:
+            record_type = self.record_type
+        rec_factory = self._get_record_factory(record_type)
+        recs = list(recs)
+        attrs = rec_factory.attribute_template
+        pkeys = rec_factory.primary_keys
+        upd_attrs = [attr for attr in attrs if attr not in pkeys]
+        num = next(_cursor_names)
+        stage = 'jh_recsync_diff_{}'.format(num)
+        dst_stage = 'jh_recsync_diff_dst_{}'.format(num)
+        dst = '{} AS d'.format(dst_stage)
+        # = lets the planner hash or merge join, IS NOT DISTINCT FROM would not
+        key_match = ' AND '.join('d.{0} = s.{0}'.format(pkey) for pkey in pkeys)
+        dbc = self.get_cursor()
+        # the destination query runs once, every comparison reads its result
+        dbc.execute('CREATE TEMP TABLE {t} ON COMMIT DROP AS SELECT {c} FROM ({q}) AS d'.format(
+            t=dst_stage, q=dst_qry, c=', '.join('d.{}'.format(attr) for attr in attrs)))
+        dbc.execute('ANALYZE {}'.format(dst_stage))
+        # the row number points back into recs, so the source records never
+        # have to be rebuilt from what the database returns
+        dbc.execute(
+            'CREATE TEMP TABLE {s} ON COMMIT DROP AS SELECT *, 0 AS jh_recsync_row '
+            'FROM {d} WITH NO DATA'.format(s=stage, d=dst_stage))
+        buf = io.StringIO()
+        for num, rec in enumerate(recs):
+            buf.write(u'\t'.join(
+                [_copy_value(rec.get(attr)) for attr in attrs] + [text(num)]) + u'\n')
+        buf.seek(0)
+        dbc.copy_expert('COPY {} ({}, jh_recsync_row) FROM STDIN'.format(
+            stage, ', '.join(attrs)), buf)
+        dbc.execute('ANALYZE {}'.format(stage))
+        dbc.execute('SELECT count(*) FROM {}'.format(dst))
+        dst_count = dbc.fetchone()[0]
+        adds, rms, mods = set(), set(), set()
+        if 'add' in operations:
+            dbc.execute(
+                'SELECT s.jh_recsync_row FROM {s} AS s '
+                'WHERE NOT EXISTS (SELECT 1 FROM {d} WHERE {k})'.format(
+                    s=stage, d=dst, k=key_match))
+            adds = {recs[row[0]] for row in dbc.fetchall()}
+        if 'remove' in operations:
+            dbc.execute(
+                'SELECT d.* FROM {d} WHERE NOT EXISTS (SELECT 1 FROM {s} AS s WHERE {k})'.format(
+                    s=stage, d=dst, k=key_match))
+            rms = set(rec_factory.create_many(dbc.fetchall()))
+        if 'modify' in operations and upd_attrs:
+            dbc.execute(
+                'SELECT d.*, s.jh_recsync_row FROM {s} AS s JOIN {d} ON {k} '
+                'WHERE ({sc}) IS DISTINCT FROM ({dc})'.format(
+                    s=stage, d=dst, k=key_match,
+                    sc=', '.join('s.{}'.format(attr) for attr in upd_attrs),
+                    dc=', '.join('d.{}'.format(attr) for attr in upd_attrs)))
+            rows = [dict(row) for row in dbc.fetchall()]
+            nums = [row.pop('jh_recsync_row') for row in rows]
+            mods = {(recs[num], d_rec) for num, d_rec in zip(
+                nums, rec_factory.create_many(rows))}
+        dbc.execute('DROP TABLE {}, {}'.format(stage, dst_stage))
+        LOG.debug(
+            'server side diff found %s additions, %s removals and %s modifications'
+            ' against %s destination rows', len(adds), len(rms), len(mods), dst_count)
+        return adds, rms, mods, dst_count
+
+    def _get_update_pkeys(self, table, rec, pkeys_arr=None):
+        """Returns the primary key columns used to update table, following the
+        same lookup order as update_jh_record"""
+        pkeys = list(pkeys_arr) if pkeys_arr else self._get_table_pkeys(table)
+        missing = [pkey for pkey in pkeys if pkey not in rec]
+        if missing:
+            raise JHDBIException('records for {} are missing primary key attributes: {}'.format(
+                table, ', '.join(missing)))
+        return pkeys
+
+    def _get_column_types(self, table):
+        """Returns a dictionary of column name to SQL type for table. Cached
+        for the life of this object"""
+        if table not in self._column_types:
+            qry = """
+                SELECT a.attname, format_type(a.atttypid, a.atttypmod)
+                FROM   pg_attribute a
+                WHERE  a.attrelid = %s::regclass
+                AND    a.attnum > 0
+                AND    NOT a.attisdropped"""
+            dbc = self.get_cursor()
+            dbc.execute(qry, (table,))
+            self._column_types[table] = {row[0]: row[1] for row in dbc.fetchall()}
+        return self._column_types[table]
 
     @staticmethod
     def _get_table_upd_dict(rec, table_map):
@@ -193,50 +842,26 @@ class JHDBRecordInterface(JHDBI):
         """Takes table, attribute/value tuple and the object and
         returns a formated query and value array
         """
-        qry = 'UPDATE {t_name} SET {a_names} = {vals} WHERE {w}'
-        val_arr = []
-        
-        if not pkeys_arr and not table_pkeys_lookup:
-            t_pkeys = self._get_table_pkeys(table)
-        elif pkeys_arr:
-            t_pkeys = pkeys_arr
+        if pkeys_arr:
+            t_pkeys = list(pkeys_arr)
         elif table_pkeys_lookup:
-            t_pkeys = table_pkeys_lookup
-
-        if len(avt) == 1:
-            atr_str = avt[0][0]
-            val_str = '%s'
-            val_arr.append(avt[0][1])
-        else:
-            atr_str = '(' + ','.join((i[0] for i in avt)) + ')'
-            val_str = '(' + ('%s,'*len(avt))[:-1] + ')'
-            val_arr += [i[1] for i in avt]
-        if len(t_pkeys) == 0:
-            t_pkeys.append(self._args['conf']['default_pkey'])
-        if len(t_pkeys) == 1:
-            pkey = t_pkeys[0]
-            w_str = '{} = %s'.format(pkey)
-            val_arr.append(rec[pkey])
+            t_pkeys = list(table_pkeys_lookup)
         else:
-            w_l = []
-            for pkey in t_pkeys:
-                w_l.append('{} = %s'.format(pkey))
-                val_arr.append(rec[pkey])
-            w_str = ' AND '.join(w_l)
-        fqry = qry.format(t_name=table, a_names=atr_str, vals=val_str, w=w_str)
-        return fqry, val_arr
+            t_pkeys = self._get_table_pkeys(table)
+        return update_query(table, avt, rec, t_pkeys)
 
     def _get_table_pkeys(self, t_name):
-        qry = """
-            SELECT a.attname
-            FROM   pg_index i
-            JOIN   pg_attribute a ON a.attrelid = i.indrelid
-                                 AND a.attnum = ANY(i.indkey)
-            WHERE  i.indrelid = %s::regclass
-            AND    i.indisprimary"""
-        dbc = self.get_cursor()
-        dbc.execute(qry, (t_name,))
-        return [r[0] for r in dbc.fetchall()]
+        """Returns the primary key columns of t_name from the catalog, the
+        static table_pkey_map or the default_pkey conf key, in that order"""
+        pkeys = self.pkey_resolver.get(t_name)
+        if pkeys is None:
+            pkeys = list(self.table_pkey_map.get(t_name, []))
+        if not pkeys:
+            default_pkey = (self._args.get('conf') or {}).get('default_pkey')
+            if not default_pkey:
+                raise JHDBIException('No primary key found for table {}'.format(t_name))
+            pkeys = [default_pkey]
+        return pkeys
 
 
 class JHDBIException(Exception):
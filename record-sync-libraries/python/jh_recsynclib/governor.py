@@ -0,0 +1,262 @@
+# Copyright 2017 Ryan D. Williams
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Destination write governor
+
+Rate limiting and concurrency control for the writes a sync makes to its
+destination.
+"""
+
+__author__ = 'Ryan D. Williams <rdw@drws-office.com>'
+
+# Standard library imports
+import time
+import logging
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# Local imports
+from jh_recsynclib.report import monotonic
+
+
+LOG = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class WriteGovernor(object):
+    """Paces writes to a destination.
+
+    Writes are rate limited with a token bucket and the number of writes in
+    flight is limited by a concurrency level.  Both are tuned AIMD style from
+    the latency and success of the writes: after every window of writes the
+    rate and concurrency are increased additively if the destination kept up,
+    and cut multiplicatively if the error rate or the average latency went
+    over their targets.  The rate never exceeds max_rate, if one is set, and
+    the concurrency never exceeds max_concurrency.
+
+    Example:
+        gov = WriteGovernor(max_rate=200, max_concurrency=8, target_latency=0.25)
+        gov.acquire()
+        start = time.time()
+        try:
+            write(record)
+        finally:
+            gov.release(time.time() - start, success)
+    """
+
+    def __init__(self, max_rate=None, initial_rate=None, min_rate=1.0, rate_increase=1.0,
+                 burst=None, max_concurrency=1, min_concurrency=1, target_latency=None,
+                 max_error_rate=0.1, decrease_factor=0.5, window=20):
+        """Inits a WriteGovernor
+
+        Args:
+            max_rate: optional. float. writes per second never to be exceeded.
+                None for no rate limit
+            initial_rate: optional. float. rate to start at. defaults to max_rate
+            min_rate: float. the rate is never cut below this
+            rate_increase: float. writes per second added after a good window
+            burst: optional. int. writes that may be made back to back after the
+                governor was idle. defaults to one second worth of writes
+            max_concurrency: int. max number of writes in flight
+            min_concurrency: int. the concurrency is never cut below this
+            target_latency: optional. float. seconds a write may take on average
+                before the destination is considered overloaded
+            max_error_rate: float. fraction of failed writes in a window above
+                which the destination is considered overloaded
+            decrease_factor: float. multiplier applied to rate and concurrency
+                when the destination is overloaded
+            window: int. number of writes between adjustments
+        """
+        if max_concurrency < 1 or min_concurrency < 1 or min_concurrency > max_concurrency:
+            raise WriteGovernorException(
+                'concurrency limits must satisfy 1 <= min_concurrency <= max_concurrency')
+        if not 0 < decrease_factor < 1:
+            raise WriteGovernorException('decrease_factor must be between 0 and 1')
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate) if max_rate else min_rate
+        self.rate_increase = rate_increase
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.target_latency = target_latency
+        self.max_error_rate = max_error_rate
+        self.decrease_factor = decrease_factor
+        self.window = window
+        self.rate = initial_rate or max_rate
+        self.concurrency = min_concurrency
+        self._burst = burst
+        self._tokens = float(self._capacity())
+        self._refilled_at = monotonic()
+        self._active = 0
+        self._cond = threading.Condition()
+        self._obs = 0
+        self._obs_errors = 0
+        self._obs_seconds = 0.0
+        self._stats = {'writes': 0, 'errors': 0, 'throttled_seconds': 0.0,
+                       'increases': 0, 'decreases': 0}
+
+    @classmethod
+    def from_conf(cls, conf):
+        """Returns a WriteGovernor from a write_governor configuration dictionary"""
+        try:
+            return cls(**conf)
+        except TypeError as exc:
+            raise WriteGovernorException('invalid write_governor configuration: {}'.format(exc))
+
+    def _capacity(self):
+        if not self.rate:
+            return 0
+        return max(1, self._burst or int(self.rate))
+
+    def acquire(self):
+        """Blocks until a write may be made"""
+        start = monotonic()
+        with self._cond:
+            while self._active >= self.concurrency:
+                self._cond.wait()
+            self._active += 1
+        while True:
+            with self._cond:
+                if not self.rate:
+                    break
+                now = monotonic()
+                self._tokens = min(
+                    self._capacity(), self._tokens + (now - self._refilled_at) * self.rate)
+                self._refilled_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    break
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+        waited = monotonic() - start
+        with self._cond:
+            self._stats['throttled_seconds'] += waited
+
+    def release(self, seconds, success):
+        """Records the outcome of a write made after acquire
+
+        Args:
+            seconds: float. time the write took
+            success: bool. False if the write failed
+        """
+        with self._cond:
+            self._active -= 1
+            self._stats['writes'] += 1
+            self._obs += 1
+            self._obs_seconds += seconds
+            if not success:
+                self._stats['errors'] += 1
+                self._obs_errors += 1
+            if self._obs >= self.window:
+                self._adjust()
+            self._cond.notify_all()
+
+    def _adjust(self):
+        """Applies AIMD to the rate and concurrency. Caller holds the lock"""
+        error_rate = float(self._obs_errors) / self._obs
+        latency = self._obs_seconds / self._obs
+        overloaded = error_rate > self.max_error_rate or (
+            self.target_latency is not None and latency > self.target_latency)
+        self._obs, self._obs_errors, self._obs_seconds = 0, 0, 0.0
+        if overloaded:
+            self._stats['decreases'] += 1
+            self.concurrency = max(
+                self.min_concurrency, int(self.concurrency * self.decrease_factor))
+            if self.rate:
+                self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            LOG.debug(
+                'destination overloaded (error rate %.2f, latency %.3fs), '
+                'rate now %s, concurrency %s', error_rate, latency, self.rate, self.concurrency)
+        else:
+            self._stats['increases'] += 1
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+            if self.rate:
+                self.rate += self.rate_increase
+                if self.max_rate:
+                    self.rate = min(self.max_rate, self.rate)
+        self._tokens = min(self._tokens, self._capacity())
+
+    def imap_unordered(self, func, items):
+        """Calls func on every item from a pool of max_concurrency threads,
+        each call paced by acquire and release.
+
+        Yields (item, success, result, seconds) in the order the calls
+        complete. result is the exception raised by func if success is False.
+        Closing the generator early stops the remaining calls.
+        """
+        tasks = queue.Queue()
+        done = queue.Queue()
+        stopped = threading.Event()
+        workers = [
+            threading.Thread(target=self._worker, args=(func, tasks, done, stopped))
+            for _ in range(self.max_concurrency)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        # keep enough calls queued that no slot waits on the caller
+        limit = self.max_concurrency * 2
+        pending = 0
+        try:
+            for item in items:
+                tasks.put(item)
+                pending += 1
+                while pending >= limit:
+                    pending -= 1
+                    yield done.get()
+            while pending:
+                pending -= 1
+                yield done.get()
+        finally:
+            stopped.set()
+            for _ in workers:
+                tasks.put(_STOP)
+            for worker in workers:
+                worker.join()
+
+    def _worker(self, func, tasks, done, stopped):
+        while True:
+            item = tasks.get()
+            if item is _STOP:
+                return
+            if stopped.is_set():
+                continue
+            self.acquire()
+            start = monotonic()
+            try:
+                result = func(item)
+                success = True
+            except Exception as exc:                                    # pylint: disable=broad-except
+                result = exc
+                success = False
+            seconds = monotonic() - start
+            self.release(seconds, success)
+            done.put((item, success, result, seconds))
+
+    def stats(self):
+        """Returns a dictionary describing the current state of the governor"""
+        with self._cond:
+            stats = dict(self._stats)
+        stats['throttled_seconds'] = round(stats['throttled_seconds'], 6)
+        stats['rate'] = self.rate
+        stats['concurrency'] = self.concurrency
+        return stats
+
+
+class WriteGovernorException(Exception):
+    "Exception class for WriteGovernor issues"
+    pass
@@ -0,0 +1,236 @@
+# Copyright 2017 Ryan D. Williams
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Sync metrics
+
+Counters, gauges and histograms written out as a textfile for collection by
+the node-exporter textfile collector.  The prometheus text format it reads is
+the default, the OpenMetrics format is written with openmetrics=True.
+"""
+
+__author__ = 'Ryan D. Williams <rdw@drws-office.com>'
+
+# Standard library imports
+import os
+import logging
+import threading
+from bisect import bisect_left
+
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+    30.0, 60.0, 120.0, 300.0, 600.0)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _format_bound(value):
+    # bucket bounds are always written as floats, e.g. le="1.0"
+    return '+Inf' if value == float('inf') else repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(val)) for name, val in pairs) + '}'
+
+
+class _Metric(object):
+    """Base class for metrics. Values are kept per label combination"""
+
+    TYPE = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _label_values(self, labels):
+        try:
+            return tuple(str(labels[name]) for name in self.labelnames)
+        except KeyError as exc:
+            raise MetricsException('{} requires label {}'.format(self.name, exc))
+
+    def render(self, openmetrics=False):
+        """Returns the metric in the text exposition format"""
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """A value that only goes up"""
+
+    TYPE = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """Increments the counter for the given labels"""
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self, openmetrics=False):
+        # OpenMetrics names the family without the _total suffix, the
+        # prometheus text format expects the family name to match the samples
+        family = self.name if openmetrics else self.name + '_total'
+        lines = [
+            '# HELP {} {}'.format(family, self.documentation),
+            '# TYPE {} counter'.format(family)]
+        with self._lock:
+            for key, val in sorted(self._values.items()):
+                lines.append('{}_total{} {}'.format(
+                    self.name, _format_labels(self.labelnames, key), _format_value(val)))
+        return lines
+
+
+class Gauge(_Metric):
+    """A value that can be set to anything"""
+
+    TYPE = 'gauge'
+
+    def set(self, value, **labels):
+        """Sets the gauge for the given labels"""
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self, openmetrics=False):
+        lines = [
+            '# HELP {} {}'.format(self.name, self.documentation),
+            '# TYPE {} gauge'.format(self.name)]
+        with self._lock:
+            for key, val in sorted(self._values.items()):
+                lines.append('{}{} {}'.format(
+                    self.name, _format_labels(self.labelnames, key), _format_value(val)))
+        return lines
+
+
+class Histogram(_Metric):
+    """Counts observations into buckets"""
+
+    TYPE = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        """Records a single observation for the given labels"""
+        key = self._label_values(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def render(self, openmetrics=False):
+        lines = [
+            '# HELP {} {}'.format(self.name, self.documentation),
+            '# TYPE {} histogram'.format(self.name)]
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    lines.append('{}_bucket{} {}'.format(
+                        self.name,
+                        _format_labels(self.labelnames, key, ('le', _format_bound(bound))),
+                        cumulative))
+                labels = _format_labels(self.labelnames, key)
+                lines.append('{}_sum{} {}'.format(self.name, labels, _format_value(total)))
+                lines.append('{}_count{} {}'.format(self.name, labels, cumulative))
+        return lines
+
+
+class MetricsRegistry(object):
+    """Holds metrics and writes them to a textfile.
+
+    Asking for a metric that already exists returns the existing one, so
+    the same registry can be shared by everything in the process.
+
+    Example:
+        registry = MetricsRegistry()
+        registry.counter('jh_recsync_records', 'records applied', ['operation']).inc(
+            operation='add')
+        registry.write_textfile('/var/lib/node_exporter/textfile/jh_recsync.prom')
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, documentation, labelnames, **kwargs)
+                self._metrics[name] = metric
+            elif not isinstance(metric, cls):
+                raise MetricsException('{} already registered as a {}'.format(
+                    name, metric.TYPE))
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        """Returns the named Counter, creating it if needed"""
+        return self._get(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        """Returns the named Gauge, creating it if needed"""
+        return self._get(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        """Returns the named Histogram, creating it if needed"""
+        return self._get(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self, openmetrics=False):
+        """Returns all metrics in the prometheus text format, or the OpenMetrics
+        text format if openmetrics is True"""
+        lines = []
+        with self._lock:
+            metrics = [self._metrics[name] for name in sorted(self._metrics)]
+        for metric in metrics:
+            lines += metric.render(openmetrics)
+        if openmetrics:
+            lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path, openmetrics=False):
+        """Atomically replaces path with the rendered metrics"""
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'w') as _fh:
+            _fh.write(self.render(openmetrics))
+        os.rename(tmp_path, path)
+        LOG.debug('wrote metrics to %s', path)
+
+
+class MetricsException(Exception):
+    "Exception class for metrics issues"
+    pass
+
+
+REGISTRY = MetricsRegistry()
@@ -0,0 +1,189 @@
+# Copyright 2017 Ryan D. Williams
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Sync orchestration
+
+Runs many syncs in one process, ordered by the dependencies between them.
+"""
+
+__author__ = 'Ryan D. Williams <rdw@drws-office.com>'
+
+# Standard library imports
+import logging
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# Local imports
+from jh_recsynclib.pool import POOL
+
+
+LOG = logging.getLogger(__name__)
+
+
+class SyncOrchestrator(object):
+    """Runs a group of syncs as a dependency graph.
+
+    Syncs whose dependencies have completed run concurrently on a fixed
+    number of worker threads.  Database connections are shared between the
+    syncs; a sync checks out the connections it needs from the connection
+    pool for the length of its run and returns them when it is done.  The
+    connections checked out during a run are closed once all syncs are done.
+    A sync whose dependency failed is skipped.
+
+    Syncs are added as factories that are given a connection_factory and
+    must return a SyncBase object.  The connection_factory should be passed
+    through to SyncBase.
+
+    Example:
+        args = SyncOptions().parse_opts()
+        orc = SyncOrchestrator(max_workers=4)
+        orc.add_sync('department', lambda cf: DeptSync(args, connection_factory=cf))
+        orc.add_sync(
+            'account', lambda cf: AccountSync(args, connection_factory=cf),
+            depends_on=['department'])
+        results = orc.run()
+        # {'department': 'success', 'account': 'success'}
+    """
+
+    SUCCESS = 'success'
+    FAILED = 'failed'
+    SKIPPED = 'skipped'
+
+    def __init__(self, max_workers=4, pool=None):
+        """Inits a SyncOrchestrator
+
+        Args:
+            max_workers: int. max number of syncs to run at the same time
+            pool: optional. ConnectionPool. defaults to the process wide pool
+        """
+        self._max_workers = max_workers
+        self._syncs = {}
+        self._order = []
+        self._connections = pool or POOL
+        self._checked_out = []
+        self._lock = threading.Lock()
+
+    def add_sync(self, name, factory, depends_on=(), sync_type=None,
+                 operations=('add', 'remove', 'modify')):
+        """Adds a sync to the graph.
+
+        Args:
+            name: string. unique name of the sync, used by depends_on
+            factory: callable taking a connection_factory and returning a SyncBase
+            depends_on: sequence of sync names that must succeed before this one runs
+            sync_type: optional. passed to SyncBase.run_sync
+            operations: optional. passed to SyncBase.run_sync
+        """
+        if name in self._syncs:
+            raise OrchestratorException('sync already added: {}'.format(name))
+        self._syncs[name] = {
+            'factory': factory,
+            'depends_on': set(depends_on),
+            'run_kwargs': {'sync_type': sync_type, 'operations': operations}}
+        self._order.append(name)
+
+    def run(self):
+        """Runs all syncs and returns a dictionary of sync name to result"""
+        self._check_graph()
+        results = {}
+        pending = list(self._order)
+        running = set()
+        tasks = queue.Queue()
+        done = queue.Queue()
+        workers = [
+            threading.Thread(target=self._worker, args=(tasks, done))
+            for _ in range(min(self._max_workers, len(pending)) or 1)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        try:
+            while pending or running:
+                for name in list(pending):
+                    deps = self._syncs[name]['depends_on']
+                    if any(results.get(dep) in (self.FAILED, self.SKIPPED) for dep in deps):
+                        LOG.error('skipping sync %s, a dependency did not succeed', name)
+                        results[name] = self.SKIPPED
+                        pending.remove(name)
+                    elif all(results.get(dep) == self.SUCCESS for dep in deps):
+                        LOG.debug('starting sync %s', name)
+                        tasks.put(name)
+                        running.add(name)
+                        pending.remove(name)
+                if not running:
+                    continue
+                name, result = done.get()
+                running.discard(name)
+                results[name] = result
+        finally:
+            for _ in workers:
+                tasks.put(None)
+            for worker in workers:
+                worker.join()
+            with self._lock:
+                conns, self._checked_out = self._checked_out, []
+            self._connections.close_connections(conns)
+        return results
+
+    def _worker(self, tasks, done):
+        """Runs syncs from the task queue until it receives None"""
+        while True:
+            name = tasks.get()
+            if name is None:
+                return
+            conns = []
+
+            def connection_factory(app_name, **kwargs):
+                conn = self._connections.checkout(app_name, **kwargs)
+                conns.append(conn)
+                with self._lock:
+                    self._checked_out.append(conn)
+                return conn
+
+            sync = self._syncs[name]
+            try:
+                sync['factory'](connection_factory).run_sync(**sync['run_kwargs'])
+                result = self.SUCCESS
+            except Exception as exc:                                    # pylint: disable=broad-except
+                LOG.error('sync %s failed: %s', name, exc)
+                result = self.FAILED
+            finally:
+                for conn in conns:
+                    self._connections.checkin(conn)
+            done.put((name, result))
+
+    def _check_graph(self):
+        """Verifies all dependencies exist and that there are no cycles"""
+        for name, sync in self._syncs.items():
+            unknown = sync['depends_on'] - set(self._syncs)
+            if unknown:
+                raise OrchestratorException('{} depends on unknown syncs: {}'.format(
+                    name, ', '.join(sorted(unknown))))
+        resolved = set()
+        remaining = set(self._syncs)
+        while remaining:
+            ready = {name for name in remaining if self._syncs[name]['depends_on'] <= resolved}
+            if not ready:
+                raise OrchestratorException('dependency cycle between syncs: {}'.format(
+                    ', '.join(sorted(remaining))))
+            resolved |= ready
+            remaining -= ready
+
+
+class OrchestratorException(Exception):
+    "Exception class for SyncOrchestrator issues"
+    pass
@@ -0,0 +1,269 @@
+# Copyright 2017 Ryan D. Williams
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""psycopg 3 backend
+
+Connections for JHDBI made with psycopg 3 instead of psycopg2, and a record
+interface that sends batches of independent updates in pipeline mode.
+psycopg2 stays the default, this module is only used when asked for.
+"""
+
+__author__ = 'Ryan D. Williams <rdw@drws-office.com>'
+
+# Standard library imports
+import logging
+from functools import partial
+
+# Third-party imports
+import psycopg
+from psycopg.conninfo import make_conninfo
+from psycopg.rows import tuple_row
+from jazzhands_appauthal.db import DatabaseConnection
+
+# Local imports
+from jh_recsynclib.db import JHDBRecordInterface, JHDBIException
+
+
+LOG = logging.getLogger(__name__)
+
+_conninfo_cache = {}
+
+
+def appauthal_conninfo(app_name):
+    """Returns a libpq connection string for an appauthal app name. appauthal
+    only makes psycopg2 connections, so one is made the first time an app
+    name is asked for to read the connection parameters from"""
+    if app_name not in _conninfo_cache:
+        dbh = DatabaseConnection(app_name).connect()
+        try:
+            params = dict(dbh.info.dsn_parameters)
+            if dbh.info.password:
+                params['password'] = dbh.info.password
+        finally:
+            dbh.close()
+        _conninfo_cache[app_name] = make_conninfo(**params)
+    return _conninfo_cache[app_name]
+
+
+class DictRow(list):
+    """Row that can be indexed by position or by column name, like the
+    psycopg2 DictRow the rest of the library expects"""
+
+    __slots__ = ('_index',)
+
+    def __init__(self, index, values):
+        super(DictRow, self).__init__(values)
+        self._index = index
+
+    def __getitem__(self, key):
+        if not isinstance(key, (int, slice)):
+            key = self._index[key]
+        return super(DictRow, self).__getitem__(key)
+
+    def get(self, key, default=None):
+        """Returns the value of column key or default"""
+        try:
+            return self[key]
+        except (KeyError, IndexError):
+            return default
+
+    def keys(self):
+        """Returns the column names"""
+        return list(self._index)
+
+    def values(self):
+        """Returns the column values"""
+        return list(self)
+
+    def items(self):
+        """Returns (column name, value) tuples"""
+        return list(zip(self._index, self))
+
+
+def dict_row(cursor):
+    """psycopg row factory making DictRows. The column index is built once
+    per result"""
+    index = {}
+    for num, column in enumerate(cursor.description or ()):
+        index.setdefault(column.name, num)
+    return partial(DictRow, index)
+
+
+def connect(app_name, conninfo=None, autocommit=False, prepared_max=None, **kwargs):
+    """Connection factory for JHDBI returning a psycopg 3 connection whose
+    cursors return DictRows
+
+    Args:
+        app_name: appauthal application name. only used without conninfo
+        conninfo: optional. libpq connection string, defaults to the one
+            appauthal has for app_name
+        autocommit: optional. bool
+        prepared_max: optional. int. statements psycopg keeps prepared
+        **kwargs: other JHDBI kwargs, they are psycopg2 options and are ignored
+    """
+    dbh = psycopg.connect(
+        conninfo or appauthal_conninfo(app_name), autocommit=autocommit, row_factory=dict_row)
+    if prepared_max:
+        dbh.prepared_max = prepared_max
+    return dbh
+
+
+class PipelineRecordInterface(JHDBRecordInterface):
+    """JHDBRecordInterface on a psycopg 3 connection that can write batches
+    of records in pipeline mode.
+
+    pipeline_update_jh_records sends the UPDATEs of many records without
+    waiting for each result, so a batch costs one round trip instead of one
+    per statement.  A failing statement aborts the rest of its pipeline, so
+    the batch is rolled back to a savepoint and split in half until the
+    records at fault are found and returned with their errors.
+
+    prepared_statement_cache_size is handed to psycopg, which prepares
+    statements on its own, instead of PreparedStatementCache.  COPY and
+    execute_values are psycopg2 only, so update_jh_records,
+    bulk_load_jh_records and diff_jh_records are not available.
+
+    Example:
+        jhdbi = PipelineRecordInterface('jh-feed', 'department', table_map=tmap)
+        for rec, exc in jhdbi.pipeline_update_jh_records(records):
+            LOG.error('%s failed: %s', rec.primary_key, exc)
+        jhdbi.commit()
+    """
+
+    PIPELINE_SAVEPOINT = 'jh_recsync_pipeline'
+    DEFAULT_PIPELINE_BATCH_SIZE = 500
+
+    def __init__(self, app_name, record_type=None, table_map=None, conninfo=None, **kwargs):
+        """Inits a PipelineRecordInterface
+
+        Args:
+            app_name: appauthal application name to use for connection to JH
+            record_type: optional. JHRecord type
+            table_map: optional. table_map dictionary. see set_table_map
+            conninfo: optional. libpq connection string used instead of the
+                connection parameters of app_name
+        """
+        conf = kwargs.get('conf') or {}
+        kwargs.setdefault('connection_factory', partial(
+            connect, conninfo=conninfo, prepared_max=conf.get('prepared_statement_cache_size')))
+        super(PipelineRecordInterface, self).__init__(
+            app_name, record_type=record_type, table_map=table_map, **kwargs)
+        self.statement_cache = None
+
+    def get_cursor(self, calling_user=None, name=None, tuple_rows=False):
+        """Returns a psycopg DB cursor. see JHDBI.get_cursor"""
+        if not tuple_rows:
+            return super(PipelineRecordInterface, self).get_cursor(calling_user, name)
+        self._check_db_handle()
+        if calling_user:
+            self._set_session_user(calling_user)
+        if name:
+            return self._dbh.cursor(name=name, row_factory=tuple_row)
+        return self._dbh.cursor(row_factory=tuple_row)
+
+    def _set_session_user(self, user):
+        "Sets the jazzhands.appuser session variable for auditing"
+        # SET does not take bind parameters, which psycopg 3 always uses
+        dbc = self.get_cursor()
+        dbc.execute("SELECT set_config('jazzhands.appuser', %s, true)", (user,))
+
+    def pipeline_update_jh_records(self, recs, table_map=None, pkeys_arr=None,
+                                   calling_user=None, batch_size=None):
+        """Updates JHRecords in JH, batch_size records per pipeline
+
+        Each record is written with the same statements as update_jh_record
+        and every statement must update exactly one row.
+
+        Args:
+            recs: iterable of JHRecords with the attrs you wish to update
+            table_map: optional. dictionary. see set_table_map.
+            pkeys_arr: optional. list of primary key columns used for every table
+            calling_user: optional. to be used when user initating action is not the db user
+            batch_size: optional. int. records per pipeline, defaults to
+                DEFAULT_PIPELINE_BATCH_SIZE
+
+        Returns:
+            list of (record, exception) tuples for the records that failed.
+            their changes are rolled back, those of the other records are kept
+        """
+        if not self._table_map and not table_map:
+            raise JHDBIException('You must set the table_map')
+        tmap = table_map if table_map else self._table_map
+        batch_size = batch_size or self.DEFAULT_PIPELINE_BATCH_SIZE
+        if calling_user:
+            self._set_session_user(calling_user)
+        failed = []
+        batch = []
+        for rec in recs:
+            try:
+                batch.append((rec, [
+                    (table,) + self._prep_qry(table, avt, rec, pkeys_arr)
+                    for table, avt in self._get_table_upd_dict(rec, tmap).items()]))
+            except (KeyError, JHDBIException) as exc:
+                failed.append((rec, exc))
+            if len(batch) >= batch_size:
+                self._run_pipeline(batch, failed)
+                batch = []
+        if batch:
+            self._run_pipeline(batch, failed)
+        if failed:
+            LOG.warning('%s records failed to update', len(failed))
+        return failed
+
+    def _run_pipeline(self, batch, failed):
+        """Sends the statements of batch, a list of (record, statements)
+        tuples, in one pipeline inside a savepoint. failures are appended to
+        failed as (record, exception) tuples"""
+        self.savepoint(self.PIPELINE_SAVEPOINT)
+        try:
+            cursors = []
+            with self._dbh.pipeline():
+                for _, statements in batch:
+                    rec_cursors = []
+                    for _, qry, val_arr in statements:
+                        dbc = self._dbh.cursor()
+                        dbc.execute(qry, val_arr)
+                        rec_cursors.append(dbc)
+                    cursors.append(rec_cursors)
+        except psycopg.Error as exc:
+            self._undo_pipeline()
+            if len(batch) == 1:
+                failed.append((batch[0][0], exc))
+                return
+            LOG.debug('pipeline of %s records failed, splitting it', len(batch))
+            half = len(batch) // 2
+            self._run_pipeline(batch[:half], failed)
+            self._run_pipeline(batch[half:], failed)
+            return
+        bad = []
+        for (rec, statements), rec_cursors in zip(batch, cursors):
+            for (table, _, _), dbc in zip(statements, rec_cursors):
+                if dbc.rowcount != 1:
+                    bad.append((rec, JHDBIException('update of {} effected {} rows.'.format(
+                        table, dbc.rowcount))))
+                    break
+        if not bad:
+            self.release_savepoint(self.PIPELINE_SAVEPOINT)
+            return
+        # the records at fault are known, the others are sent again
+        self._undo_pipeline()
+        failed.extend(bad)
+        bad_ids = {id(rec) for rec, _ in bad}
+        rest = [item for item in batch if id(item[0]) not in bad_ids]
+        if rest:
+            self._run_pipeline(rest, failed)
+
+    def _undo_pipeline(self):
+        self.rollback_to_savepoint(self.PIPELINE_SAVEPOINT)
+        self.release_savepoint(self.PIPELINE_SAVEPOINT)
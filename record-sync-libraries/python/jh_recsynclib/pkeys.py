@@ -0,0 +1,167 @@
+# Copyright 2017 Ryan D. Williams
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Primary key discovery
+
+Reads the primary keys of every table in a JazzHands database in one
+catalog query and caches them by schema version.
+"""
+
+__author__ = 'Ryan D. Williams <rdw@drws-office.com>'
+
+# Standard library imports
+import os
+import json
+import hashlib
+import logging
+import threading
+
+
+LOG = logging.getLogger(__name__)
+
+SCHEMA_VERSION_QRY = """
+    SELECT md5(string_agg(c.oid::text || ':' || c.xmin::text, ',' ORDER BY c.oid))
+    FROM   pg_class c
+    JOIN   pg_namespace n ON n.oid = c.relnamespace
+    WHERE  n.nspname = ANY(current_schemas(false))
+    AND    c.relkind IN ('r', 'p', 'i')"""
+
+PRIMARY_KEYS_QRY = """
+    SELECT n.nspname, c.relname,
+           array_agg(a.attname::text ORDER BY array_position(i.indkey::int2[], a.attnum))
+    FROM   pg_index i
+    JOIN   pg_class c ON c.oid = i.indrelid
+    JOIN   pg_namespace n ON n.oid = c.relnamespace
+    JOIN   pg_attribute a ON a.attrelid = i.indrelid
+                         AND a.attnum = ANY(i.indkey)
+    WHERE  i.indisprimary
+    AND    n.nspname = ANY(current_schemas(false))
+    GROUP BY n.nspname, c.relname
+    ORDER BY array_position(current_schemas(false)::text[], n.nspname::text)"""
+
+
+def pkeys_from_rows(rows):
+    """Returns a dictionary of table name to primary key columns from the
+    (schema, table, columns) rows of PRIMARY_KEYS_QRY"""
+    pkeys = {}
+    for schema, table, columns in rows:
+        pkeys['{}.{}'.format(schema, table)] = columns
+        pkeys.setdefault(table, columns)
+    return pkeys
+
+
+class PrimaryKeyResolver(object):
+    """Looks up table primary keys from the database catalog.
+
+    The primary keys of all tables in the schemas of the search_path are
+    read with a single query the first time one is asked for.  They are
+    kept in memory for the process, keyed by app name and schema version,
+    and written to cache_dir if one is given so later processes can skip the
+    catalog query.  The schema version is a digest of the pg_class rows of
+    those schemas, which change with DDL, unless one is given explicitly.
+    Without an explicit schema_version every process still runs that version
+    query once, the cache only saves it the primary key query.
+
+    Tables are found by plain name, the first schema in the search_path
+    winning, or by schema qualified name.
+
+    Example:
+        resolver = PrimaryKeyResolver(jhdbi, cache_dir='/var/cache/jh_recsync')
+        resolver.get('account_collection_account')
+        # ['account_id', 'account_collection_id']
+    """
+
+    _loaded = {}
+    _lock = threading.Lock()
+
+    def __init__(self, dbh, cache_dir=None, schema_version=None):
+        """Inits a PrimaryKeyResolver
+
+        Args:
+            dbh: JHDBI or similiar object that implements get_cursor
+            cache_dir: optional. directory the primary keys are cached in
+            schema_version: optional. string used as the schema version instead
+                of reading it from the catalog
+        """
+        self._dbh = dbh
+        self._cache_dir = cache_dir
+        self._schema_version = schema_version
+        self._pkeys = None
+
+    def get(self, table):
+        """Returns a list of the primary key columns of table, an empty list
+        for a table without a primary key or None if there is no such table"""
+        if self._pkeys is None:
+            self._pkeys = self._load()
+        pkeys = self._pkeys.get(table)
+        return list(pkeys) if pkeys is not None else None
+
+    def reset(self):
+        """Forgets the primary keys, they are read again on the next get"""
+        self._pkeys = None
+        self._schema_version = None
+
+    def _load(self):
+        version = self._schema_version or self._read_schema_version()
+        key = (self._dbh._app_name, version)                           # pylint: disable=protected-access
+        with self._lock:
+            pkeys = self._loaded.get(key)
+        if pkeys is None:
+            pkeys = self._read_cache_file(version)
+        if pkeys is None:
+            pkeys = self._read_catalog()
+            self._write_cache_file(version, pkeys)
+        with self._lock:
+            self._loaded[key] = pkeys
+        return pkeys
+
+    def _read_schema_version(self):
+        dbc = self._dbh.get_cursor()
+        dbc.execute(SCHEMA_VERSION_QRY)
+        return dbc.fetchone()[0]
+
+    def _read_catalog(self):
+        LOG.debug('reading primary keys from the catalog')
+        dbc = self._dbh.get_cursor()
+        dbc.execute(PRIMARY_KEYS_QRY)
+        return pkeys_from_rows(dbc.fetchall())
+
+    def _cache_file(self):
+        name = hashlib.md5(self._dbh._app_name.encode('utf-8')).hexdigest()  # pylint: disable=protected-access
+        return os.path.join(self._cache_dir, 'jh_recsync_pkeys_{}.json'.format(name))
+
+    def _read_cache_file(self, version):
+        if not self._cache_dir:
+            return None
+        try:
+            with open(self._cache_file(), 'r') as _fh:
+                cached = json.load(_fh)
+        except (IOError, OSError, ValueError):
+            return None
+        if cached.get('version') != version:
+            LOG.debug('primary key cache is for another schema version')
+            return None
+        return cached['pkeys']
+
+    def _write_cache_file(self, version, pkeys):
+        if not self._cache_dir:
+            return
+        path = self._cache_file()
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as _fh:
+                json.dump({'version': version, 'pkeys': pkeys}, _fh)
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as exc:
+            LOG.warning('unable to write primary key cache %s: %s', path, exc)
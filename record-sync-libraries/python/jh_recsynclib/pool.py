@@ -0,0 +1,146 @@
+# Copyright 2017 Ryan D. Williams
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Database connection pool
+
+Process wide pool of appauthal database connections.
+"""
+
+__author__ = 'Ryan D. Williams <rdw@drws-office.com>'
+
+# Standard library imports
+import weakref
+import logging
+import threading
+
+
+LOG = logging.getLogger(__name__)
+
+
+class ConnectionPool(object):
+    """Keeps idle database connections for reuse.
+
+    Connections are keyed by appauthal app name and driver kwargs.  A
+    connection is only ever handed to one user at a time.  Checked in
+    connections are rolled back and dropped if closed, and connections that
+    were closed while idle are discarded on checkout.
+
+    Example:
+        conn = POOL.checkout('jazzhands_sync', psycopg2_cursor_factory='DictCursor')
+        try:
+            ...
+        finally:
+            POOL.checkin(conn)
+    """
+
+    def __init__(self, max_idle=4):
+        """Inits a ConnectionPool
+
+        Args:
+            max_idle: int. idle connections kept per key, extra ones are closed
+        """
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = {}
+        # keyed on the connection itself, an id() can be reused once a
+        # connection that was never checked in is garbage collected
+        self._keys = weakref.WeakKeyDictionary()
+        self.stats = {'hits': 0, 'misses': 0, 'discarded': 0}
+
+    @staticmethod
+    def _key(app_name, kwargs):
+        # conf is the sync configuration dictionary, it does not change the connection
+        return (app_name, tuple(sorted(
+            (key, repr(val)) for key, val in kwargs.items() if key != 'conf')))
+
+    def checkout(self, app_name, **kwargs):
+        """Returns an idle connection for app_name or opens a new one
+
+        Args:
+            app_name: appauthal application name
+            **kwargs: driver kwargs passed to appauthal connect
+        """
+        key = self._key(app_name, kwargs)
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                conn = idle.pop()
+                if conn.closed:
+                    self.stats['discarded'] += 1
+                    continue
+                self.stats['hits'] += 1
+                self._keys[conn] = key
+                return conn
+            self.stats['misses'] += 1
+        conn = self._connect(app_name, **kwargs)
+        with self._lock:
+            self._keys[conn] = key
+        return conn
+
+    @staticmethod
+    def _connect(app_name, **kwargs):
+        """Opens a new connection through appauthal"""
+        from jazzhands_appauthal.db import DatabaseConnection
+        return DatabaseConnection(app_name).connect(**kwargs)
+
+    def checkin(self, conn):
+        """Returns a connection to the pool. Connections not checked out from
+        this pool are closed"""
+        with self._lock:
+            key = self._keys.pop(conn, None)
+        if conn.closed:
+            return
+        if key is None:
+            conn.close()
+            return
+        try:
+            conn.rollback()
+            if getattr(conn, 'autocommit', False):
+                conn.autocommit = False
+        except Exception:                                               # pylint: disable=broad-except
+            LOG.debug('discarding connection that failed to rollback')
+            self.stats['discarded'] += 1
+            conn.close()
+            return
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close_connections(self, conns):
+        """Closes the given connections, dropping any that are idle from the pool"""
+        conns = list(conns)
+        with self._lock:
+            for key, idle in self._idle.items():
+                self._idle[key] = [conn for conn in idle if not any(
+                    conn is other for other in conns)]
+            for conn in conns:
+                self._keys.pop(conn, None)
+        for conn in conns:
+            if not conn.closed:
+                conn.close()
+
+    def close_all(self):
+        """Closes all idle connections"""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                if not conn.closed:
+                    conn.close()
+
+
+POOL = ConnectionPool()
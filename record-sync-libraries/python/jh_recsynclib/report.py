@@ -0,0 +1,134 @@
+# Copyright 2017 Ryan D. Williams
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Sync run reports
+
+Timings and record counts for the phases of a sync run.
+"""
+
+__author__ = 'Ryan D. Williams <rdw@drws-office.com>'
+
+# Standard library imports
+import sys
+import json
+import time
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+LOG = logging.getLogger(__name__)
+
+monotonic = getattr(time, 'monotonic', time.time)
+
+
+def peak_rss_kb():
+    """Returns the peak resident set size of this process in KB or None if
+    it cannot be determined on this platform"""
+    if not resource:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports KB, macOS bytes
+    if sys.platform == 'darwin':
+        rss = rss // 1024
+    return rss
+
+
+class RunReport(object):
+    """Collects the timings of a sync run.
+
+    Each phase records the seconds spent in it and optionally the number of
+    records it handled.  Entering a phase with the same name again adds to
+    the existing totals.
+
+    Example:
+        report = RunReport('department', 'changes')
+        with report.phase('source_fetch') as phase:
+            src = get_source()
+            phase['records'] = len(src)
+        report.log()
+    """
+
+    def __init__(self, record_type, sync_type):
+        """Inits a RunReport and starts its clock
+
+        Args:
+            record_type: string. record type being synced
+            sync_type: string. changes or full
+        """
+        self.record_type = record_type
+        self.sync_type = sync_type
+        self.phases = OrderedDict()
+        self.info = {}
+        self.result = None
+        self.records_applied = 0
+        self._start = monotonic()
+        self._end = None
+
+    @contextmanager
+    def phase(self, name):
+        """Context manager timing the enclosed block as the named phase.
+        Yields the phase dictionary so a record count can be set on it"""
+        entry = self.phases.setdefault(name, {'seconds': 0.0, 'records': None})
+        start = monotonic()
+        try:
+            yield entry
+        finally:
+            entry['seconds'] += monotonic() - start
+
+    def finish(self, result):
+        """Stops the clock and records the result of the run"""
+        self._end = monotonic()
+        self.result = result
+
+    @property
+    def total_seconds(self):
+        """Seconds since the report was started or until it was finished"""
+        return (self._end or monotonic()) - self._start
+
+    def as_dict(self):
+        """Returns the report as a dictionary"""
+        total = self.total_seconds
+        phases = OrderedDict()
+        for name, entry in self.phases.items():
+            phases[name] = {'seconds': round(entry['seconds'], 6)}
+            if entry['records'] is not None:
+                phases[name]['records'] = entry['records']
+                if entry['seconds']:
+                    phases[name]['records_per_second'] = round(
+                        entry['records'] / entry['seconds'], 1)
+        report = OrderedDict((
+            ('record_type', self.record_type),
+            ('sync_type', self.sync_type),
+            ('result', self.result),
+            ('total_seconds', round(total, 6)),
+            ('records_applied', self.records_applied),
+            ('records_per_second', round(self.records_applied / total, 1) if total else None),
+            ('peak_rss_kb', peak_rss_kb()),
+            ('phases', phases)))
+        report.update(sorted(self.info.items()))
+        return report
+
+    def to_json(self):
+        """Returns the report as a JSON string"""
+        return json.dumps(self.as_dict())
+
+    def log(self):
+        """Logs the report as a single JSON line"""
+        LOG.info('sync run report: %s', self.to_json())
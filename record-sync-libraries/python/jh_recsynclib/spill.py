@@ -0,0 +1,179 @@
+# Copyright 2017 Ryan D. Williams
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Bounded memory datasets
+
+Footprint estimates for datasets being fetched and hash partitioned disk
+storage used when a sync's datasets would not fit in its memory budget.
+"""
+
+__author__ = 'Ryan D. Williams <rdw@drws-office.com>'
+
+# Standard library imports
+import os
+import re
+import sys
+import shutil
+import hashlib
+import logging
+import tempfile
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+# Local imports
+from jh_recsynclib.checkpoint import record_key
+
+
+LOG = logging.getLogger(__name__)
+
+_SIZE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+
+
+def parse_size(value):
+    """Returns a size in bytes from an int or a string such as 512M or 2G"""
+    if isinstance(value, (int, float)):
+        return int(value)
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([kmg]?)b?\s*$', str(value), re.IGNORECASE)
+    if not match:
+        raise SpillException('invalid size: {}'.format(value))
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).lower()])
+
+
+def record_footprint(record):
+    """Returns an estimate of the bytes used by a JHRecord"""
+    size = sys.getsizeof(record) + sys.getsizeof(vars(record))
+    size += sys.getsizeof(getattr(record, '_conf', None))
+    for value in dict.values(record):
+        size += sys.getsizeof(value)
+    return size
+
+
+class FootprintEstimator(object):
+    """Estimates the memory used by records as they are fetched.
+
+    The first records are all measured, after that only one in every
+    sample_every, and the average is applied to the total count.
+    """
+
+    def __init__(self, measure_first=100, sample_every=50):
+        self.count = 0
+        self._measure_first = measure_first
+        self._sample_every = sample_every
+        self._sampled = 0
+        self._sampled_bytes = 0
+
+    def add(self, record):
+        """Counts a record"""
+        self.count += 1
+        if self.count <= self._measure_first or self.count % self._sample_every == 0:
+            self._sampled += 1
+            self._sampled_bytes += record_footprint(record)
+
+    @property
+    def total(self):
+        """Estimated bytes used by the records counted"""
+        if not self._sampled:
+            return 0
+        return int(float(self._sampled_bytes) / self._sampled * self.count)
+
+
+class SpilledDatasets(object):
+    """Source and destination datasets spilled to disk.
+
+    Records are split into partitions by a hash of their primary key, so
+    a source record and the destination record it matches always land in
+    the same partition, and each partition can be diffed on its own.
+    Records are stored as pickled dictionaries and rebuilt with the factory
+    of the first record added for each location.
+
+    Example:
+        spill = SpilledDatasets(32)
+        spill.add('source', s_rec)
+        spill.add('destination', d_rec)
+        for src, dst in spill.partitions():
+            changes = JHRecordSyncer(src, dst)
+        spill.close()
+    """
+
+    LOCATIONS = ('source', 'destination')
+
+    def __init__(self, num_partitions, directory=None):
+        """Inits SpilledDatasets
+
+        Args:
+            num_partitions: int. number of partitions
+            directory: optional. directory the partition files are created in.
+                defaults to the system temp directory
+        """
+        self.num_partitions = num_partitions
+        self.counts = {loc: 0 for loc in self.LOCATIONS}
+        self._dir = tempfile.mkdtemp(prefix='jh_recsync_spill_', dir=directory)
+        self._factories = {}
+        self._files = {
+            (loc, num): open(os.path.join(self._dir, '{}.{}'.format(loc, num)), 'wb')
+            for loc in self.LOCATIONS for num in range(num_partitions)}
+        LOG.debug('spilling datasets to %s in %s partitions', self._dir, num_partitions)
+
+    def partition_of(self, record):
+        """Returns the partition number for a JHRecord"""
+        # md5 rather than the crc32 used by shard_of, partitions of a shard
+        # would otherwise be correlated with the shard and mostly empty
+        digest = hashlib.md5(record_key(record).encode('utf-8')).hexdigest()
+        return int(digest[:8], 16) % self.num_partitions
+
+    def add(self, location, record):
+        """Writes a record to its partition
+
+        Args:
+            location: string. source or destination
+            record: JHRecord
+        """
+        if location not in self._factories:
+            self._factories[location] = record.factory
+        pickle.dump(
+            dict(record.all_items()), self._files[(location, self.partition_of(record))],
+            pickle.HIGHEST_PROTOCOL)
+        self.counts[location] += 1
+
+    def partitions(self):
+        """Yields a (source set, destination set) tuple of JHRecords for each partition"""
+        for _fh in self._files.values():
+            _fh.flush()
+        for num in range(self.num_partitions):
+            yield tuple(self._load(loc, num) for loc in self.LOCATIONS)
+
+    def _load(self, location, num):
+        records = set()
+        factory = self._factories.get(location)
+        with open(os.path.join(self._dir, '{}.{}'.format(location, num)), 'rb') as _fh:
+            while True:
+                try:
+                    records.add(factory.create(pickle.load(_fh)))
+                except EOFError:
+                    break
+        return records
+
+    def close(self):
+        """Closes and removes the partition files"""
+        for _fh in self._files.values():
+            _fh.close()
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+
+class SpillException(Exception):
+    "Exception class for bounded memory dataset issues"
+    pass
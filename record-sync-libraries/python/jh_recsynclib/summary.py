@@ -0,0 +1,125 @@
+# Copyright 2017 Ryan D. Williams
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Change summaries
+
+Aggregated view of the changes made by a sync run, logged in place of the
+per record messages for dry runs and large change sets.
+"""
+
+__author__ = 'Ryan D. Williams <rdw@drws-office.com>'
+
+# Standard library imports
+from collections import OrderedDict
+
+from builtins import str as text
+
+
+class ChangeSummary(object):
+    """Counts the changes of a sync run.
+
+    Keeps the number of records added, removed and modified, how many
+    modified records changed each attribute, and the first sample_size
+    records of each operation.
+
+    Example:
+        summary = ChangeSummary('department', sample_size=5)
+        summary.add(s_rec)
+        summary.modify(s_rec, d_rec)
+        for line in summary.lines('jazzhands'):
+            LOG.info(line)
+    """
+
+    OPERATIONS = ('add', 'remove', 'modify')
+
+    def __init__(self, record_type, sample_size=10):
+        """Inits a ChangeSummary
+
+        Args:
+            record_type: string. record type being synced
+            sample_size: int. records kept per operation
+        """
+        self.record_type = record_type
+        self.sample_size = sample_size
+        self.counts = OrderedDict((opr, 0) for opr in self.OPERATIONS)
+        self.attributes = {}
+        self.samples = {opr: [] for opr in self.OPERATIONS}
+
+    def _count(self, opr, sample):
+        self.counts[opr] += 1
+        if len(self.samples[opr]) < self.sample_size:
+            self.samples[opr].append(sample())
+
+    def add(self, record):
+        """Counts an added record"""
+        self._count('add', lambda: text(record.primary_key))
+
+    def remove(self, record):
+        """Counts a removed record"""
+        self._count('remove', lambda: text(record.primary_key))
+
+    def modify(self, s_rec, d_rec, changed=None):
+        """Counts a modified record
+
+        Args:
+            s_rec: source JHRecord
+            d_rec: destination JHRecord
+            changed: optional. d_rec.diff(s_rec) if the caller already has it
+        """
+        if changed is None:
+            changed = d_rec.diff(s_rec)
+        for attr in changed:
+            self.attributes[attr] = self.attributes.get(attr, 0) + 1
+        self._count('modify', lambda: {
+            'key': text(s_rec.primary_key),
+            'changes': {attr: [text(d_rec.get(attr)), text(val)]
+                        for attr, val in changed.items()}})
+
+    @property
+    def total(self):
+        """Total number of changes counted"""
+        return sum(self.counts.values())
+
+    def as_dict(self):
+        """Returns the summary as a dictionary"""
+        return OrderedDict((
+            ('counts', dict(self.counts)),
+            ('attributes', OrderedDict(self._sorted_attributes())),
+            ('samples', self.samples)))
+
+    def lines(self, destination):
+        """Returns the summary as log messages
+
+        Args:
+            destination: string. destination subsystem name used in the messages
+        """
+        lines = ['Change summary for {} in {}: added {}, removed {}, modified {}'.format(
+            self.record_type, destination,
+            self.counts['add'], self.counts['remove'], self.counts['modify'])]
+        for attr, count in self._sorted_attributes():
+            lines.append('{}.{} changed on {} records'.format(self.record_type, attr, count))
+        for opr, verb in (('add', 'Added'), ('remove', 'Removed')):
+            for key in self.samples[opr]:
+                lines.append('Sample: {} {}:{}'.format(verb, self.record_type, key))
+        for sample in self.samples['modify']:
+            lines.append('Sample: Modified {}:{} {}'.format(
+                self.record_type, sample['key'], ', '.join(
+                    '{} from {} to {}'.format(attr, old, new)
+                    for attr, (old, new) in sorted(sample['changes'].items()))))
+        if any(self.counts[opr] > len(self.samples[opr]) for opr in self.OPERATIONS):
+            lines.append('Samples limited to {} records per operation'.format(self.sample_size))
+        return lines
+
+    def _sorted_attributes(self):
+        return sorted(self.attributes.items(), key=lambda item: (-item[1], item[0]))
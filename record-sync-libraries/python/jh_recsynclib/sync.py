@@ -20,7 +20,11 @@ Classes to support syncing records between datasources.
 __author__ = 'Ryan D. Williams <rdw@drws-office.com>'
 
 # Standard library imports
+import copy
 import json
+import itertools
+import time
+import zlib
 import logging
 import argparse
 
@@ -28,11 +32,40 @@ from builtins import str as text
 
 # Local imports
 from jh_recsynclib import PackageError
+from jh_recsynclib.checkpoint import SyncCheckpoint, record_key
+from jh_recsynclib.governor import WriteGovernor
+from jh_recsynclib.report import RunReport, monotonic
+from jh_recsynclib.summary import ChangeSummary
+from jh_recsynclib.spill import FootprintEstimator, SpilledDatasets, parse_size
+from jh_recsynclib.utils import JHRecordFactory
 
 
 LOG = logging.getLogger(__name__)
 
 
+def parse_shard(value):
+    """Parses an INDEX/COUNT shard argument into an (index, count) tuple.
+    Indexes start at 0"""
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'shard must be given as INDEX/COUNT, e.g. 0/4: {}'.format(value))
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(
+            'shard index must be between 0 and COUNT - 1: {}'.format(value))
+    return index, count
+
+
+def shard_of(record, count):
+    """Returns the shard a JHRecord belongs to out of count shards.
+
+    Uses crc32 of the primary key so every host and process, whatever its
+    python version or hash seed, assigns a record to the same shard.
+    """
+    return (zlib.crc32(record_key(record).encode('utf-8')) & 0xffffffff) % count
+
+
 class SyncOptions(object):
     """Class provides an extensible arguments parser with defaults required
     by all feeds."""
@@ -71,6 +104,9 @@ class SyncOptions(object):
         self.parser.add_argument(
             '--logging-conf', dest='logging_conf',
             help='override default AN syslogger conf file.')
+        self.parser.add_argument(
+            '--shard', dest='shard', type=parse_shard, default=None, metavar='INDEX/COUNT',
+            help='only sync the records whose primary key hashes to shard INDEX of COUNT')
         if args:
             self.parser.add_argument(*args, **kwargs)
 
@@ -196,40 +232,224 @@ class SyncBase(object):                     # pylint: disable=too-many-instance-
                 Used to indicate that this sync interacts with JazzHands. If you enable this
                 you must also provide appauthal_app_name
             'appauthal_app_name': str - required only with use_jazzhands_db flag
+            'checkpoint_file': str - optional. path used to track the progress of
+                a changes sync. only used with allow_partial_updates. a rerun
+                after a failure whose source and destination still match the
+                checkpoint applies the remaining changes without diffing again
+            'checkpoint_fsync': bool - defaults to False
+                Sync the checkpoint file to disk after every commit so it also
+                survives the host going down, at the cost of an fsync per commit
+            'cache_destination_dataset': bool - defaults to False
+                Keep the destination dataset between runs of a long lived sync
+                (see SyncDaemon) and apply the changes made by each run to it
+                instead of fetching the destination again. Dropped after any run
+                with failures.
+            'destination_cache_ttl': int - defaults to 300. seconds a cached
+                destination dataset may be used before it is fetched again, which
+                is when changes made outside the sync are picked up
+            'savepoint_isolation': bool - defaults to False. only used with
+                allow_partial_updates. each record is applied inside a savepoint
+                and a failing record only rolls back its own savepoint. changes are
+                then commited in batches instead of after every record, the per
+                record events are held and commited along with them
+            'commit_interval_records': int - defaults to 100. with savepoint_isolation,
+                commit after this many applied records
+            'commit_interval_seconds': number - defaults to 5. with savepoint_isolation,
+                commit once this many seconds have passed since the last commit
+            'attach_run_report': bool - defaults to False. append the JSON run report
+                (see RunReport) to the message of the ExecutionStopped event. the
+                report is always logged at the end of a run and available as
+                self.report
+            'metrics_textfile': str - optional. path of a textfile the sync metrics
+                are written to at the end of every run. see jh_recsynclib.metrics
+            'metrics_format': str - ['prometheus', 'openmetrics'] - defaults to
+                'prometheus', the format read by the node-exporter textfile
+                collector. text format of the metrics_textfile
+            'write_governor': dict - optional. paces the writes made by the apply
+                hooks. keys are the WriteGovernor arguments, e.g.
+                {"max_rate": 200, "max_concurrency": 8, "target_latency": 0.25}.
+                writes are only made concurrently by subclasses that set
+                CONCURRENT_WRITES and never with savepoint_isolation
+            'summary_logging': bool - defaults to False. log a ChangeSummary (counts,
+                changed attribute histogram and a sample of records) instead of a
+                message per record. dry runs skip the per record events entirely.
+                real runs are only summarized above summary_logging_threshold and
+                still write every event to the event log DB
+            'summary_logging_threshold': int - optional. with summary_logging, real
+                runs with more changes than this are summarized. never when unset
+            'summary_sample_size': int - defaults to 10. records per operation kept
+                in the summary sample
+            'prepared_statement_cache_size': int - optional. with use_jazzhands_db,
+                run the UPDATEs of JHDBRecordInterface.update_jh_record as prepared
+                statements, keeping at most this many prepared. hit and miss
+                counts are added to the run report
+            'tuple_rows': bool - defaults to False. with use_jazzhands_db,
+                JHDBRecordInterface.query_jh_record and iter_jh_records fetch
+                plain tuples and build the records positionally instead of
+                going through a DictRow per row
+            'combine_table_updates': bool - defaults to False. with use_jazzhands_db,
+                JHDBRecordInterface.update_jh_record updates a record spanning
+                several tables with one statement instead of one per table
+            'pkey_cache_dir': str - optional. with use_jazzhands_db, directory the
+                primary keys read from the JazzHands catalog are cached in
+            'pkey_schema_version': str - optional. with use_jazzhands_db, version
+                the primary key cache is keyed by instead of a digest of the catalog.
+                change it to pick up schema changes. without it every run still
+                reads the digest from the catalog
+            'full_sync_chunk_size': int - optional. full syncs stream the records
+                from _iter_source_dataset to _update_destination_chunk this many at
+                a time instead of passing the whole source to _update_destination.
+                with allow_partial_updates every chunk is commited
+            'full_sync_progress_interval': int - defaults to 10. with
+                full_sync_chunk_size, log an ExecutionProgress event every this
+                many chunks. feedlogs DBs bootstrapped before the event type
+                existed need feedlogger/ddl/upgrade_execution_progress.sql
+            'memory_budget': int or str - optional. bytes, or a size such as
+                '512M', the datasets of a changes sync may use. the footprint of
+                the records from _iter_source_dataset and _iter_destination_dataset
+                is estimated as they arrive and once it nears the budget the
+                datasets are spilled to disk and diffed one hash partition at a
+                time. the strategy used is recorded in the run report.
+                checkpoint_file is not used by partitioned runs
+            'spill_directory': str - optional. directory spilled datasets are
+                written to. defaults to the system temp directory
+            'spill_partitions': int - defaults to 64. number of partitions spilled
+                datasets are split into
+            'server_side_diff': bool - defaults to False. with use_jazzhands_db,
+                diff a changes sync inside JazzHands instead of fetching the
+                destination. the source is COPYed into a temporary table and
+                compared with the query from _get_destination_query, only the
+                differences are read back. checkpoint_file, memory_budget and
+                cache_destination_dataset are not used
         }
+
+    Subclasses that can count their records cheaply (e.g. SELECT count(*))
+    should implement _count_source and _count_destination.  The counts are
+    checked against the safety limits before any dataset is fetched: the
+    difference between them is the least number of changes the sync will make,
+    so a truncated source aborts the run before the transfer starts.
+
+    With --shard INDEX/COUNT the source and destination datasets are limited to
+    the records whose primary key hashes to that shard, so COUNT hosts or
+    processes can split one record type between them.  The safety limits are
+    evaluated against the shard and checkpoint files get a shard suffix.  Full
+    syncs replace the whole destination and cannot be sharded.  With
+    server_side_diff the destination query is not sharded, so the shard's
+    destination size used by the safety limits is an estimate: the query's row
+    count divided by COUNT.  A shard holding more than its share of the rows
+    gets a tighter limit, one holding less a looser one.
+
+    Subclasses whose _add_record, _rm_record and _modify_record are thread safe
+    and do not depend on a shared transaction (e.g. calls to a REST API) can set
+    CONCURRENT_WRITES to True to let the write governor apply several records at
+    once.  Event logging, checkpoints and commits stay in the calling thread.
     """
 
-    def __init__(self, record_type, args, record_sync_logger_key='record_sync_logger_conf'):
+    CONCURRENT_WRITES = False
+    SAVEPOINT_NAME = 'jh_recsync_record'
+    DEFAULT_COMMIT_INTERVAL_RECORDS = 100
+    DEFAULT_COMMIT_INTERVAL_SECONDS = 5
+    DEFAULT_SUMMARY_SAMPLE_SIZE = 10
+    DEFAULT_PROGRESS_INTERVAL = 10
+    DEFAULT_SPILL_PARTITIONS = 64
+    DEFAULT_DESTINATION_CACHE_TTL = 300
+    # the datasets only get this share of memory_budget, the rest is left for
+    # the indexes and change sets built from them
+    MEMORY_BUDGET_DATASET_FRACTION = 0.5
+
+    def __init__(self, record_type, args, record_sync_logger_key='record_sync_logger_conf',
+                 connection_factory=None):
         """Inits a Sync.
 
         Args:
             args: argparse namespace object (should come from SyncOptions)
+            connection_factory: optional. callable taking an appauthal app name and
+                driver kwargs and returning a DB connection. used for both the
+                JazzHands and the event logger connections. see SyncOrchestrator
         """
         self.record_type = record_type
         self._dry_run = args.dry_run
         self._max_percent = args.max_percent
         self._force = args.force
         self._conf_file = args.conf_file
+        # namespaces from parsers other than SyncOptions may not have a shard
+        self._shard = getattr(args, 'shard', None)
         self._req_attrs = None
         self._record_sync_logger_key = record_sync_logger_key
+        self._connection_factory = connection_factory
         self._sl = SafetyLimiter(max_p=self._max_percent, force=self._force)
+        self._failures = 0
+        self._applied = None
         self._conf = self._load_conf(self._conf_file)
-        if self._conf.get('use_jazzhands_db', False):
-            try:
-                # local import - have to do this here so there is no hard dependency on JH
-                try:
-                    from jh_recsynclib.db import JHDBRecordInterface
-                except ImportError:
-                    raise PackageError('DB functionality requires jazzhands_appauthal package')
-                self.dbh = JHDBRecordInterface(
-                    self._conf['appauthal_app_name'], record_type, conf=self._conf)
-            except KeyError:
-                raise SyncException(
-                    'use_jazzhands_db option requires you to provide appauthal_app_name as well')
-        else:
-            self.dbh = None
+        # the loggers write defaults into their section of _conf, so reloads
+        # compare against the file as it was loaded
+        self._loaded_conf = copy.deepcopy(self._conf)
+        self._metrics = self._init_metrics()
+        self.dbh = self._init_db_handle()
         self._feedlgr = self._init_event_logger()
         self._sync_type = self._conf.get('sync_type', 'changes')
+        self._checkpoint = self._init_checkpoint()
+        self._governor = self._init_governor()
+        self._dst_snapshot = None
+        self._dst_fetched_at = None
+        self._summary = None
+        self._in_chunk = False
+        self.report = None
+
+    def reload_conf(self):
+        """Rereads the configuration file.
+
+        If the configuration changed the database handle and event logger are
+        recreated with it and the cached JazzHands record definitions are
+        dropped. The current handle and logger are only replaced once the new
+        ones have been created, so a configuration that cannot be loaded or
+        applied is ignored and the current one is kept.
+
+        Returns:
+            True if the configuration was reloaded, False if it was unchanged
+            or could not be used
+        """
+        try:
+            conf = self._load_conf(self._conf_file)
+        except (IOError, OSError, ValueError) as exc:
+            LOG.error('Unable to reload %s, keeping current configuration: %s',
+                      self._conf_file, exc)
+            return False
+        if conf == self._loaded_conf:
+            LOG.info('Configuration unchanged')
+            return False
+        LOG.info('Reloading configuration from %s', self._conf_file)
+        loaded_conf = copy.deepcopy(conf)
+        old_conf, old_metrics = self._conf, self._metrics
+        dbh = None
+        # the _init methods read _conf and _metrics, point them at the new
+        # configuration while building and put the old ones back on failure
+        self._conf = conf
+        try:
+            self._metrics = self._init_metrics()
+            dbh = self._init_db_handle()
+            feedlgr = self._init_event_logger()
+            checkpoint = self._init_checkpoint()
+            governor = self._init_governor()
+        except Exception as exc:                                        # pylint: disable=broad-except
+            if dbh:
+                dbh.close()
+            self._conf, self._metrics = old_conf, old_metrics
+            LOG.error('Unable to apply %s, keeping current configuration: %s',
+                      self._conf_file, exc)
+            return False
+        if self.dbh:
+            self.dbh.close()
+        self._feedlgr.close()
+        self._loaded_conf = loaded_conf
+        self.dbh = dbh
+        self._feedlgr = feedlgr
+        self._sync_type = self._conf.get('sync_type', 'changes')
+        self._checkpoint = checkpoint
+        self._governor = governor
+        self._dst_snapshot = None
+        JHRecordFactory.clear_definition_cache()
+        return True
 
     def run_sync(self, sync_type=None, operations=('add', 'remove', 'modify')):
         """Runs the sync process.
@@ -244,6 +464,16 @@ class SyncBase(object):                     # pylint: disable=too-many-instance-
         """
         if not sync_type:
             sync_type = self._sync_type
+        # reset the per run state, a sync object may be run many times
+        self._sl = SafetyLimiter(max_p=self._max_percent, force=self._force)
+        self._failures = 0
+        self._uncommitted = 0
+        self._last_commit = time.time()
+        self.report = RunReport(self.record_type, sync_type)
+        if self._shard:
+            if sync_type == 'full':
+                raise SyncException('full syncs cannot be sharded')
+            self.report.info['shard'] = '{}/{}'.format(*self._shard)
         if sync_type == 'changes':
             return self._changes_sync(operations)
         elif sync_type == 'full':
@@ -268,26 +498,86 @@ class SyncBase(object):                     # pylint: disable=too-many-instance-
         """commences a full sync, taking all the data from the source and
         pushing it into the destination.  Object level data will not be logged
         as this would be needlessly noisy and not provide useful info"""
+        if self._conf.get('full_sync_chunk_size'):
+            return self._chunked_full_sync(self._conf['full_sync_chunk_size'])
         self._feedlgr.start()
         try:
-            records = self._get_source_dataset()
+            self._preflight_check()
+            with self.report.phase('source_fetch') as phase:
+                records = self._get_source_dataset()
+                phase['records'] = len(records)
             LOG.debug('source dataset contains %s records', len(records))
             LOG.debug('attempting to update destination')
-            self._update_destination(records)
+            with self.report.phase('update_destination') as phase:
+                self._update_destination(records)
+                phase['records'] = len(records)
             LOG.debug('update complete')
         except Exception as exc:
             LOG.exception(exc)
             LOG.debug('Rolling back any uncommited changes')
             self.rollback()
-            self._feedlgr.fail(exc)
+            self._fail(exc)
             raise exc
         if not self._dry_run:
-            self.commit()
+            with self.report.phase('commit'):
+                self.commit()
+            self.report.records_applied = len(records)
             LOG.info('Successfully updated: %s', len(records))
         else:
             self.rollback()
             LOG.info('Dry Run. Would have updated: %s', len(records))
-        self._feedlgr.success()
+        self._success()
+        return True
+
+    def _chunked_full_sync(self, chunk_size):
+        """full sync streaming the source to the destination in chunks of
+        chunk_size records"""
+        interval = self._conf.get('full_sync_progress_interval', self.DEFAULT_PROGRESS_INTERVAL)
+        self._feedlgr.start()
+        total = 0
+        chunk_number = 0
+        try:
+            self._preflight_check()
+            source = iter(self._iter_source_dataset())
+            while True:
+                with self.report.phase('source_fetch') as phase:
+                    chunk = list(itertools.islice(source, chunk_size))
+                    phase['records'] = (phase['records'] or 0) + len(chunk)
+                if not chunk:
+                    break
+                chunk_number += 1
+                with self.report.phase('update_destination') as phase:
+                    self._in_chunk = True
+                    try:
+                        self._update_destination_chunk(chunk, chunk_number)
+                    finally:
+                        self._in_chunk = False
+                    phase['records'] = (phase['records'] or 0) + len(chunk)
+                total += len(chunk)
+                LOG.debug('chunk %s: updated %s records', chunk_number, len(chunk))
+                if self._check_partial():
+                    with self.report.phase('commit'):
+                        self.commit()
+                    self.report.records_applied = total
+                if chunk_number % interval == 0:
+                    self._feedlgr.progress('Processed {} chunks, {} records'.format(
+                        chunk_number, total))
+        except Exception as exc:
+            LOG.exception(exc)
+            LOG.debug('Rolling back any uncommited changes')
+            self.rollback()
+            self._fail(exc)
+            raise exc
+        self.report.info['chunks'] = chunk_number
+        if not self._dry_run:
+            with self.report.phase('commit'):
+                self.commit()
+            self.report.records_applied = total
+            LOG.info('Successfully updated: %s in %s chunks', total, chunk_number)
+        else:
+            self.rollback()
+            LOG.info('Dry Run. Would have updated: %s in %s chunks', total, chunk_number)
+        self._success()
         return True
 
     def _changes_sync(self, operations):
@@ -296,68 +586,400 @@ class SyncBase(object):                     # pylint: disable=too-many-instance-
         operations passed. looks for ['add', 'remove', 'modify']"""
         #mark the start of execution in the db
         self._feedlgr.start()
+        spill = None
         try:
             LOG.debug('operations requested: %s', operations)
-            src = self._get_source_dataset()
-            LOG.debug('source dataset contains %s records', len(src))
-            dst = self._get_destination_dataset()
-            LOG.debug('destination dataset contains %s records', len(dst))
-            dos = JHRecordSyncer(src, dst)
-            if 'add' in operations:
-                adds = dos.get_additions()
-                LOG.debug('%s records to be added', len(adds))
-            else:
-                adds = set()
-            if 'remove' in operations:
-                rms = dos.get_removals()
-                LOG.debug('%s records to be removed', len(rms))
-            else:
-                rms = set()
-            if 'modify' in operations:
-                mods = dos.get_modifications()
-                LOG.debug('%s records to be modified', len(mods))
+            self._preflight_check()
+            if self._conf.get('server_side_diff'):
+                dst = None
+                counts = self._server_side_changes(operations)
             else:
-                mods = set()
-            self._sl.set_total_records(len(dst))
-            self._sl.add_changes(len(adds) + len(rms) + len(mods))
-            if not self._sl.check_changes():
-                raise SyncException(self._sl.get_error_str())
-            #run operations and collect any failures
-            if not (adds or rms or mods):
+                if self._conf.get('memory_budget'):
+                    src, dst, spill = self._budgeted_fetch()
+                else:
+                    src, dst = self._fetch_datasets()
+                if spill:
+                    counts = self._partitioned_changes(spill, operations)
+                else:
+                    counts = self._in_memory_changes(src, dst, operations)
+            if not counts:
                 LOG.info('No changes found. Exiting')
-                self._feedlgr.success()
+                self._clear_checkpoint()
+                self._save_destination_snapshot(None if spill else dst)
+                self._success()
                 return True
-            if 'add' in operations:
-                LOG.debug('attempting to add new records')
-                self._add_records(adds)
-                LOG.debug('additions complete')
-            if 'remove' in operations:
-                LOG.debug('attempting to remove records')
-                self._rm_records(rms)
-                LOG.debug('removals complete')
-            if 'modify' in operations:
-                LOG.debug('attempting to modify records')
-                self._modify_records(mods)
-                LOG.debug('modifications complete')
         except Exception as exc:
             LOG.exception(exc)
             LOG.debug('Rolling back any uncommited changes')
             self.rollback()
-            self._feedlgr.fail(exc)
+            self._fail(exc)
+            self._applied = None
+            self._dst_snapshot = None
             raise exc
+        finally:
+            if spill:
+                spill.close()
+        adds, rms, mods = counts
         if not self._dry_run:
-            self.commit()
+            with self.report.phase('commit'):
+                self.commit()
+            self._save_destination_snapshot(None if spill else dst)
             LOG.info(
-                'Successfully added: %s, modified: %s, removed: %s',
-                len(adds), len(mods), len(rms))
+                'Successfully added: %s, modified: %s, removed: %s', adds, mods, rms)
         else:
             self.rollback()
             LOG.info(
                 'Dry Run. Would have added: %s, modified: %s,'
-                ' removed: %s', len(adds), len(mods), len(rms))
-        self._feedlgr.success()
+                ' removed: %s', adds, mods, rms)
+        self._clear_checkpoint()
+        self._success()
         return True
 
+    def _preflight_check(self):
+        """checks the source and destination record counts against the safety
+        limits before anything is fetched. skipped unless both _count_source and
+        _count_destination are implemented"""
+        with self.report.phase('preflight_count'):
+            src_count = self._count_source()
+            dst_count = None if src_count is None else self._count_destination()
+        if src_count is None or dst_count is None:
+            return
+        LOG.debug('pre-flight counts: source %s, destination %s', src_count, dst_count)
+        self.report.info['preflight_counts'] = {'source': src_count, 'destination': dst_count}
+        if not dst_count:
+            return
+        limiter = SafetyLimiter(max_p=self._max_percent, t_rec=dst_count, force=self._force)
+        limiter.add_changes(abs(dst_count - src_count))
+        if not limiter.check_changes():
+            raise SyncException(
+                'Pre-flight check failed, source has {} records and destination {}. {}'.format(
+                    src_count, dst_count, limiter.get_error_str()))
+
+    def _fetch_datasets(self):
+        """gets the source and destination datasets, limited to this sync's
+        shard. returns a (source, destination) tuple of sets"""
+        with self.report.phase('source_fetch') as phase:
+            src = self._get_source_dataset()
+            phase['records'] = len(src)
+        LOG.debug('source dataset contains %s records', len(src))
+        with self.report.phase('destination_fetch') as phase:
+            dst = self._get_destination_snapshot()
+            phase['records'] = len(dst)
+        LOG.debug('destination dataset contains %s records', len(dst))
+        if self._shard:
+            with self.report.phase('shard_filter') as phase:
+                src = self._filter_shard(src)
+                dst = self._filter_shard(dst)
+                phase['records'] = len(src) + len(dst)
+            LOG.debug(
+                'shard %s/%s contains %s source and %s destination records',
+                self._shard[0], self._shard[1], len(src), len(dst))
+        return src, dst
+
+    def _budgeted_fetch(self):
+        """gets the source and destination datasets while estimating their
+        memory footprint. once the estimate passes MEMORY_BUDGET_DATASET_FRACTION
+        of memory_budget every record is spilled to disk instead.
+
+        Returns:
+            tuple of (source set, destination set, SpilledDatasets or None).
+            the sets are empty when the datasets were spilled
+        """
+        budget = parse_size(self._conf['memory_budget'])
+        limit = budget * self.MEMORY_BUDGET_DATASET_FRACTION
+        estimator = FootprintEstimator()
+        datasets = {'source': set(), 'destination': set()}
+        spill = None
+        for location, fetch in (('source', self._iter_source_dataset),
+                                ('destination', self._iter_destination_dataset)):
+            with self.report.phase('{}_fetch'.format(location)) as phase:
+                count = 0
+                for record in fetch():
+                    if self._shard and not self._in_shard(record):
+                        continue
+                    count += 1
+                    estimator.add(record)
+                    if spill:
+                        spill.add(location, record)
+                        continue
+                    datasets[location].add(record)
+                    if estimator.total > limit:
+                        LOG.warning(
+                            'estimated dataset size of %s bytes is close to the memory budget'
+                            ' of %s bytes, spilling datasets to disk', estimator.total, budget)
+                        spill = SpilledDatasets(
+                            self._conf.get('spill_partitions', self.DEFAULT_SPILL_PARTITIONS),
+                            self._conf.get('spill_directory'))
+                        for loc, records in datasets.items():
+                            for rec in records:
+                                spill.add(loc, rec)
+                            records.clear()
+                phase['records'] = count
+            LOG.debug('%s dataset contains %s records', location, count)
+        self.report.info['memory_strategy'] = 'partitioned' if spill else 'in_memory'
+        self.report.info['estimated_dataset_bytes'] = estimator.total
+        return datasets['source'], datasets['destination'], spill
+
+    def _in_memory_changes(self, src, dst, operations):
+        """diffs the datasets and applies the changes.
+
+        Returns:
+            tuple of the number of (additions, removals, modifications)
+            or None if there were no changes
+        """
+        changes = None
+        if self._checkpoint:
+            with self.report.phase('checkpoint_resume'):
+                changes = self._checkpoint.resume(src, dst, operations)
+        if changes:
+            adds, rms, mods = changes
+        else:
+            adds, rms, mods = self._get_changes(src, dst, operations)
+            if self._checkpoint:
+                with self.report.phase('checkpoint_begin'):
+                    self._checkpoint.begin(src, dst, operations, adds, rms, mods)
+        self._check_safety(len(dst), len(adds) + len(rms) + len(mods))
+        if not (adds or rms or mods):
+            return None
+        if self._conf.get('cache_destination_dataset') and not self._dry_run:
+            self._applied = []
+        self._start_apply(len(adds) + len(rms) + len(mods))
+        self._apply_changes(adds, rms, mods, operations)
+        self._finish_apply()
+        return len(adds), len(rms), len(mods)
+
+    def _partitioned_changes(self, spill, operations):
+        """diffs and applies the changes one spilled partition at a time. the
+        partitions are read twice, once to count the changes for the safety
+        limits and once to apply them. checkpoints are not used.
+
+        Returns:
+            tuple of the number of (additions, removals, modifications)
+            or None if there were no changes
+        """
+        counts = [0, 0, 0]
+        with self.report.phase('partition_count'):
+            for src, dst in spill.partitions():
+                dos = JHRecordSyncer(src, dst)
+                for num, (opr, func) in enumerate((
+                        ('add', dos.get_additions), ('remove', dos.get_removals),
+                        ('modify', dos.get_modifications))):
+                    if opr in operations:
+                        counts[num] += len(func())
+        LOG.debug('%s records to be added, %s removed and %s modified', *counts)
+        self._check_safety(spill.counts['destination'], sum(counts))
+        if not sum(counts):
+            return None
+        checkpoint, self._checkpoint = self._checkpoint, None
+        try:
+            self._start_apply(sum(counts))
+            for src, dst in spill.partitions():
+                adds, rms, mods = self._get_changes(src, dst, operations)
+                self._apply_changes(adds, rms, mods, operations)
+            self._finish_apply()
+        finally:
+            self._checkpoint = checkpoint
+        return tuple(counts)
+
+    def _server_side_changes(self, operations):
+        """diffs the source against the destination query inside JazzHands and
+        applies the changes. checkpoints are not used.
+
+        Returns:
+            tuple of the number of (additions, removals, modifications)
+            or None if there were no changes
+        """
+        if not self.dbh:
+            raise SyncException('server_side_diff requires the use_jazzhands_db option')
+        self.report.info['diff_strategy'] = 'server_side'
+        with self.report.phase('source_fetch') as phase:
+            src = self._get_source_dataset()
+            if self._shard:
+                src = self._filter_shard(src)
+            phase['records'] = len(src)
+        LOG.debug('source dataset contains %s records', len(src))
+        with self.report.phase('server_diff') as phase:
+            adds, rms, mods, dst_count = self.dbh.diff_jh_records(
+                src, self._get_destination_query(), operations=operations)
+            if self._shard:
+                rms = self._filter_shard(rms)
+                # the query covers every shard, assume this one holds its
+                # share. approximate, see the class docstring
+                dst_count //= self._shard[1]
+            phase['records'] = len(adds) + len(rms) + len(mods)
+        LOG.debug(
+            'destination contains %s records, %s to be added, %s removed and %s modified',
+            dst_count, len(adds), len(rms), len(mods))
+        self._check_safety(dst_count, len(adds) + len(rms) + len(mods))
+        if not (adds or rms or mods):
+            return None
+        checkpoint, self._checkpoint = self._checkpoint, None
+        try:
+            self._start_apply(len(adds) + len(rms) + len(mods))
+            self._apply_changes(adds, rms, mods, operations)
+            self._finish_apply()
+        finally:
+            self._checkpoint = checkpoint
+        return len(adds), len(rms), len(mods)
+
+    def _check_safety(self, total_records, changes):
+        """raises a SyncException if the changes are over the safety limits"""
+        self._sl.set_total_records(total_records)
+        self._sl.add_changes(changes)
+        if not self._sl.check_changes():
+            raise SyncException(self._sl.get_error_str())
+
+    def _start_apply(self, changes):
+        "sets up change summaries before any change is applied"
+        self._summary = self._init_summary(changes)
+        self._feedlgr.record_syslog = self._summary is None
+        # the events of records applied since the last commit must not be
+        # commited before the records are
+        self._feedlgr.hold_events = self._check_savepoints()
+
+    def _finish_apply(self):
+        "logs the change summary once all changes are applied"
+        if self._summary:
+            self.report.info['change_summary'] = self._summary.as_dict()
+            self._feedlgr.log_summary(self._summary)
+
+    def _apply_changes(self, adds, rms, mods, operations):
+        "applies the changes for the operations passed to the destination"
+        if 'add' in operations:
+            LOG.debug('attempting to add new records')
+            with self.report.phase('apply_add') as phase:
+                self._add_records(adds)
+                phase['records'] = (phase['records'] or 0) + len(adds)
+            LOG.debug('additions complete')
+        if 'remove' in operations:
+            LOG.debug('attempting to remove records')
+            with self.report.phase('apply_remove') as phase:
+                self._rm_records(rms)
+                phase['records'] = (phase['records'] or 0) + len(rms)
+            LOG.debug('removals complete')
+        if 'modify' in operations:
+            LOG.debug('attempting to modify records')
+            with self.report.phase('apply_modify') as phase:
+                self._modify_records(mods)
+                phase['records'] = (phase['records'] or 0) + len(mods)
+            LOG.debug('modifications complete')
+
+    def _get_changes(self, src, dst, operations):
+        """compares the source and destination datasets and returns a tuple of
+        the (additions, removals, modifications) for the operations passed"""
+        with self.report.phase('diff_index'):
+            dos = JHRecordSyncer(src, dst)
+        if 'add' in operations:
+            with self.report.phase('diff_additions') as phase:
+                adds = dos.get_additions()
+                phase['records'] = (phase['records'] or 0) + len(adds)
+            LOG.debug('%s records to be added', len(adds))
+        else:
+            adds = set()
+        if 'remove' in operations:
+            with self.report.phase('diff_removals') as phase:
+                rms = dos.get_removals()
+                phase['records'] = (phase['records'] or 0) + len(rms)
+            LOG.debug('%s records to be removed', len(rms))
+        else:
+            rms = set()
+        if 'modify' in operations:
+            with self.report.phase('diff_modifications') as phase:
+                mods = dos.get_modifications()
+                phase['records'] = (phase['records'] or 0) + len(mods)
+            LOG.debug('%s records to be modified', len(mods))
+        else:
+            mods = set()
+        return adds, rms, mods
+
+    def _success(self):
+        """logs the successful end of the run to the event logger and the run report"""
+        self._add_report_stats()
+        msg = None
+        if self._conf.get('attach_run_report'):
+            # the attached report is a snapshot taken before the feedlog flush
+            self.report.result = 'success'
+            msg = 'Sync Execution Completed Successfully. Run report: {}'.format(
+                self.report.to_json())
+        with self.report.phase('feedlog_flush'):
+            self._feedlgr.success(msg)
+        self.report.finish('success')
+        self.report.log()
+        self._export_metrics()
+
+    def _fail(self, exc):
+        """logs the failed run to the event logger and the run report"""
+        self._add_report_stats()
+        with self.report.phase('feedlog_flush'):
+            self._feedlgr.fail(exc)
+        self.report.finish('failed')
+        self.report.log()
+        self._export_metrics()
+
+    def _add_report_stats(self):
+        """adds the state of the write governor and statement cache to the run report"""
+        if self._governor:
+            self.report.info['write_governor'] = self._governor.stats()
+        if self.dbh and self.dbh.statement_cache:
+            self.report.info['prepared_statements'] = dict(self.dbh.statement_cache.stats)
+
+    def _init_metrics(self):
+        """Returns the process metrics registry if metrics are configured"""
+        if not self._conf.get('metrics_textfile'):
+            return None
+        from jh_recsynclib.metrics import REGISTRY
+        return REGISTRY
+
+    def _observe_apply(self, opr, seconds, success):
+        """records the outcome and latency of applying a single record"""
+        if not self._metrics:
+            return
+        opr = {'rm': 'remove'}.get(opr, opr)
+        result = 'success' if success else 'failure'
+        self._metrics.counter(
+            'jh_recsync_records', 'Records applied to the destination',
+            ['record_type', 'operation', 'result']).inc(
+                record_type=self.record_type, operation=opr, result=result)
+        self._metrics.histogram(
+            'jh_recsync_record_apply_seconds', 'Time taken to apply a single record',
+            ['record_type', 'operation']).observe(
+                seconds, record_type=self.record_type, operation=opr)
+
+    def _export_metrics(self):
+        """adds the run report to the metrics and writes the metrics textfile"""
+        if not self._metrics:
+            return
+        report = self.report
+        self._metrics.counter(
+            'jh_recsync_runs', 'Sync runs completed', ['record_type', 'result']).inc(
+                record_type=self.record_type, result=report.result)
+        self._metrics.gauge(
+            'jh_recsync_last_run_timestamp_seconds', 'Time the last sync run ended',
+            ['record_type', 'result']).set(
+                time.time(), record_type=self.record_type, result=report.result)
+        self._metrics.gauge(
+            'jh_recsync_last_run_records_per_second', 'Records applied per second by the last run',
+            ['record_type']).set(
+                report.as_dict()['records_per_second'] or 0, record_type=self.record_type)
+        phase_hist = self._metrics.histogram(
+            'jh_recsync_phase_seconds', 'Time spent in each phase of a sync run',
+            ['record_type', 'phase'])
+        for name, entry in report.phases.items():
+            phase_hist.observe(entry['seconds'], record_type=self.record_type, phase=name)
+        if self._governor:
+            self._metrics.gauge(
+                'jh_recsync_write_rate', 'Writes per second allowed by the write governor',
+                ['record_type']).set(self._governor.rate or 0, record_type=self.record_type)
+            self._metrics.gauge(
+                'jh_recsync_write_concurrency', 'Concurrent writes allowed by the write governor',
+                ['record_type']).set(self._governor.concurrency, record_type=self.record_type)
+        try:
+            self._metrics.write_textfile(
+                self._conf['metrics_textfile'],
+                openmetrics=self._conf.get('metrics_format') == 'openmetrics')
+        except (IOError, OSError) as exc:
+            LOG.error('Unable to write metrics to %s: %s', self._conf['metrics_textfile'], exc)
+
     def throw_exception(self, exception):
         """This function takes an Exception, logs it and then raises it.  Used to handle
         and log exceptions outside of the canned functions.  useful for sublcasses to bail
@@ -372,7 +994,96 @@ class SyncBase(object):                     # pylint: disable=too-many-instance-
         conf = self._conf[self._record_sync_logger_key]
         if self._dry_run:
             conf['dry_run'] = True
-        return JHRecordSyncLogger(conf)
+        return JHRecordSyncLogger(
+            conf, connection_factory=self._connection_factory, metrics=self._metrics)
+
+    def _init_db_handle(self):
+        """Returns a JHDBRecordInterface if the configuration asks for one"""
+        if not self._conf.get('use_jazzhands_db', False):
+            return None
+        try:
+            # local import - have to do this here so there is no hard dependency on JH
+            try:
+                from jh_recsynclib.db import JHDBRecordInterface
+            except ImportError:
+                raise PackageError('DB functionality requires jazzhands_appauthal package')
+            return JHDBRecordInterface(
+                self._conf['appauthal_app_name'], self.record_type,
+                connection_factory=self._connection_factory, conf=self._conf)
+        except KeyError:
+            raise SyncException(
+                'use_jazzhands_db option requires you to provide appauthal_app_name as well')
+
+    def _init_checkpoint(self):
+        """Returns a SyncCheckpoint if one is configured and can be used"""
+        if self._conf.get('checkpoint_file') and self._check_partial():
+            path = self._conf['checkpoint_file']
+            if self._shard:
+                path = '{}.shard{}of{}'.format(path, *self._shard)
+            return SyncCheckpoint(path, fsync=self._conf.get('checkpoint_fsync', False))
+        return None
+
+    def _in_shard(self, record):
+        """Returns True if the record belongs to this sync's shard"""
+        return shard_of(record, self._shard[1]) == self._shard[0]
+
+    def _filter_shard(self, records):
+        """Returns the records belonging to this sync's shard"""
+        return {record for record in records if self._in_shard(record)}
+
+    def _init_summary(self, changes):
+        """Returns a ChangeSummary if this run's changes are to be summarized"""
+        if not self._conf.get('summary_logging'):
+            return None
+        threshold = self._conf.get('summary_logging_threshold')
+        if not self._dry_run and (threshold is None or changes <= threshold):
+            return None
+        return ChangeSummary(self.record_type, self._conf.get(
+            'summary_sample_size', self.DEFAULT_SUMMARY_SAMPLE_SIZE))
+
+    def _init_governor(self):
+        """Returns a WriteGovernor if one is configured"""
+        if not self._conf.get('write_governor'):
+            return None
+        return WriteGovernor.from_conf(self._conf['write_governor'])
+
+    def _get_destination_snapshot(self):
+        """Returns the cached destination dataset if there is a current one,
+        otherwise gets it from the destination"""
+        ttl = self._conf.get('destination_cache_ttl')
+        if ttl is None:
+            ttl = self.DEFAULT_DESTINATION_CACHE_TTL
+        if self._dst_snapshot is not None and time.time() - self._dst_fetched_at < ttl:
+            LOG.debug('using cached destination dataset')
+            return set(self._dst_snapshot.values())
+        self._dst_snapshot = None
+        self._dst_fetched_at = time.time()
+        return self._get_destination_dataset()
+
+    def _save_destination_snapshot(self, dst):
+        """Caches the destination dataset with the changes applied by this run"""
+        applied, self._applied = self._applied, None
+        if not self._conf.get('cache_destination_dataset') or self._dry_run:
+            return
+        if dst is None:
+            # the datasets were spilled to disk, too large to keep
+            self._dst_snapshot = None
+            return
+        if self._failures:
+            LOG.debug('not caching destination dataset, run had failures')
+            self._dst_snapshot = None
+            return
+        snapshot = {rec.primary_key: rec for rec in dst}
+        for opr, record, d_rec in applied or ():
+            if opr == 'add':
+                snapshot[d_rec.primary_key] = d_rec
+            elif opr == 'remove':
+                snapshot.pop(record.primary_key, None)
+            elif opr == 'modify':
+                new_rec = copy.copy(d_rec)
+                new_rec.update(record.items())
+                snapshot[new_rec.primary_key] = new_rec
+        self._dst_snapshot = snapshot
 
     def _check_recs_req_attrs(self, records):
         """Verifies if a set of JHRecords have the fields required
@@ -404,7 +1115,13 @@ class SyncBase(object):                     # pylint: disable=too-many-instance-
         "takes an operation and an exception and handles it"
         LOG.error(u'Failed to %s: %s', opr, obj)
         LOG.exception(exc)
+        self._failures += 1
+        if self._check_savepoints():
+            self.rollback_to_savepoint()
+            return
         self.rollback()
+        if self._checkpoint:
+            self._checkpoint.discard()
         if self._conf.get('allow_partial_updates'):
             return
         raise exc
@@ -412,53 +1129,206 @@ class SyncBase(object):                     # pylint: disable=too-many-instance-
     def _check_partial(self):
         return bool(self._conf.get('allow_partial_updates') and not self._dry_run)
 
+    def _check_savepoints(self):
+        return bool(self._conf.get('savepoint_isolation') and self._check_partial())
+
     def _commit_if_partial(self):
-        "if allow_partial_updates is True, commit events immiedately"
-        if self._check_partial():
+        """if allow_partial_updates is True, commit events immiedately. with
+        savepoint_isolation commit once the commit interval has been reached"""
+        if not self._check_partial():
+            return
+        if self._check_savepoints():
+            self._uncommitted += 1
+            max_recs = self._conf.get(
+                'commit_interval_records', self.DEFAULT_COMMIT_INTERVAL_RECORDS)
+            max_secs = self._conf.get(
+                'commit_interval_seconds', self.DEFAULT_COMMIT_INTERVAL_SECONDS)
+            if self._uncommitted < max_recs and time.time() - self._last_commit < max_secs:
+                return
+            LOG.debug('commit interval reached, commiting %s changes', self._uncommitted)
+        else:
             LOG.debug('allow_partial_updates true, commiting last change')
-            self.commit()
+        self.commit()
+        self._uncommitted = 0
+        self._last_commit = time.time()
+        if self._checkpoint:
+            self._checkpoint.flush()
+
+    def _apply(self, opr, record, func, *args):
+        """Calls func with args to apply a single record to the destination.
+        Failures are handled by _handle_op_exception.
+
+        Returns:
+            tuple of (success boolean, value returned by func)
+        """
+        if self._check_savepoints():
+            self.savepoint()
+        if self._governor:
+            self._governor.acquire()
+        start = monotonic()
+        try:
+            result = func(*args)
+        except Exception as exc:                                        # pylint: disable=broad-except
+            self._applied_one(opr, monotonic() - start, False)
+            self._handle_op_exception(opr, record, exc)
+            return False, None
+        self._applied_one(opr, monotonic() - start, True)
+        return True, result
+
+    def _applied_one(self, opr, seconds, success):
+        "reports a write made by _apply to the write governor and the metrics"
+        if self._governor:
+            self._governor.release(seconds, success)
+        self._observe_apply(opr, seconds, success)
+
+    def _concurrent_writes(self):
+        return bool(
+            self.CONCURRENT_WRITES and self._governor and
+            self._governor.max_concurrency > 1 and not self._check_savepoints())
+
+    def _apply_all(self, opr, items, func, arg=None):
+        """Applies func to each item, concurrently if the subclass and the write
+        governor allow it. Failures are handled by _handle_op_exception.
+
+        Args:
+            opr: string. operation name used for logging and metrics
+            items: iterable of records or record tuples
+            func: callable applying a single record
+            arg: optional. callable returning the record func is called with
+                for an item. defaults to the item itself
+
+        Yields:
+            tuple of (item, success boolean, value returned by func)
+        """
+        arg = arg or (lambda item: item)
+        if not self._concurrent_writes():
+            for item in items:
+                record = arg(item)
+                success, result = self._apply(opr, record, func, record)
+                yield item, success, result
+            return
+        calls = ((item, arg(item)) for item in items)
+        results = self._governor.imap_unordered(lambda call: func(call[1]), calls)
+        try:
+            for (item, record), success, result, seconds in results:
+                self._observe_apply(opr, seconds, success)
+                if not success:
+                    self._handle_op_exception(opr, record, result)
+                    yield item, False, None
+                    continue
+                yield item, True, result
+        finally:
+            results.close()
+
+    def _add_record_checked(self, s_rec):
+        "calls _add_record and verifies it returned the new record"
+        d_rec = self._add_record(s_rec)
+        if not d_rec:
+            raise SyncException('No object returned from self._add_record(obj)')
+        return d_rec
+
+    def _mark_done(self, opr, record, d_rec=None):
+        """records a successfully applied change in the checkpoint and for the
+        destination cache if either is in use"""
+        self.report.records_applied += 1
+        if self._checkpoint:
+            self._checkpoint.mark_done(opr, record)
+        if self._applied is not None:
+            self._applied.append((opr, record, d_rec))
+
+    def _clear_checkpoint(self):
+        "removes the checkpoint once every change has been applied"
+        if self._checkpoint:
+            self._checkpoint.clear()
 
     def _add_records(self, records):
         "Add a set of records into the destination."
-        for s_rec in records:
-            if not self._dry_run:
-                try:
-                    #create a new object and store the result in a temporary variable
-                    d_rec = self._add_record(s_rec)
-                    if not d_rec:
-                        raise SyncException('No object returned from self._add_record(obj)')
-                except Exception as exc:                                # pylint: disable=broad-except
-                    self._handle_op_exception('add', s_rec, exc)
-            else:
-                d_rec = s_rec
+        if self._dry_run:
+            for s_rec in records:
+                if self._summary:
+                    self._summary.add(s_rec)
+                else:
+                    self._feedlgr.add_record(s_rec, s_rec)
+            return
+        for s_rec, success, d_rec in self._apply_all('add', records, self._add_record_checked):
+            if not success:
+                continue
+            self._mark_done('add', s_rec, d_rec)
             self._feedlgr.add_record(s_rec, d_rec)
+            if self._summary:
+                self._summary.add(s_rec)
             self._commit_if_partial()
 
     def _rm_records(self, records):
         "Remove a set of records from the destination."
-        for d_rec in records:
-            if not self._dry_run:
-                try:
-                    self._rm_record(d_rec)
-                except Exception as exc:                                # pylint: disable=broad-except
-                    self._handle_op_exception('rm', d_rec, exc)
+        if self._dry_run:
+            for d_rec in records:
+                if self._summary:
+                    self._summary.remove(d_rec)
+                else:
+                    self._feedlgr.rm_record(d_rec)
+            return
+        for d_rec, success, _ in self._apply_all('rm', records, self._rm_record):
+            if not success:
+                continue
+            self._mark_done('remove', d_rec)
             self._feedlgr.rm_record(d_rec)
+            if self._summary:
+                self._summary.remove(d_rec)
             self._commit_if_partial()
 
     def _modify_records(self, records):
         """Update a set of records in the destination using a tuple of
         JHRecords. (source_record, destination_record)"""
-        for o_t in records:
-            s_rec, d_rec = o_t
-            record = d_rec.diff(s_rec)
-            if not self._dry_run:
-                try:
-                    self._modify_record(record)
-                except Exception as exc:                                # pylint: disable=broad-except
-                    self._handle_op_exception('modify', record, exc)
+        if self._dry_run:
+            for s_rec, d_rec in records:
+                if self._summary:
+                    self._summary.modify(s_rec, d_rec)
+                else:
+                    self._feedlgr.modify_record(s_rec, d_rec)
+            return
+        results = self._apply_all(
+            'modify', records, self._modify_record, arg=lambda o_t: o_t[1].diff(o_t[0]))
+        for (s_rec, d_rec), success, _ in results:
+            if not success:
+                continue
+            self._mark_done('modify', s_rec, d_rec)
             self._feedlgr.modify_record(s_rec, d_rec)
+            if self._summary:
+                self._summary.modify(s_rec, d_rec)
             self._commit_if_partial()
 
+    def bulk_load(self, records, table=None, operations=('add', 'modify')):
+        """Loads records into a JazzHands table with
+        JHDBRecordInterface.bulk_load_jh_records and logs the number of rows
+        added, modified and removed. Meant for _update_destination and
+        _update_destination_chunk of syncs with a JazzHands destination.
+
+        With 'remove' in operations the removals are checked against the
+        safety limits before anything is deleted.  'remove' can not be used
+        from _update_destination_chunk, a chunk is only part of the source.
+
+        Returns:
+            the counts dictionary returned by bulk_load_jh_records
+        """
+        if not self.dbh:
+            raise SyncException('bulk_load requires the use_jazzhands_db option')
+        safety_check = None
+        if 'remove' in operations:
+            if self._in_chunk:
+                raise SyncException(
+                    "bulk_load can not 'remove' from _update_destination_chunk, "
+                    'a chunk is only part of the source')
+            safety_check = self._check_safety
+        counts = self.dbh.bulk_load_jh_records(
+            records, table=table, operations=operations, safety_check=safety_check)
+        totals = self.report.info.setdefault('bulk_load', {})
+        for opr in ('staged', 'add', 'modify', 'remove'):
+            totals[opr] = totals.get(opr, 0) + counts[opr]
+        if not self._dry_run:
+            self._feedlgr.bulk_load(counts)
+        return counts
+
     def commit(self):
         """Commit changes. Generally will just be used with self.dbh.commit()
         for database feeds.  This class is meant to be overloaded if you have
@@ -476,6 +1346,31 @@ class SyncBase(object):                     # pylint: disable=too-many-instance-
             self.dbh.rollback()
         self._feedlgr.rollback()
 
+    def savepoint(self):
+        """Sets a savepoint before a record is applied. Only used with
+        savepoint_isolation. Generally will just be self.dbh.savepoint(). Meant to
+        be overloaded if you implement your own transactional endpoint"""
+        if self.dbh:
+            self.dbh.savepoint(self.SAVEPOINT_NAME)
+
+    def rollback_to_savepoint(self):
+        """Rolls back the record being applied to the last savepoint. Only used
+        with savepoint_isolation. Meant to be overloaded along with savepoint"""
+        if self.dbh:
+            self.dbh.rollback_to_savepoint(self.SAVEPOINT_NAME)
+
+    def _count_source(self):
+        """Returns the number of records in the sync source without fetching
+        them, or None if that is not possible. Used by the pre-flight check,
+        optional. Should count the whole source, not just this sync's shard"""
+        return None
+
+    def _count_destination(self):
+        """Returns the number of records in the sync destination without
+        fetching them, or None if that is not possible. Used by the pre-flight
+        check, optional"""
+        return None
+
     def _get_source_dataset(self):
         "Get set of JHRecords from the sync source.  Must be implemented"
         raise NotImplementedError
@@ -484,6 +1379,12 @@ class SyncBase(object):                     # pylint: disable=too-many-instance-
         "Get set of JHRecords from the sync destination. Must be implemented"
         raise NotImplementedError
 
+    def _get_destination_query(self):
+        """Returns the SQL query selecting the destination records from
+        JazzHands, column names matching the attribute names. Must be
+        implemented to use server_side_diff"""
+        raise NotImplementedError
+
     def _add_record(self, obj):
         """Add a set of records into the destination. Must be implemented
 
@@ -504,6 +1405,31 @@ class SyncBase(object):                     # pylint: disable=too-many-instance-
         Must be implemented"""
         raise NotImplementedError
 
+    def _iter_source_dataset(self):
+        """Returns an iterable of the JHRecords in the sync source. Only used
+        with full_sync_chunk_size and memory_budget. Defaults to
+        _get_source_dataset, override to stream the source instead of loading it
+        all at once"""
+        return self._get_source_dataset()
+
+    def _iter_destination_dataset(self):
+        """Returns an iterable of the JHRecords in the sync destination. Only
+        used with memory_budget. Defaults to the (possibly cached) destination
+        dataset, override to stream the destination"""
+        return self._get_destination_snapshot()
+
+    def _update_destination_chunk(self, records, chunk_number):
+        """Write one chunk of a chunked full sync to the destination. Must be
+        implemented to use full_sync_chunk_size. Rows missing from a chunk may
+        be in a later one, so nothing may be removed based on a chunk and
+        bulk_load refuses 'remove' here
+
+        Args:
+            records: list of JHRecords
+            chunk_number: int. number of the chunk, starting at 1
+        """
+        raise NotImplementedError
+
 
 class JHRecordSyncLogger(object):
     """Logs JHRecord changes to JH.  Also logs to the default
@@ -540,11 +1466,13 @@ class JHRecordSyncLogger(object):
         }
     }
 
-    def __init__(self, conf):
+    def __init__(self, conf, connection_factory=None, metrics=None):
         """Inits a JHRecordSyncLogger
 
         Args:
             conf: recsync_logger_conf configuration dictionary
+            connection_factory: optional. passed on to the FeedLogger
+            metrics: optional. MetricsRegistry passed on to the FeedLogger
 
         Required Keys:
             source_subsystem: string. Source subsystem type.
@@ -563,6 +1491,15 @@ class JHRecordSyncLogger(object):
             allow_partial_updates: bool - instructs the logger to log events immiedately. turns
                 on autocommit.
 
+        Setting record_syslog to False stops the per record syslog messages,
+        events are still sent to the Sync Logs DB.  Used when a ChangeSummary
+        is logged with log_summary instead.
+
+        Setting hold_events to True keeps the per record events in memory
+        until commit, so they reach the Sync Logs DB together with the
+        destination changes they report, even with allow_partial_updates.
+        rollback drops them.  Used with savepoint_isolation.
+
         Object Attribute Map Dictionary:
             {
                 'record_type': {
@@ -581,7 +1518,8 @@ class JHRecordSyncLogger(object):
             if 'appauthal_app_name' not in self._conf:
                 self._conf['appauthal_app_name'] = self.DEFAULT_APP_NAME
             try:
-                self._feedlgr = FeedLogger(self._conf)
+                self._feedlgr = FeedLogger(
+                    self._conf, connection_factory=connection_factory, metrics=metrics)
             except FeedLoggerException as exc:
                 raise _JHRecordSyncLoggerException(
                     'Logging dictionary missing values. Message from FeedLogger: {}'.format(exc))
@@ -598,6 +1536,10 @@ class JHRecordSyncLogger(object):
         self._syslog = conf.get('syslog', True)
         self._priority = conf.get('priority', 'info')
         self._partial = self._conf.get('allow_partial_updates')
+        self.record_syslog = True
+        self.hold_events = False
+        self._held_events = []
+        self._progress_type = None
 
     def add_record(self, s_rec, d_rec):
         """takes source and destination JH record and logs addtion to subsystem
@@ -634,22 +1576,71 @@ class JHRecordSyncLogger(object):
             self._full_dest_subsys_name)
         self._log_event(self._get_etype('modify'), self._priority, msg, 'modify', s_rec, d_rec)
 
+    def log_summary(self, summary):
+        """Logs a ChangeSummary to syslog"""
+        if not self._syslog:
+            return
+        for line in summary.lines(self._full_dest_subsys_name):
+            self._log_message(line)
+
     def commit(self):
-        """commit log entries to JH"""
+        """commit log entries to JH, sending any held events first"""
         if self._dblog:
+            held, self._held_events = self._held_events, []
+            for event in held:
+                self._feedlgr.log_event(*event)
             self._feedlgr.commit()
 
     def rollback(self):
-        """rollback log entries to JH"""
+        """rollback log entries to JH and drop any held events"""
+        self._held_events = []
         if self._dblog:
             self._feedlgr.rollback()
 
+    def close(self):
+        """Close the connection to the event log DB"""
+        if self._dblog:
+            self._feedlgr.close()
+
     def start(self):
         """Log a the start of a feed run"""
+        if self._dblog:
+            self._feedlgr.ensure_session()
         self._log_event('ExecutionStarted', self._priority, 'Sync Execution Started')
         if self._dblog:
             self._feedlgr.commit()
 
+    def bulk_load(self, counts):
+        """Log the result of a bulk load as an ExecutionProgress event
+
+        Args:
+            counts: dictionary returned by JHDBRecordInterface.bulk_load_jh_records
+        """
+        msg = 'Bulk loaded {} into {} {}: added {}, modified {}, removed {}'.format(
+            counts['staged'], self._full_dest_subsys_name, counts['table'],
+            counts['add'], counts['modify'], counts['remove'])
+        self._log_progress(msg)
+
+    def progress(self, msg):
+        """Log and commit an ExecutionProgress event"""
+        self._log_progress(msg)
+        self.commit()
+
+    def _log_progress(self, msg):
+        """Logs an ExecutionProgress event. Feedlogs DBs deployed before the
+        event type was added only get the syslog message"""
+        if self._dblog and self._progress_type is None:
+            self._progress_type = self._feedlgr.has_event_type('ExecutionProgress')
+            if not self._progress_type:
+                LOG.warning(
+                    'event type ExecutionProgress is missing from the feedlogs DB, '
+                    'apply upgrade_execution_progress.sql. progress is only sent to syslog')
+        if self._dblog and not self._progress_type:
+            if self._syslog:
+                self._log_message(msg)
+            return
+        self._log_event('ExecutionProgress', self._priority, msg)
+
     def fail(self, msg=None):
         """Log failure and rollback any uncommited events"""
         if not msg:
@@ -661,10 +1652,11 @@ class JHRecordSyncLogger(object):
         if self._dblog:
             self._feedlgr.end_session()
 
-    def success(self):
+    def success(self, msg=None):
         """Commit any open event log items and an ExecutionStopped event"""
-        self._log_event(
-            'ExecutionStopped', self._priority, 'Sync Execution Completed Successfully')
+        if not msg:
+            msg = 'Sync Execution Completed Successfully'
+        self._log_event('ExecutionStopped', self._priority, msg)
         self.commit()
         if self._dblog:
             self._feedlgr.end_session()
@@ -782,8 +1774,11 @@ class JHRecordSyncLogger(object):
                 attrs = self._get_rec_attrs(action, s_rec, d_rec)
             else:
                 attrs = None
-            self._feedlgr.log_event(event_type, priority, message, attrs)
-        if self._syslog:
+            if action and self.hold_events:
+                self._held_events.append((event_type, priority, message, attrs))
+            else:
+                self._feedlgr.log_event(event_type, priority, message, attrs)
+        if self._syslog and (self.record_syslog or not action):
             self._log_message(message)
             if action == 'modify':
                 attrs = self._get_update_fields(s_rec, d_rec)
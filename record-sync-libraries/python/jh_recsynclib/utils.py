@@ -27,9 +27,8 @@ from collections import OrderedDict
 from copy import deepcopy
 from csv import reader as _reader, DictReader as _DictReader
 
-# Third-party imports
-import pkg_resources
-import jsonschema
+
+SCHEMA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'json_schema')
 
 
 class TemplatedDict(dict):
@@ -232,11 +231,20 @@ class JHRecord(TemplatedDict):
         pkeys = self._conf['primary_keys']
         if len(pkeys) == 1:
             return self[pkeys[0]]
-        return (self[attr] for attr in pkeys)
+        return tuple(self[attr] for attr in pkeys)
 
     def __hash__(self):
         return hash(self.primary_key)
 
+    @classmethod
+    def _from_validated(cls, conf, *args, **kwargs):
+        """Creates a JHRecord from a conf that has already been validated.
+        Used by JHRecordFactory.create_many"""
+        record = cls.__new__(cls)
+        record._conf = conf
+        TemplatedDict.__init__(record, conf['attribute_template'], *args, **kwargs)
+        return record
+
     def check_req_attrs(self):
         """Checks for the record for the attributes labeled as required in jh.
 
@@ -255,9 +263,13 @@ class JHRecordFactory(object):
     """Creates JHRecords and sets configuration from JH.
 
     Helper class that creates a JHRecord with primary key pulled from
-    JH based on the object_type supplied
+    JH based on the object_type supplied.  Definitions pulled from JH are
+    cached for the life of the process so later factories for the same
+    record type do not have to query JH again.
     """
 
+    _definition_cache = {}
+
     def __init__(self, record_type, rec_def=None, db_handle=None, def_dir=None):
         """Inits JHRecordFactory to produce JHRecord objects.
 
@@ -292,7 +304,10 @@ class JHRecordFactory(object):
             self._rec_def = rec_def
         elif db_handle:
             dbh = db_handle
-            self._rec_def = self._get_record_definition_jh(dbh)
+            self._rec_def = self._definition_cache.get(record_type)
+            if not self._rec_def:
+                self._rec_def = self._get_record_definition_jh(dbh)
+                self._definition_cache[record_type] = self._rec_def
             dbh.close()
         elif def_dir:
             if not os.path.isdir(def_dir):
@@ -316,6 +331,21 @@ class JHRecordFactory(object):
         """The record types required attributes"""
         return self._rec_def['required_attributes']
 
+    @classmethod
+    def get_cached_definition(cls, record_type):
+        """Returns the cached JH definition of record_type or None"""
+        return cls._definition_cache.get(record_type)
+
+    @classmethod
+    def cache_definition(cls, record_type, rec_def):
+        """Caches a definition of record_type pulled from JH by other means"""
+        cls._definition_cache[record_type] = rec_def
+
+    @classmethod
+    def clear_definition_cache(cls):
+        """Forgets all record definitions pulled from JH"""
+        cls._definition_cache.clear()
+
     def _validate_def(self):
         vconf = JHRecordSyncConfigValidator('record_definition')
         vconf.validate_conf(self._rec_def)
@@ -349,18 +379,43 @@ class JHRecordFactory(object):
         Returns:
             JHRecord
         """
-        conf = {
+        return JHRecord(self._record_conf(), *args, **kwargs)
+
+    def create_many(self, rows, columns=None):
+        """Creates a JHRecord from each row.
+
+        The record configuration is built and validated once and shared by
+        all the records, instead of once per record as with create.
+
+        Args:
+            rows: iterable of dictionaries or DictRows, or of tuples of values
+                when columns is given
+            columns: optional. sequence of the attribute names of the values
+                in each row, e.g. the column names of a cursor description
+
+        Returns:
+            list of JHRecords
+        """
+        conf = self._record_conf()
+        JHRecordSyncConfigValidator('record').validate_conf(conf)
+        if columns is None:
+            return [JHRecord._from_validated(conf, row) for row in rows]
+        columns = tuple(columns)
+        return [JHRecord._from_validated(conf, zip(columns, row)) for row in rows]
+
+    def _record_conf(self):
+        return {
             'record_type': self.record_type, 'primary_keys': self.primary_keys,
             'attribute_template': self.attribute_template, 'factory': self,
             'required_attributes': self.required_attributes}
-        return JHRecord(conf, *args, **kwargs)
 
 
 class JHRecordSyncConfigValidator(object):
     """JHRecordSyncConfigValidator Class
 
     We use JSON Schema validation to ensure configuration dictionaries have the
-    required parameters.
+    required parameters.  Schemas are loaded and compiled once per config type
+    and shared by all validators for the life of the process.
 
     Examples:
         confv = JHRecordSyncConfigValidator('record_definition')
@@ -369,6 +424,9 @@ class JHRecordSyncConfigValidator(object):
     Raises:
         ConfigError
     """
+
+    _compiled = {}
+
     def __init__(self, config_type):
         """Inits a JHRecordSyncConfigValidator
 
@@ -379,19 +437,26 @@ class JHRecordSyncConfigValidator(object):
             JHRecordSyncConfigValidator object
         """
         self._config_type = config_type
-        schema_file = 'json_schema/{}.json'.format(config_type)
-        if pkg_resources.resource_exists('jh_recsynclib', schema_file):
-            self._schema_file = pkg_resources.resource_filename('jh_recsynclib', schema_file)
-        else:
-            self._schema_file = os.path.join(
-                os.path.split(__file__)[0], '{}.json'.format(config_type))
-        with open(self._schema_file, 'r') as _fh:
-            self.schema = json.load(_fh)
+        if config_type not in self._compiled:
+            # jsonschema and the schema files are only loaded once a config is
+            # validated, keeping them out of the import time of this module
+            import jsonschema
+            schema_file = os.path.join(SCHEMA_DIR, '{}.json'.format(config_type))
+            if not os.path.exists(schema_file):
+                schema_file = os.path.join(
+                    os.path.dirname(__file__), '{}.json'.format(config_type))
+            with open(schema_file, 'r') as _fh:
+                schema = json.load(_fh)
+            validator_cls = jsonschema.validators.validator_for(schema)
+            validator_cls.check_schema(schema)
+            self._compiled[config_type] = (schema_file, schema, validator_cls(schema))
+        self._schema_file, self.schema, self._validator = self._compiled[config_type]
 
     def validate_conf(self, conf):
         """Takes a conf dict and compares it against the schema declared in init"""
+        import jsonschema
         try:
-            jsonschema.validate(conf, self.schema)
+            self._validator.validate(conf)
         except jsonschema.ValidationError as exc:
             raise ConfigError(exc)
 
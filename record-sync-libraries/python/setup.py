@@ -40,7 +40,7 @@ setup(
     author_email = 'xrxdxwx@gmail.com',
     license = license,
     url = 'http://www.jazzhands.net/',
-    packages = find_packages(),
+    packages = find_packages(exclude=['benchmarks', 'benchmarks.*', 'tests']),
     package_data = {'jh_recsynclib': ['json_schema/*.json']},
     classifiers = classifiers
 )
@@ -0,0 +1,207 @@
+"""In-memory stand-ins used by the tests"""
+
+# Standard library imports
+import os
+import json
+import shutil
+import tempfile
+
+# Local imports
+from context import jh_recsynclib                                      # pylint: disable=unused-import
+from jh_recsynclib.sync import SyncBase, SyncOptions
+from jh_recsynclib.utils import JHRecordFactory
+
+
+FACTORY = JHRecordFactory('thing', rec_def={
+    'required_attributes': ['id', 'name'],
+    'optional_attributes': ['val'],
+    'primary_keys': ['id']})
+
+
+def make_records(count, start=0, val='a'):
+    """Returns a set of count thing records with ids from start"""
+    return {FACTORY.create(id=num, name='n{}'.format(num), val=val)
+            for num in range(start, start + count)}
+
+
+class TransactionalStore(object):
+    """Destination and stand-in JHDBI in one. Writes are only visible in
+    committed once commit is called, savepoints work like the database ones"""
+
+    statement_cache = None
+
+    def __init__(self, records=()):
+        self.committed = {rec.primary_key: rec for rec in records}
+        self._pending = []
+        self._savepoint = None
+        self.calls = []
+
+    def write(self, opr, record):
+        """Queues a write in the current transaction"""
+        self._pending.append((opr, record))
+
+    def commit(self):
+        self.calls.append('commit')
+        for opr, record in self._pending:
+            if opr == 'remove':
+                self.committed.pop(record.primary_key, None)
+            else:
+                self.committed[record.primary_key] = record
+        self._pending = []
+        self._savepoint = None
+
+    def rollback(self):
+        self.calls.append('rollback')
+        self._pending = []
+        self._savepoint = None
+
+    def savepoint(self, name):
+        self.calls.append('savepoint')
+        self._savepoint = len(self._pending)
+
+    def rollback_to_savepoint(self, name):
+        self.calls.append('rollback_to_savepoint')
+        if self._savepoint is None:
+            raise Exception('savepoint {} does not exist'.format(name))
+        del self._pending[self._savepoint:]
+
+
+class FakeFeedLogger(object):
+    """Records the events logged and which of them were committed"""
+
+    def __init__(self, event_types=None):
+        self.pending = []
+        self.committed = []
+        self.event_types = event_types
+
+    def has_event_type(self, event_type):
+        return self.event_types is None or event_type in self.event_types
+
+    def ensure_session(self):
+        pass
+
+    def end_session(self):
+        pass
+
+    def close(self):
+        pass
+
+    def log_event(self, event_type, priority, message, attrs=None):
+        self.pending.append(message)
+
+    def commit(self):
+        self.committed += self.pending
+        self.pending = []
+
+    def rollback(self):
+        self.pending = []
+
+
+class StoreSync(SyncBase):
+    """SyncBase subclass writing to a TransactionalStore. Records whose id
+    is in fail_on raise on modify"""
+
+    def __init__(self, source, dest, conf=None, argv=(), fail_on=()):
+        self.tmpdir = tempfile.mkdtemp(prefix='jh_recsync_test')
+        sync_conf = {
+            'record_sync_logger_conf': {
+                'dblog': False,
+                'syslog': False,
+                'source_subsystem': 'test',
+                'destination_subsystem': 'memory'}}
+        sync_conf.update(conf or {})
+        conf_file = os.path.join(self.tmpdir, 'sync.json')
+        with open(conf_file, 'w') as _fh:
+            json.dump(sync_conf, _fh)
+        self._source = source
+        self.store = TransactionalStore(dest)
+        self.fail_on = set(fail_on)
+        args = SyncOptions().parse_opts(['--conf-file', conf_file, '--force'] + list(argv))
+        super(StoreSync, self).__init__('thing', args)
+        self.dbh = self.store
+
+    def cleanup(self):
+        """Removes the configuration written for this sync"""
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _get_source_dataset(self):
+        return set(self._source)
+
+    def _get_destination_dataset(self):
+        return set(self.store.committed.values())
+
+    def _add_record(self, obj):
+        self.store.write('add', obj)
+        return obj
+
+    def _rm_record(self, obj):
+        self.store.write('remove', obj)
+
+    def _modify_record(self, obj):
+        if obj.primary_key in self.fail_on:
+            raise Exception('update of thing effected 0 rows.')
+        # obj only holds the changed attributes
+        current = self.store.committed[obj.primary_key]
+        values = dict(current.items())
+        values.update(obj.items())
+        self.store.write('modify', FACTORY.create(values))
+
+    def _update_destination(self, records):
+        for record in records:
+            self.store.write('add', record)
+
+
+class FakeDBCursor(object):
+    """psycopg2 style cursor recording what is executed. Results are taken
+    from the rowcounts and rows queues of its connection"""
+
+    def __init__(self, conn):
+        self._conn = conn
+        self.rowcount = -1
+        self.query = None
+
+    def execute(self, qry, vals=None):
+        self.query = qry
+        self._conn.executed.append((qry, vals))
+        self.rowcount = self._conn.rowcounts.pop(0) if self._conn.rowcounts else 1
+
+    def copy_expert(self, qry, buf):
+        self._conn.executed.append((qry, buf.read()))
+
+    def fetchone(self):
+        return self._conn.rows.pop(0) if self._conn.rows else None
+
+    def fetchall(self):
+        rows, self._conn.rows = self._conn.rows, []
+        return rows
+
+    def close(self):
+        pass
+
+
+class FakeDBConnection(object):
+    """psycopg2 style connection handing out FakeDBCursors"""
+
+    def __init__(self):
+        self.autocommit = False
+        self.closed = False
+        self.executed = []
+        self.rowcounts = []
+        self.rows = []
+        self.calls = []
+
+    def cursor(self, **kwargs):
+        return FakeDBCursor(self)
+
+    def commit(self):
+        self.calls.append('commit')
+
+    def rollback(self):
+        self.calls.append('rollback')
+
+    def close(self):
+        self.closed = True
+
+    def statements(self, prefix):
+        """Returns the executed statements starting with prefix"""
+        return [qry for qry, _ in self.executed if qry.lstrip().startswith(prefix)]
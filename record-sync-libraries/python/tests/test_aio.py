@@ -0,0 +1,153 @@
+"""Tests of jh_recsynclib.aio against fake pools and connections"""
+
+# Standard library imports
+import asyncio
+import unittest
+from unittest import mock
+
+# Local imports
+from fakes import FACTORY
+
+try:
+    from jh_recsynclib import aio
+    from jh_recsynclib.db import JHDBIException
+except ImportError:
+    aio = None
+
+
+PKEY_ROWS = [('jazzhands', 'thing', ['id'])]
+
+
+class FakeAsyncCursor(object):
+
+    def __init__(self, conn):
+        self._conn = conn
+        self.rowcount = -1
+
+    async def execute(self, qry, vals=None):
+        self._conn.executed.append(qry)
+        self.rowcount = self._conn.rowcounts.pop(0) if self._conn.rowcounts else 1
+        if 'md5(string_agg' in qry:
+            self._rows = [(self._conn.version,)]
+        elif 'indisprimary' in qry:
+            self._rows = list(PKEY_ROWS)
+        else:
+            self._rows = []
+
+    async def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    async def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    async def close(self):
+        pass
+
+
+class FakeAsyncConnection(object):
+
+    version = 'v1'
+
+    def __init__(self):
+        self.closed = False
+        self.executed = []
+        self.rowcounts = []
+        self.calls = []
+
+    def cursor(self, name=None):
+        return FakeAsyncCursor(self)
+
+    async def commit(self):
+        self.calls.append('commit')
+
+    async def rollback(self):
+        self.calls.append('rollback')
+
+
+class FakeAsyncPool(object):
+
+    opened = []
+
+    def __init__(self, conninfo, **kwargs):
+        self.conninfo = conninfo
+        self.conn = FakeAsyncConnection()
+        self.closed = False
+        self.loop = None
+        FakeAsyncPool.opened.append(self)
+
+    async def open(self):
+        self.loop = asyncio.get_running_loop()
+
+    async def getconn(self):
+        return self.conn
+
+    async def putconn(self, conn):
+        pass
+
+    async def close(self):
+        self.closed = True
+
+
+@unittest.skipUnless(aio, 'needs psycopg, psycopg_pool, psycopg2 and jazzhands_appauthal')
+class AsyncRecordInterfaceTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('jh_recsynclib.aio.AsyncConnectionPool', FakeAsyncPool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        FakeAsyncPool.opened = []
+        aio.AsyncJHDBRecordInterface._catalog_pkeys.clear()
+        self.table_map = {'id': 'thing', 'name': 'thing', 'val': 'thing'}
+        self.rec = FACTORY.create(id=1, name='n1', val='new')
+
+    def _run(self, coro_func):
+        async def run():
+            try:
+                return await coro_func()
+            finally:
+                await aio.close_pools()
+        return asyncio.run(run())
+
+    def _jhdbi(self):
+        return aio.AsyncJHDBRecordInterface(
+            'jazzhands', 'thing', table_map=self.table_map, conninfo='dbname=jazzhands')
+
+    def test_update_reports_rowcount(self):
+        async def update():
+            async with self._jhdbi() as jhdbi:
+                jhdbi._dbh.rowcounts = [0]
+                await jhdbi.update_jh_record(self.rec, pkeys_arr=['id'])
+        with self.assertRaisesRegex(JHDBIException, 'update of thing effected 0 rows'):
+            self._run(update)
+
+    def test_pools_per_loop(self):
+        async def get_pool():
+            return await aio.get_pool('dbname=jazzhands')
+        first = self._run(get_pool)
+        second = self._run(get_pool)
+        self.assertIsNot(first, second)
+        self.assertTrue(first.closed and second.closed)
+
+    def test_pool_shared_within_loop(self):
+        async def get_pools():
+            return await asyncio.gather(*(aio.get_pool('dbname=jazzhands') for _ in range(3)))
+        pools = self._run(get_pools)
+        self.assertEqual(len(set(map(id, pools))), 1)
+        self.assertEqual(len(FakeAsyncPool.opened), 1)
+
+    def test_catalog_pkeys_follow_schema_version(self):
+        async def pkeys(version):
+            async with self._jhdbi() as jhdbi:
+                jhdbi._dbh.version = version
+                jhdbi._dbh.executed = []
+                result = await jhdbi._get_table_pkeys('thing')
+                await jhdbi._get_table_pkeys('thing')
+                return result, [qry for qry in jhdbi._dbh.executed if 'indisprimary' in qry]
+        self.assertEqual(self._run(lambda: pkeys('v1')), (['id'], [aio.PRIMARY_KEYS_QRY]))
+        self.assertEqual(self._run(lambda: pkeys('v1')), (['id'], []))
+        self.assertEqual(self._run(lambda: pkeys('v2')), (['id'], [aio.PRIMARY_KEYS_QRY]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+"""Tests of SyncBase.bulk_load"""
+
+# Standard library imports
+import unittest
+
+# Local imports
+from fakes import StoreSync, make_records
+from jh_recsynclib.sync import SyncException
+
+
+class BulkLoadDB(object):
+    """Stands in for JHDBRecordInterface.bulk_load_jh_records"""
+
+    statement_cache = None
+
+    def __init__(self):
+        self.loads = []
+
+    def bulk_load_jh_records(self, records, table=None, operations=(), safety_check=None):
+        records = list(records)
+        self.loads.append((operations, safety_check))
+        return {'table': table, 'staged': len(records), 'add': 0, 'modify': 0, 'remove': 0}
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class BulkLoadSync(StoreSync):
+
+    operations = ('add', 'modify')
+
+    def _update_destination(self, records):
+        self.bulk_load(records, table='thing', operations=self.operations)
+
+    def _update_destination_chunk(self, records, chunk_number):
+        self.bulk_load(records, table='thing', operations=self.operations)
+
+
+class BulkLoadTest(unittest.TestCase):
+
+    def _sync(self, operations, conf=None):
+        sync = BulkLoadSync(make_records(5), (), conf=conf)
+        self.addCleanup(sync.cleanup)
+        sync.operations = operations
+        sync.dbh = BulkLoadDB()
+        return sync
+
+    def test_remove_checked_against_safety_limits(self):
+        sync = self._sync(('add', 'modify', 'remove'))
+        self.assertTrue(sync.run_sync('full'))
+        (operations, safety_check), = sync.dbh.loads
+        self.assertEqual(safety_check, sync._check_safety)
+
+    def test_no_safety_check_without_remove(self):
+        sync = self._sync(('add', 'modify'), {'full_sync_chunk_size': 2})
+        self.assertTrue(sync.run_sync('full'))
+        self.assertEqual([check for _, check in sync.dbh.loads], [None] * 3)
+
+    def test_remove_refused_in_chunks(self):
+        sync = self._sync(('add', 'remove'), {'full_sync_chunk_size': 2})
+        with self.assertRaises(SyncException):
+            sync.run_sync('full')
+        self.assertEqual(sync.dbh.loads, [])
+        self.assertFalse(sync._in_chunk)
+
+
+if __name__ == '__main__':
+    unittest.main()
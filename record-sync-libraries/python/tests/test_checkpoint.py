@@ -0,0 +1,129 @@
+"""Tests of jh_recsynclib.checkpoint"""
+
+# Standard library imports
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+# Local imports
+from fakes import StoreSync, make_records
+from fakes import FACTORY
+from jh_recsynclib import checkpoint
+from jh_recsynclib.checkpoint import SyncCheckpoint, fingerprint_records
+
+
+class SyncCheckpointTest(unittest.TestCase):
+
+    OPERATIONS = ('add', 'remove', 'modify')
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'thing.ckpt')
+        self.src = make_records(5, val='new')
+        self.dst = make_records(5, start=2)
+        src_keys = {rec.primary_key: rec for rec in self.src}
+        dst_keys = {rec.primary_key: rec for rec in self.dst}
+        self.adds = {src_keys[0], src_keys[1]}
+        self.rms = {dst_keys[5], dst_keys[6]}
+        self.mods = {(src_keys[num], dst_keys[num]) for num in (2, 3, 4)}
+
+    def _begin(self):
+        ckpt = SyncCheckpoint(self.path)
+        ckpt.begin(self.src, self.dst, self.OPERATIONS, self.adds, self.rms, self.mods)
+        return ckpt
+
+    def test_resume_skips_flushed(self):
+        ckpt = self._begin()
+        ckpt.mark_done('add', next(iter(self.adds)))
+        ckpt.mark_done('modify', next(iter(self.mods))[0])
+        ckpt.flush()
+        ckpt.mark_done('remove', next(iter(self.rms)))
+        ckpt.discard()
+        adds, rms, mods = SyncCheckpoint(self.path).resume(self.src, self.dst, self.OPERATIONS)
+        self.assertEqual((len(adds), len(rms), len(mods)), (1, 2, 2))
+        self.assertTrue(adds < self.adds and mods < self.mods)
+
+    def test_changed_dataset_ignored(self):
+        self._begin()
+        src = make_records(5, val='newer')
+        self.assertIsNone(SyncCheckpoint(self.path).resume(src, self.dst, self.OPERATIONS))
+
+    def test_other_operations_ignored(self):
+        self._begin()
+        self.assertIsNone(SyncCheckpoint(self.path).resume(self.src, self.dst, ('add',)))
+
+    def test_clear(self):
+        ckpt = self._begin()
+        ckpt.clear()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertIsNone(ckpt.resume(self.src, self.dst, self.OPERATIONS))
+
+    def test_fingerprint(self):
+        self.assertEqual(fingerprint_records(self.src), fingerprint_records(set(self.src)))
+        self.assertNotEqual(fingerprint_records(self.src), fingerprint_records(self.dst))
+        self.assertEqual(
+            fingerprint_records(make_records(2)),
+            fingerprint_records(make_records(3), exclude_keys={'2'}))
+        swapped = {
+            FACTORY.create(id=0, name='n0', val='b'), FACTORY.create(id=1, name='n1', val='a')}
+        self.assertNotEqual(
+            fingerprint_records({
+                FACTORY.create(id=0, name='n0', val='a'),
+                FACTORY.create(id=1, name='n1', val='b')}),
+            fingerprint_records(swapped))
+
+    def test_no_fingerprints_without_file(self):
+        with mock.patch.object(checkpoint, 'fingerprint_records') as fingerprint:
+            self.assertIsNone(SyncCheckpoint(self.path).resume(self.src, self.dst, self.OPERATIONS))
+        fingerprint.assert_not_called()
+
+    def test_source_fingerprinted_once(self):
+        self._begin()
+        ckpt = SyncCheckpoint(self.path)
+        dst = make_records(5, start=1)
+        with mock.patch.object(
+                checkpoint, 'fingerprint_records', wraps=fingerprint_records) as fingerprint:
+            self.assertIsNone(ckpt.resume(self.src, dst, self.OPERATIONS))
+            ckpt.begin(self.src, dst, self.OPERATIONS, self.adds, self.rms, self.mods)
+        # source and destination on resume, only the destination on begin
+        self.assertEqual(fingerprint.call_count, 3)
+
+    def test_fsync(self):
+        with mock.patch.object(os, 'fsync') as fsync:
+            ckpt = self._begin()
+            ckpt.mark_done('add', next(iter(self.adds)))
+            ckpt.flush()
+            self.assertEqual(fsync.call_count, 1)
+            ckpt = SyncCheckpoint(self.path, fsync=True)
+            ckpt.mark_done('add', next(iter(self.adds)))
+            ckpt.flush()
+            self.assertEqual(fsync.call_count, 2)
+
+
+class CheckpointSyncTest(unittest.TestCase):
+
+    def test_resume_after_failure(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        conf = {
+            'allow_partial_updates': True,
+            'checkpoint_file': os.path.join(tmpdir, 'thing.ckpt')}
+        src, dst = make_records(6, val='new'), make_records(6)
+        sync = StoreSync(src, dst, conf=conf, fail_on={4})
+        self.addCleanup(sync.cleanup)
+        sync.run_sync()
+        self.assertEqual(sync._failures, 1)
+        applied = {key for key, rec in sync.store.committed.items() if rec['val'] == 'new'}
+        self.assertEqual(len(applied), 5)
+
+        rerun = StoreSync(src, sync.store.committed.values(), conf=conf)
+        self.addCleanup(rerun.cleanup)
+        self.assertTrue(rerun.run_sync())
+        self.assertEqual(rerun.store.committed[4]['val'], 'new')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,255 @@
+"""Tests of JHDBRecordInterface against a fake connection"""
+
+# Standard library imports
+import datetime
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    mock = None
+
+# Local imports
+from fakes import FakeDBConnection, FACTORY
+
+try:
+    from jh_recsynclib.db import (
+        JHDBRecordInterface, JHDBIException, PreparedStatementCache, _copy_value)
+except ImportError:
+    JHDBRecordInterface = None
+
+
+TABLE_MAP = {'id': 'thing', 'name': 'thing', 'val': 'thing'}
+
+
+@unittest.skipUnless(
+    JHDBRecordInterface and mock, 'needs psycopg2, jazzhands_appauthal and unittest.mock')
+class RecordInterfaceTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('jh_recsynclib.db.DatabaseConnection')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.conn = FakeDBConnection()
+        self.dbh = JHDBRecordInterface(
+            'jazzhands', record_type='thing', table_map=TABLE_MAP,
+            connection_factory=lambda app_name, **kwargs: self.conn, conf={})
+        self.rec = FACTORY.create(id=1, name='n1', val='new')
+
+
+class UpdateRecordTest(RecordInterfaceTest):
+
+    def test_update(self):
+        self.dbh.update_jh_record(self.rec, pkeys_arr=['id'])
+        self.assertEqual(len(self.conn.statements('UPDATE thing')), 1)
+        self.assertNotIn('rollback', self.conn.calls)
+
+    def test_no_row_rolls_back(self):
+        self.conn.rowcounts = [0]
+        with self.assertRaises(JHDBIException):
+            self.dbh.update_jh_record(self.rec, pkeys_arr=['id'])
+        self.assertEqual(self.conn.calls, ['rollback'])
+
+    def test_no_row_keeps_savepoint(self):
+        self.dbh.savepoint('jh_recsync_record')
+        self.conn.rowcounts = [0]
+        with self.assertRaises(JHDBIException):
+            self.dbh.update_jh_record(self.rec, pkeys_arr=['id'])
+        self.assertEqual(self.conn.calls, [])
+        self.dbh.rollback_to_savepoint('jh_recsync_record')
+        self.assertEqual(
+            self.conn.statements('ROLLBACK TO'), ['ROLLBACK TO SAVEPOINT jh_recsync_record'])
+        self.dbh.savepoint('jh_recsync_record')
+        self.assertEqual(
+            self.conn.executed[-1][0],
+            'RELEASE SAVEPOINT jh_recsync_record; SAVEPOINT jh_recsync_record')
+
+
+class CombinedUpdateTest(RecordInterfaceTest):
+
+    def setUp(self):
+        super(CombinedUpdateTest, self).setUp()
+        self.dbh.combine_table_updates = True
+        self.table_map = {'id': 'thing', 'name': 'thing', 'val': 'thing_val'}
+
+    def test_update(self):
+        self.conn.rows = [(1, 1)]
+        self.dbh.update_jh_record(self.rec, table_map=self.table_map, pkeys_arr=['id'])
+        qry, = self.conn.statements('WITH')
+        self.assertIn('UPDATE thing SET', qry)
+        self.assertIn('UPDATE thing_val SET', qry)
+
+    def test_zero_rows_raises_without_rollback(self):
+        self.conn.rows = [(1, 0)]
+        with self.assertRaises(JHDBIException) as ctx:
+            self.dbh._update_combined(
+                self.conn.cursor(), self.dbh._get_table_upd_dict(self.rec, self.table_map),
+                self.rec, ['id'])
+        self.assertIn('thing_val', str(ctx.exception))
+        self.assertEqual(self.conn.calls, [])
+
+    def test_zero_rows_keeps_savepoint(self):
+        self.dbh.savepoint('jh_recsync_record')
+        self.conn.rows = [(0, 1)]
+        with self.assertRaises(JHDBIException):
+            self.dbh.update_jh_record(self.rec, table_map=self.table_map, pkeys_arr=['id'])
+        self.assertEqual(self.conn.calls, [])
+
+    def test_zero_rows_rolls_back_without_savepoint(self):
+        self.conn.rows = [(0, 1)]
+        with self.assertRaises(JHDBIException):
+            self.dbh.update_jh_record(self.rec, table_map=self.table_map, pkeys_arr=['id'])
+        self.assertEqual(self.conn.calls, ['rollback'])
+
+
+class UpdateManyTest(RecordInterfaceTest):
+
+    def setUp(self):
+        super(UpdateManyTest, self).setUp()
+        self.dbh._column_types['thing'] = {'id': 'date', 'name': 'text', 'val': 'text'}
+        # keys whose text differs from what the database returns for them
+        self.recs = [
+            FACTORY.create(id=datetime.date(2017, 1, day), name='n', val='new')
+            for day in (1, 2, 3)]
+        patcher = mock.patch('jh_recsynclib.db.execute_values')
+        self.execute_values = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_matched_by_row_ordinal(self):
+        self.execute_values.return_value = [(0,), (2,)]
+        unmatched = self.dbh.update_jh_records(self.recs, pkeys_arr=['id'])
+        self.assertEqual(unmatched, [self.recs[1]])
+        _, qry, argslist = self.execute_values.call_args[0]
+        self.assertIn('AS v (jh_recsync_row, id, name, val)', qry)
+        self.assertTrue(qry.endswith('RETURNING v.jh_recsync_row'))
+        self.assertEqual([args[0] for args in argslist], [0, 1, 2])
+        self.assertTrue(
+            self.execute_values.call_args[1]['template'].startswith('(%s::integer, %s::date'))
+
+    def test_key_matching_several_rows_rolls_back(self):
+        self.execute_values.return_value = [(0,), (1,), (1,), (2,)]
+        with self.assertRaises(JHDBIException):
+            self.dbh.update_jh_records(self.recs, pkeys_arr=['id'])
+        self.assertEqual(self.conn.calls, ['rollback'])
+
+
+class BulkLoadTest(RecordInterfaceTest):
+
+    def test_remove_requires_records(self):
+        with self.assertRaises(JHDBIException):
+            self.dbh.bulk_load_jh_records([], pkeys_arr=['id'], operations=('remove',))
+        self.assertEqual(self.conn.executed, [])
+        counts = self.dbh.bulk_load_jh_records([], pkeys_arr=['id'])
+        self.assertEqual(counts['staged'], 0)
+
+    def test_remove_checked_before_delete(self):
+        checks = []
+        self.conn.rows = [(10, 3)]
+        self.dbh.bulk_load_jh_records(
+            [self.rec], pkeys_arr=['id'], operations=('remove',),
+            safety_check=lambda total, removals: checks.append((total, removals)))
+        self.assertEqual(checks, [(10, 3)])
+        self.assertEqual(len(self.conn.statements('DELETE FROM thing')), 1)
+
+    def test_safety_check_aborts_remove(self):
+        def check(total, removals):
+            raise Exception('too many changes')
+        self.conn.rows = [(10, 9)]
+        with self.assertRaises(Exception):
+            self.dbh.bulk_load_jh_records(
+                [self.rec], pkeys_arr=['id'], operations=('remove',), safety_check=check)
+        self.assertEqual(self.conn.statements('DELETE'), [])
+
+
+class DiffRecordsTest(RecordInterfaceTest):
+
+    def test_destination_staged_once(self):
+        self.dbh._get_record_factory = lambda record_type: FACTORY
+        self.conn.rows = [(5,), (0,)]
+        adds, _, _, dst_count = self.dbh.diff_jh_records(
+            [self.rec], 'SELECT * FROM thing', operations=('add',))
+        self.assertEqual(adds, {self.rec})
+        self.assertEqual(dst_count, 5)
+        self.assertIn('d.id = s.id', self.conn.statements('SELECT s.')[0])
+        queries = [qry for qry, _ in self.conn.executed if 'FROM thing' in qry]
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(queries[0].startswith('CREATE TEMP TABLE jh_recsync_diff_dst_'))
+        self.assertEqual(len(self.conn.statements('ANALYZE')), 2)
+
+
+@unittest.skipUnless(JHDBRecordInterface, 'needs psycopg2 and jazzhands_appauthal')
+class PreparedStatementCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = FakeDBConnection()
+        self.dbc = self.conn.cursor()
+        self.cache = PreparedStatementCache(max_size=2)
+
+    def _prepared(self, qry):
+        """Returns the statement PREPAREd for qry, without its name"""
+        self.cache.execute(self.dbc, qry, [])
+        prepare, = self.conn.statements('PREPARE')
+        return prepare.split(' AS ', 1)[1]
+
+    def test_placeholders_numbered(self):
+        self.cache.execute(self.dbc, 'UPDATE thing SET name = %s WHERE id = %s', ['x', 1])
+        (prepare, _), (execute, params) = self.conn.executed
+        self.assertTrue(prepare.endswith(' AS UPDATE thing SET name = $1 WHERE id = $2'))
+        self.assertTrue(execute.startswith('EXECUTE jh_recsync_ps'))
+        self.assertTrue(execute.endswith(' (%s, %s)'))
+        self.assertEqual(params, ['x', 1])
+
+    def test_escaped_percent(self):
+        self.assertEqual(
+            self._prepared("SELECT id FROM thing WHERE name LIKE 'a%%' AND val = %s"),
+            "SELECT id FROM thing WHERE name LIKE 'a%' AND val = $1")
+
+    def test_quoted_placeholder(self):
+        self.assertEqual(
+            self._prepared("""SELECT '%s', 'it''s %s', "%s" FROM thing WHERE id = %s"""),
+            """SELECT '%s', 'it''s %s', "%s" FROM thing WHERE id = $1""")
+
+    def test_lru_eviction(self):
+        first, second, third = ('SELECT {} FROM thing WHERE id = %s'.format(num)
+                                for num in range(3))
+        for qry in (first, second, first, third):
+            self.cache.execute(self.dbc, qry, [1])
+        # second is the least recently used when third is prepared
+        prepared = [qry.split()[1] for qry in self.conn.statements('PREPARE')]
+        deallocated, = self.conn.statements('DEALLOCATE')
+        self.assertEqual(deallocated, 'DEALLOCATE {}'.format(prepared[1]))
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual(self.cache.stats, {'hits': 1, 'misses': 3, 'evictions': 1})
+        self.cache.execute(self.dbc, first, [1])
+        self.assertEqual(self.cache.stats['hits'], 2)
+
+    def test_deallocate_and_reset(self):
+        self.cache.execute(self.dbc, 'SELECT 1', [])
+        self.cache.execute(self.dbc, 'SELECT 2', [])
+        self.cache.deallocate(self.dbc)
+        self.assertEqual(len(self.conn.statements('DEALLOCATE')), 2)
+        self.assertEqual(len(self.cache), 0)
+        self.cache.execute(self.dbc, 'SELECT 1', [])
+        self.cache.reset()
+        self.cache.execute(self.dbc, 'SELECT 1', [])
+        self.assertEqual(len(self.conn.statements('PREPARE')), 4)
+        self.assertEqual(len(self.conn.statements('DEALLOCATE')), 2)
+
+
+@unittest.skipUnless(JHDBRecordInterface, 'needs psycopg2 and jazzhands_appauthal')
+class CopyValueTest(unittest.TestCase):
+
+    def test_scalars(self):
+        self.assertEqual(_copy_value(None), u'\\N')
+        self.assertEqual(_copy_value(True), u't')
+        self.assertEqual(_copy_value(u'a\tb\\'), u'a\\tb\\\\')
+
+    def test_arrays(self):
+        self.assertEqual(_copy_value([1, None, u'a b']), u'{"1",NULL,"a b"}')
+        self.assertEqual(_copy_value([[1, 2], [3, 4]]), u'{{"1","2"},{"3","4"}}')
+        self.assertEqual(_copy_value([u'"q"', u'b\\s']), u'{"\\\\"q\\\\"","b\\\\\\\\s"}')
+        self.assertEqual(_copy_value([]), u'{}')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+"""Tests of jh_recsynclib.governor"""
+
+# Standard library imports
+import unittest
+
+# Local imports
+from context import jh_recsynclib                                      # pylint: disable=unused-import
+from jh_recsynclib.governor import WriteGovernor, WriteGovernorException
+
+
+def run_window(gov, seconds=0.0, success=True):
+    """Records a full window of writes"""
+    for _ in range(gov.window):
+        gov.acquire()
+        gov.release(seconds, success)
+
+
+class WriteGovernorTest(unittest.TestCase):
+
+    def test_increase_without_max_rate(self):
+        gov = WriteGovernor(initial_rate=1000, rate_increase=5, max_concurrency=4, window=2)
+        run_window(gov)
+        self.assertEqual(gov.rate, 1005)
+        self.assertEqual(gov.concurrency, 2)
+
+    def test_increase_capped_at_max_rate(self):
+        gov = WriteGovernor(max_rate=1000, initial_rate=998, rate_increase=5, window=2)
+        run_window(gov)
+        self.assertEqual(gov.rate, 1000)
+
+    def test_no_rate_limit(self):
+        gov = WriteGovernor(max_concurrency=2, window=2)
+        run_window(gov)
+        self.assertIsNone(gov.rate)
+        self.assertEqual(gov.concurrency, 2)
+
+    def test_decrease_on_errors(self):
+        gov = WriteGovernor(
+            max_rate=1000, min_rate=300, max_concurrency=8, window=4, decrease_factor=0.5)
+        gov.concurrency = 8
+        run_window(gov, success=False)
+        self.assertEqual(gov.rate, 500)
+        self.assertEqual(gov.concurrency, 4)
+        run_window(gov, success=False)
+        self.assertEqual(gov.rate, 300)
+        self.assertEqual(gov.stats()['decreases'], 2)
+
+    def test_decrease_on_latency(self):
+        gov = WriteGovernor(max_rate=1000, target_latency=0.1, window=2)
+        run_window(gov, seconds=0.2)
+        self.assertEqual(gov.rate, 500)
+
+    def test_imap_unordered(self):
+        gov = WriteGovernor(max_concurrency=3, window=5)
+
+        def func(item):
+            if item == 3:
+                raise ValueError(item)
+            return item * 2
+        results = {item: (success, result) for item, success, result, _ in
+                   gov.imap_unordered(func, range(10))}
+        self.assertEqual(len(results), 10)
+        self.assertEqual(results[4], (True, 8))
+        self.assertFalse(results[3][0])
+        self.assertIsInstance(results[3][1], ValueError)
+
+    def test_invalid_conf(self):
+        with self.assertRaises(WriteGovernorException):
+            WriteGovernor.from_conf({'max_concurency': 2})
+        with self.assertRaises(WriteGovernorException):
+            WriteGovernor(min_concurrency=2, max_concurrency=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+"""Tests of jh_recsynclib.metrics"""
+
+# Standard library imports
+import os
+import shutil
+import tempfile
+import unittest
+
+# Local imports
+from context import jh_recsynclib                                      # pylint: disable=unused-import
+from jh_recsynclib.metrics import MetricsRegistry, MetricsException
+
+
+class MetricsRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        self.registry.counter('jh_recsync_records', 'records applied', ['operation']).inc(
+            operation='add')
+
+    def test_prometheus_is_default(self):
+        text = self.registry.render()
+        self.assertIn('# TYPE jh_recsync_records_total counter\n', text)
+        self.assertIn('jh_recsync_records_total{operation="add"} 1\n', text)
+        self.assertNotIn('# EOF', text)
+
+    def test_openmetrics(self):
+        text = self.registry.render(openmetrics=True)
+        self.assertIn('# TYPE jh_recsync_records counter\n', text)
+        self.assertIn('jh_recsync_records_total{operation="add"} 1\n', text)
+        self.assertTrue(text.endswith('# EOF\n'))
+
+    def test_same_metric_returned(self):
+        counter = self.registry.counter('jh_recsync_records', 'records applied', ['operation'])
+        counter.inc(2, operation='add')
+        self.assertIn('jh_recsync_records_total{operation="add"} 3\n', self.registry.render())
+        with self.assertRaises(MetricsException):
+            self.registry.gauge('jh_recsync_records', 'records applied')
+
+    def test_missing_label(self):
+        with self.assertRaises(MetricsException):
+            self.registry.counter('jh_recsync_records', 'records applied', ['operation']).inc()
+
+    def test_histogram_buckets(self):
+        hist = self.registry.histogram('jh_recsync_seconds', 'latency', buckets=(0.1, 1))
+        hist.observe(0.05)
+        hist.observe(0.5)
+        hist.observe(5)
+        text = self.registry.render()
+        self.assertIn('jh_recsync_seconds_bucket{le="0.1"} 1\n', text)
+        self.assertIn('jh_recsync_seconds_bucket{le="1.0"} 2\n', text)
+        self.assertIn('jh_recsync_seconds_bucket{le="+Inf"} 3\n', text)
+        self.assertIn('jh_recsync_seconds_count 3\n', text)
+
+    def test_write_textfile(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'jh_recsync.prom')
+        self.registry.write_textfile(path)
+        with open(path) as _fh:
+            self.assertEqual(_fh.read(), self.registry.render())
+        self.assertEqual(os.listdir(tmpdir), ['jh_recsync.prom'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+"""Tests of the psycopg 3 pipeline record interface against a fake connection"""
+
+# Standard library imports
+import contextlib
+import unittest
+from unittest import mock
+
+# Local imports
+from fakes import FakeDBConnection, FakeDBCursor, FACTORY
+
+try:
+    import psycopg
+    from jh_recsynclib import pg3
+    from jh_recsynclib.db import JHDBIException
+except ImportError:
+    pg3 = None
+
+
+TABLE_MAP = {'id': 'thing', 'name': 'thing', 'val': 'thing'}
+
+
+class FakePipelineCursor(FakeDBCursor):
+    """Cursor applying the UPDATEs of thing records to its connection. Keys
+    in errors fail the pipeline, keys in missing match no row"""
+
+    def execute(self, qry, vals=None):
+        super(FakePipelineCursor, self).execute(qry, vals)
+        conn = self._conn
+        if qry.startswith('UPDATE'):
+            key = vals[-1]
+            if key in conn.errors:
+                conn.pipeline_failed = True
+            self.rowcount = 0 if key in conn.missing else 1
+            conn.applied.append(key)
+            return
+        for stmt in qry.split('; '):
+            if stmt.startswith('SAVEPOINT'):
+                conn.marks.append(len(conn.applied))
+            elif stmt.startswith('RELEASE SAVEPOINT'):
+                conn.marks.pop()
+            elif stmt.startswith('ROLLBACK TO SAVEPOINT'):
+                del conn.applied[conn.marks[-1]:]
+
+
+class FakePipelineConnection(FakeDBConnection):
+    """psycopg 3 style connection with pipeline mode. A pipeline raises
+    psycopg.Error on exit if one of its statements failed"""
+
+    def __init__(self, errors=(), missing=()):
+        super(FakePipelineConnection, self).__init__()
+        self.errors = set(errors)
+        self.missing = set(missing)
+        self.applied = []
+        self.marks = []
+        self.pipelines = 0
+        self.pipeline_failed = False
+
+    def cursor(self, **kwargs):
+        return FakePipelineCursor(self)
+
+    @contextlib.contextmanager
+    def pipeline(self):
+        self.pipelines += 1
+        self.pipeline_failed = False
+        yield
+        if self.pipeline_failed:
+            raise psycopg.Error('pipeline aborted')
+
+
+@unittest.skipUnless(pg3, 'needs psycopg and jazzhands_appauthal')
+class PipelineUpdateTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('jh_recsynclib.db.DatabaseConnection')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.recs = [FACTORY.create(id=num, name='n', val='new') for num in range(8)]
+
+    def _update(self, conn, **kwargs):
+        dbh = pg3.PipelineRecordInterface(
+            'jazzhands', record_type='thing', table_map=TABLE_MAP,
+            connection_factory=lambda app_name, **kwargs: conn, conf={})
+        return dbh.pipeline_update_jh_records(self.recs, pkeys_arr=['id'], **kwargs)
+
+    def test_success(self):
+        conn = FakePipelineConnection()
+        self.assertEqual(self._update(conn), [])
+        self.assertEqual(conn.pipelines, 1)
+        self.assertEqual(conn.applied, list(range(8)))
+        self.assertEqual(conn.statements('ROLLBACK TO'), [])
+
+    def test_failing_record_bisected(self):
+        conn = FakePipelineConnection(errors={5})
+        failed = self._update(conn)
+        self.assertEqual([rec for rec, _ in failed], [self.recs[5]])
+        self.assertIsInstance(failed[0][1], psycopg.Error)
+        # 8 records, then halves of 4, 2 and 1 for each level of the bisection
+        self.assertEqual(conn.pipelines, 7)
+        self.assertEqual(sorted(conn.applied), [0, 1, 2, 3, 4, 6, 7])
+
+    def test_several_failing_records(self):
+        conn = FakePipelineConnection(errors={0, 7})
+        failed = self._update(conn)
+        self.assertEqual([rec for rec, _ in failed], [self.recs[0], self.recs[7]])
+        self.assertEqual(sorted(conn.applied), [1, 2, 3, 4, 5, 6])
+
+    def test_unmatched_record_resent_without_bisection(self):
+        conn = FakePipelineConnection(missing={3})
+        failed = self._update(conn)
+        self.assertEqual([rec for rec, _ in failed], [self.recs[3]])
+        self.assertIsInstance(failed[0][1], JHDBIException)
+        self.assertEqual(conn.pipelines, 2)
+        self.assertEqual(sorted(conn.applied), [0, 1, 2, 4, 5, 6, 7])
+
+    def test_batch_size(self):
+        conn = FakePipelineConnection(errors={2})
+        failed = self._update(conn, batch_size=3)
+        self.assertEqual([rec for rec, _ in failed], [self.recs[2]])
+        # batches of 3, 3 and 2. the first is bisected into 1 and 2, then 1 and 1
+        self.assertEqual(conn.pipelines, 7)
+        self.assertEqual(sorted(conn.applied), [0, 1, 3, 4, 5, 6, 7])
+
+
+if __name__ == '__main__':
+    unittest.main()
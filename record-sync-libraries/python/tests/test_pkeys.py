@@ -0,0 +1,76 @@
+"""Tests of jh_recsynclib.pkeys"""
+
+# Standard library imports
+import shutil
+import tempfile
+import unittest
+
+# Local imports
+from fakes import FakeDBConnection
+from jh_recsynclib.pkeys import PrimaryKeyResolver, PRIMARY_KEYS_QRY, pkeys_from_rows
+
+
+ROWS = [
+    ('jazzhands', 'account', ['account_id']),
+    ('jazzhands', 'account_collection_account', ['account_collection_id', 'account_id']),
+    ('audit', 'account', ['aud#seq'])]
+
+
+class FakeDBI(object):
+
+    def __init__(self, app_name):
+        self._app_name = app_name
+        self.conn = FakeDBConnection()
+
+    def get_cursor(self):
+        return self.conn.cursor()
+
+
+class PrimaryKeyResolverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        PrimaryKeyResolver._loaded.clear()
+        self.addCleanup(PrimaryKeyResolver._loaded.clear)
+
+    def _dbi(self, app_name='jazzhands', version='v1'):
+        dbi = FakeDBI(app_name)
+        dbi.conn.rows = ([(version,)] if version else []) + ROWS
+        return dbi
+
+    def test_first_schema_wins(self):
+        self.assertEqual(pkeys_from_rows(ROWS)['account'], ['account_id'])
+        self.assertEqual(pkeys_from_rows(ROWS)['audit.account'], ['aud#seq'])
+
+    def test_search_path_order_cast(self):
+        self.assertIn('current_schemas(false)::text[]', PRIMARY_KEYS_QRY)
+
+    def test_catalog_read_once_per_version(self):
+        first = self._dbi()
+        resolver = PrimaryKeyResolver(first)
+        self.assertEqual(resolver.get('account'), ['account_id'])
+        self.assertIsNone(resolver.get('nothing'))
+        second = self._dbi()
+        self.assertEqual(PrimaryKeyResolver(second).get('account'), ['account_id'])
+        self.assertEqual(len(second.conn.executed), 1)
+
+    def test_cache_file(self):
+        PrimaryKeyResolver(self._dbi(), cache_dir=self.cache_dir).get('account')
+        PrimaryKeyResolver._loaded.clear()
+        dbi = self._dbi()
+        resolver = PrimaryKeyResolver(dbi, cache_dir=self.cache_dir)
+        self.assertEqual(resolver.get('account_collection_account'),
+                         ['account_collection_id', 'account_id'])
+        # only the schema version is read
+        self.assertEqual(len(dbi.conn.executed), 1)
+
+    def test_explicit_version_skips_catalog(self):
+        PrimaryKeyResolver(self._dbi(version=None), schema_version='v1').get('account')
+        dbi = self._dbi(version=None)
+        PrimaryKeyResolver(dbi, schema_version='v1').get('account')
+        self.assertEqual(dbi.conn.executed, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
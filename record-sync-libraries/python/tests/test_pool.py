@@ -0,0 +1,166 @@
+"""Tests of the connection pool and the sync orchestrator"""
+
+# Standard library imports
+import gc
+import unittest
+
+# Local imports
+from context import jh_recsynclib                                      # pylint: disable=unused-import
+from jh_recsynclib.pool import ConnectionPool
+from jh_recsynclib.orchestrator import SyncOrchestrator, OrchestratorException
+
+
+class FakeConnection(object):
+
+    def __init__(self, app_name):
+        self.app_name = app_name
+        self.autocommit = False
+        self.closed = False
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class FakePool(ConnectionPool):
+
+    def __init__(self, max_idle=4):
+        super(FakePool, self).__init__(max_idle)
+        self.opened = []
+
+    def _connect(self, app_name, **kwargs):
+        conn = FakeConnection(app_name)
+        self.opened.append(conn)
+        return conn
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def test_reuse(self):
+        pool = FakePool()
+        conn = pool.checkout('app')
+        pool.checkin(conn)
+        self.assertIs(pool.checkout('app'), conn)
+        self.assertIsNot(pool.checkout('app', cursor_factory='x'), conn)
+        self.assertEqual(pool.stats['hits'], 1)
+
+    def test_closed_idle_discarded(self):
+        pool = FakePool()
+        conn = pool.checkout('app')
+        pool.checkin(conn)
+        conn.close()
+        self.assertIsNot(pool.checkout('app'), conn)
+        self.assertEqual(pool.stats['discarded'], 1)
+
+    def test_unknown_connection_closed(self):
+        pool = FakePool()
+        conn = FakeConnection('app')
+        pool.checkin(conn)
+        self.assertTrue(conn.closed)
+
+    def test_lost_connection_forgotten(self):
+        pool = FakePool()
+        pool.checkout('app')
+        pool.opened = []
+        gc.collect()
+        self.assertEqual(len(pool._keys), 0)
+
+    def test_close_connections(self):
+        pool = FakePool()
+        first, second = pool.checkout('app'), pool.checkout('app')
+        pool.checkin(first)
+        pool.close_connections([first, second])
+        self.assertTrue(first.closed and second.closed)
+        self.assertIsNot(pool.checkout('app'), first)
+        self.assertEqual(pool.stats['discarded'], 0)
+        self.assertEqual(len(pool.opened), 3)
+
+
+class FakeSync(object):
+
+    def __init__(self, connection_factory, fail=False, name=None, runs=None):
+        self.conn = connection_factory('app')
+        self.fail = fail
+        self.name = name
+        self.runs = runs if runs is not None else []
+
+    def run_sync(self, **kwargs):
+        self.runs.append((self.name, kwargs))
+        if self.fail:
+            raise Exception('sync failed')
+
+
+class SyncOrchestratorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.runs = []
+
+    def _add(self, orc, name, depends_on=(), fail=False, **kwargs):
+        """Adds a FakeSync recording its runs in self.runs"""
+        orc.add_sync(
+            name, lambda cf: FakeSync(cf, fail=fail, name=name, runs=self.runs),
+            depends_on=depends_on, **kwargs)
+
+    def test_connections_closed_after_run(self):
+        pool = FakePool()
+        orc = SyncOrchestrator(max_workers=2, pool=pool)
+        orc.add_sync('department', FakeSync)
+        orc.add_sync('account', FakeSync, depends_on=['department'])
+        orc.add_sync('failing', lambda cf: FakeSync(cf, fail=True))
+        orc.add_sync('skipped', FakeSync, depends_on=['failing'])
+        self.assertEqual(orc.run(), {
+            'department': 'success', 'account': 'success',
+            'failing': 'failed', 'skipped': 'skipped'})
+        self.assertTrue(pool.opened)
+        self.assertTrue(all(conn.closed for conn in pool.opened))
+        self.assertEqual(sum(len(idle) for idle in pool._idle.values()), 0)
+
+    def test_dependencies_run_first(self):
+        orc = SyncOrchestrator(max_workers=4, pool=FakePool())
+        self._add(orc, 'account', depends_on=['department', 'company'])
+        self._add(orc, 'department', depends_on=['company'])
+        self._add(orc, 'company', sync_type='full', operations=('add',))
+        self.assertEqual(set(orc.run().values()), {'success'})
+        order = [name for name, _ in self.runs]
+        self.assertEqual(order, ['company', 'department', 'account'])
+        self.assertEqual(self.runs[0][1], {'sync_type': 'full', 'operations': ('add',)})
+
+    def test_dependents_of_failed_skipped(self):
+        orc = SyncOrchestrator(max_workers=2, pool=FakePool())
+        self._add(orc, 'company', fail=True)
+        self._add(orc, 'department', depends_on=['company'])
+        self._add(orc, 'account', depends_on=['department'])
+        self._add(orc, 'location')
+        self.assertEqual(orc.run(), {
+            'company': 'failed', 'department': 'skipped', 'account': 'skipped',
+            'location': 'success'})
+        self.assertEqual(sorted(name for name, _ in self.runs), ['company', 'location'])
+
+    def test_unknown_dependency(self):
+        orc = SyncOrchestrator(pool=FakePool())
+        self._add(orc, 'account', depends_on=['department'])
+        with self.assertRaises(OrchestratorException):
+            orc.run()
+        self.assertEqual(self.runs, [])
+
+    def test_cycle(self):
+        orc = SyncOrchestrator(pool=FakePool())
+        self._add(orc, 'company')
+        self._add(orc, 'department', depends_on=['account'])
+        self._add(orc, 'account', depends_on=['department'])
+        with self.assertRaises(OrchestratorException) as ctx:
+            orc.run()
+        self.assertIn('account, department', str(ctx.exception))
+        self.assertEqual(self.runs, [])
+
+    def test_duplicate_name(self):
+        orc = SyncOrchestrator(pool=FakePool())
+        self._add(orc, 'company')
+        with self.assertRaises(OrchestratorException):
+            self._add(orc, 'company')
+
+
+if __name__ == '__main__':
+    unittest.main()
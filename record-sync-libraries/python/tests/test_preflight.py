@@ -0,0 +1,102 @@
+"""Tests of the count based pre-flight check"""
+
+# Standard library imports
+import unittest
+from unittest import mock
+
+# Local imports
+from fakes import StoreSync, make_records
+from jh_recsynclib.sync import SyncException
+
+
+class CountingSync(StoreSync):
+    """StoreSync whose record counts can be set without fetching anything"""
+
+    def __init__(self, source, dest, src_count=None, dst_count=None, **kwargs):
+        super(CountingSync, self).__init__(source, dest, **kwargs)
+        self.src_count = src_count
+        self.dst_count = dst_count
+        self.fetches = 0
+        # StoreSync forces, the safety limits are what is tested here
+        self._force = False
+
+    def _count_source(self):
+        return self.src_count
+
+    def _count_destination(self):
+        return self.dst_count
+
+    def _get_source_dataset(self):
+        self.fetches += 1
+        return super(CountingSync, self)._get_source_dataset()
+
+    def _get_destination_query(self):
+        return 'SELECT id, name, val FROM thing'
+
+
+class PreflightTest(unittest.TestCase):
+
+    def _sync(self, src_count, dst_count, **kwargs):
+        sync = CountingSync(
+            make_records(20), make_records(20), src_count=src_count, dst_count=dst_count,
+            **kwargs)
+        self.addCleanup(sync.cleanup)
+        return sync
+
+    def test_within_limits(self):
+        sync = self._sync(20, 20)
+        self.assertTrue(sync.run_sync())
+        self.assertEqual(sync.report.info['preflight_counts'], {'source': 20, 'destination': 20})
+        self.assertEqual(sync.fetches, 1)
+
+    def test_truncated_source_aborts_before_fetch(self):
+        sync = self._sync(2, 200)
+        with self.assertRaises(SyncException) as ctx:
+            sync.run_sync()
+        self.assertIn('Pre-flight check failed', str(ctx.exception))
+        self.assertEqual(sync.fetches, 0)
+
+    def test_force(self):
+        sync = self._sync(2, 200)
+        sync._force = True
+        self.assertTrue(sync.run_sync())
+
+    def test_skipped_without_counts(self):
+        for src_count, dst_count in ((None, 200), (2, None)):
+            sync = self._sync(src_count, dst_count)
+            self.assertTrue(sync.run_sync())
+            self.assertNotIn('preflight_counts', sync.report.info)
+
+    def test_empty_destination(self):
+        sync = self._sync(20, 0)
+        self.assertTrue(sync.run_sync())
+        self.assertEqual(sync.report.info['preflight_counts'], {'source': 20, 'destination': 0})
+
+
+class ServerSideEstimateTest(unittest.TestCase):
+
+    def _checked_total(self, argv=()):
+        """Runs a server side diff of a destination query returning 100 rows
+        and returns the destination size the safety limits were checked with"""
+        sync = CountingSync(make_records(20), (), conf={'server_side_diff': True}, argv=argv)
+        self.addCleanup(sync.cleanup)
+        sync.dbh = mock.Mock(statement_cache=None)
+        sync.dbh.diff_jh_records.return_value = (set(), set(), set(), 100)
+        with mock.patch.object(sync, '_check_safety') as check_safety:
+            self.assertTrue(sync.run_sync())
+        self.assertEqual(
+            sync.dbh.diff_jh_records.call_args[0][1], 'SELECT id, name, val FROM thing')
+        return check_safety.call_args[0][0]
+
+    def test_unsharded(self):
+        self.assertEqual(self._checked_total(), 100)
+
+    def test_sharded_estimate(self):
+        # the destination query is not sharded, each shard is assumed to
+        # hold an equal share of it
+        self.assertEqual(self._checked_total(['--shard', '1/4']), 25)
+        self.assertEqual(self._checked_total(['--shard', '0/3']), 33)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+"""Tests of the ExecutionProgress events logged by JHRecordSyncLogger"""
+
+# Standard library imports
+import unittest
+
+# Local imports
+from fakes import StoreSync, FakeFeedLogger, make_records
+
+
+class ProgressEventTest(unittest.TestCase):
+
+    def _logger(self, event_types=None):
+        sync = StoreSync(make_records(1), ())
+        self.addCleanup(sync.cleanup)
+        events = FakeFeedLogger(event_types)
+        sync._feedlgr._dblog = True
+        sync._feedlgr._feedlgr = events
+        return sync._feedlgr, events
+
+    def test_progress_logged(self):
+        logger, events = self._logger()
+        logger.progress('chunk 1')
+        self.assertEqual(events.committed, ['chunk 1'])
+
+    def test_progress_skipped_without_event_type(self):
+        logger, events = self._logger(event_types=['ExecutionStarted'])
+        with self.assertLogs('jh_recsynclib.sync', 'WARNING'):
+            logger.progress('chunk 1')
+        logger.progress('chunk 2')
+        self.assertEqual(events.committed, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
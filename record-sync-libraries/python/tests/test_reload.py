@@ -0,0 +1,79 @@
+"""Tests of SyncBase.reload_conf"""
+
+# Standard library imports
+import os
+import json
+import unittest
+from unittest import mock
+
+# Local imports
+from fakes import StoreSync, make_records
+from jh_recsynclib.utils import JHRecordFactory
+
+
+class ReloadConfTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sync = StoreSync(make_records(2), make_records(2), argv=['--no'])
+        self.dbh = self.sync.dbh = mock.Mock()
+        self.feedlgr = self.sync._feedlgr
+
+    def tearDown(self):
+        self.sync.cleanup()
+        JHRecordFactory.clear_definition_cache()
+
+    def write_conf(self, **conf):
+        """Rewrites the sync's configuration file with conf merged in"""
+        path = os.path.join(self.sync.tmpdir, 'sync.json')
+        with open(path) as _fh:
+            sync_conf = json.load(_fh)
+        sync_conf.update(conf)
+        with open(path, 'w') as _fh:
+            json.dump(sync_conf, _fh)
+
+    def test_unchanged(self):
+        # the dry run flag written into the logger configuration is not a change
+        self.assertTrue(self.sync._conf['record_sync_logger_conf']['dry_run'])
+        self.assertFalse(self.sync.reload_conf())
+        self.assertIs(self.sync._feedlgr, self.feedlgr)
+        self.assertIs(self.sync.dbh, self.dbh)
+        self.dbh.close.assert_not_called()
+
+    def test_changed(self):
+        JHRecordFactory.cache_definition('thing', {'primary_keys': ['id']})
+        self.write_conf(sync_type='full', write_governor={'max_concurrency': 2})
+        new_dbh = mock.Mock()
+        with mock.patch.object(self.sync, '_init_db_handle', return_value=new_dbh):
+            self.assertTrue(self.sync.reload_conf())
+        self.dbh.close.assert_called_once_with()
+        self.assertIs(self.sync.dbh, new_dbh)
+        self.assertIsNot(self.sync._feedlgr, self.feedlgr)
+        self.assertEqual(self.sync._sync_type, 'full')
+        self.assertIsNotNone(self.sync._governor)
+        self.assertIsNone(JHRecordFactory.get_cached_definition('thing'))
+        # and the reloaded configuration is the one compared against next time
+        self.assertFalse(self.sync.reload_conf())
+
+    def test_unreadable(self):
+        with open(os.path.join(self.sync.tmpdir, 'sync.json'), 'w') as _fh:
+            _fh.write('{')
+        self.assertFalse(self.sync.reload_conf())
+        self.assertIs(self.sync._feedlgr, self.feedlgr)
+        self.assertIs(self.sync.dbh, self.dbh)
+
+    def test_unusable_keeps_current(self):
+        conf = self.sync._conf
+        self.write_conf(sync_type='full', record_sync_logger_conf={'dblog': False})
+        new_dbh = mock.Mock()
+        with mock.patch.object(self.sync, '_init_db_handle', return_value=new_dbh):
+            self.assertFalse(self.sync.reload_conf())
+        new_dbh.close.assert_called_once_with()
+        self.dbh.close.assert_not_called()
+        self.assertIs(self.sync._conf, conf)
+        self.assertIs(self.sync.dbh, self.dbh)
+        self.assertIs(self.sync._feedlgr, self.feedlgr)
+        self.assertEqual(self.sync._sync_type, 'changes')
+
+
+if __name__ == '__main__':
+    unittest.main()
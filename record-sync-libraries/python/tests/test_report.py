@@ -0,0 +1,46 @@
+"""Tests of the run report kept by SyncBase"""
+
+# Standard library imports
+import json
+import unittest
+
+# Local imports
+from fakes import StoreSync, make_records
+
+
+class RunReportTest(unittest.TestCase):
+
+    def _sync(self, conf=None):
+        sync = StoreSync(make_records(5, val='new'), make_records(5), conf=conf)
+        self.addCleanup(sync.cleanup)
+        return sync
+
+    def test_report_covers_feedlog_flush(self):
+        sync = self._sync()
+        results = []
+        success = sync._feedlgr.success
+
+        def check_open(msg=None):
+            results.append(sync.report.result)
+            success(msg)
+        sync._feedlgr.success = check_open
+        self.assertTrue(sync.run_sync())
+        self.assertEqual(results, [None])
+        report = sync.report.as_dict()
+        self.assertEqual(report['result'], 'success')
+        self.assertIn('feedlog_flush', report['phases'])
+        self.assertGreaterEqual(
+            report['total_seconds'], sum(p['seconds'] for p in report['phases'].values()))
+
+    def test_attached_report(self):
+        sync = self._sync({'attach_run_report': True})
+        messages = []
+        sync._feedlgr.success = messages.append
+        self.assertTrue(sync.run_sync())
+        attached = json.loads(messages[0].split('Run report: ', 1)[1])
+        self.assertEqual(attached['result'], 'success')
+        self.assertNotIn('feedlog_flush', attached['phases'])
+
+
+if __name__ == '__main__':
+    unittest.main()
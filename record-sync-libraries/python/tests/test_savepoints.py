@@ -0,0 +1,99 @@
+"""Tests of savepoint isolation in SyncBase"""
+
+# Standard library imports
+import unittest
+
+# Local imports
+from fakes import StoreSync, FakeFeedLogger, make_records
+
+
+SAVEPOINT_CONF = {
+    'allow_partial_updates': True,
+    'savepoint_isolation': True,
+    'commit_interval_records': 100,
+    'commit_interval_seconds': 3600}
+
+
+class SavepointIsolationTest(unittest.TestCase):
+
+    def _sync(self, fail_on=(), conf=None):
+        sync_conf = dict(SAVEPOINT_CONF)
+        sync_conf.update(conf or {})
+        sync = StoreSync(
+            make_records(10, val='new'), make_records(10, val='old'),
+            conf=sync_conf, fail_on=fail_on)
+        self.addCleanup(sync.cleanup)
+        events = FakeFeedLogger()
+        # send the per record events somewhere without a feedlogs DB
+        sync._feedlgr._dblog = True
+        sync._feedlgr._feedlgr = events
+        sync._feedlgr._get_rec_attrs = lambda *args: None
+        return sync, events
+
+    def test_failed_record_only_rolls_back_itself(self):
+        sync, _ = self._sync(fail_on={3, 7})
+        self.assertTrue(sync.run_sync())
+        self.assertEqual(sync._failures, 2)
+        values = {key: rec['val'] for key, rec in sync.store.committed.items()}
+        self.assertEqual(values[3], 'old')
+        self.assertEqual(values[7], 'old')
+        self.assertEqual(
+            sorted(key for key, val in values.items() if val == 'new'),
+            [0, 1, 2, 4, 5, 6, 8, 9])
+        self.assertNotIn('rollback', sync.store.calls)
+        self.assertEqual(sync.store.calls.count('rollback_to_savepoint'), 2)
+
+    def test_record_events_are_held_until_commit(self):
+        sync, events = self._sync()
+        held = []
+        commit = sync.store.commit
+
+        def commit_and_check():
+            held.append(len(sync._feedlgr._held_events))
+            self.assertFalse([msg for msg in events.committed if msg.startswith('Modified')])
+            commit()
+        sync.store.commit = commit_and_check
+        self.assertTrue(sync.run_sync())
+        self.assertEqual(held[0], 10)
+        self.assertEqual(
+            len([msg for msg in events.committed if msg.startswith('Modified')]), 10)
+
+    def test_held_events_dropped_on_rollback(self):
+        sync, events = self._sync()
+        sync._feedlgr.hold_events = True
+        (s_rec,), (d_rec,) = make_records(1, val='new'), make_records(1)
+        sync._feedlgr.modify_record(s_rec, d_rec)
+        self.assertEqual(len(sync._feedlgr._held_events), 1)
+        sync._feedlgr.rollback()
+        sync._feedlgr.commit()
+        self.assertEqual(events.committed, [])
+
+
+class FailurePathTest(unittest.TestCase):
+
+    def _sync(self, conf=None):
+        sync = StoreSync(
+            make_records(5, val='new'), make_records(5, val='old'), conf=conf, fail_on={2})
+        self.addCleanup(sync.cleanup)
+        return sync
+
+    def test_failure_rolls_back_everything(self):
+        sync = self._sync()
+        with self.assertRaises(Exception):
+            sync.run_sync()
+        self.assertIn('rollback', sync.store.calls)
+        self.assertNotIn('commit', sync.store.calls)
+        self.assertTrue(all(rec['val'] == 'old' for rec in sync.store.committed.values()))
+
+    def test_partial_updates_commit_each_record(self):
+        sync = self._sync({'allow_partial_updates': True})
+        self.assertTrue(sync.run_sync())
+        self.assertEqual(sync._failures, 1)
+        self.assertNotIn('savepoint', sync.store.calls)
+        self.assertEqual(
+            sorted(key for key, rec in sync.store.committed.items() if rec['val'] == 'new'),
+            [0, 1, 3, 4])
+
+
+if __name__ == '__main__':
+    unittest.main()
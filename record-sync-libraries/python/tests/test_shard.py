@@ -0,0 +1,66 @@
+"""Tests of sharded syncs"""
+
+# Standard library imports
+import argparse
+import unittest
+
+# Local imports
+from fakes import StoreSync, make_records
+from jh_recsynclib.sync import SyncException, parse_shard, shard_of
+
+
+class ParseShardTest(unittest.TestCase):
+
+    def test_valid(self):
+        self.assertEqual(parse_shard('0/4'), (0, 4))
+        self.assertEqual(parse_shard('3/4'), (3, 4))
+
+    def test_invalid(self):
+        for value in ('4/4', '-1/4', '0/0', '1', 'a/b', '1/2/3'):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                parse_shard(value)
+
+
+class ShardOfTest(unittest.TestCase):
+
+    def test_stable(self):
+        # crc32 based, the same on every host and python version
+        self.assertEqual([shard_of(rec, 4) for rec in sorted(
+            make_records(8), key=lambda rec: rec.primary_key)], [
+                shard_of(rec, 4) for rec in sorted(
+                    make_records(8), key=lambda rec: rec.primary_key)])
+
+    def test_spread(self):
+        counts = [0] * 4
+        for rec in make_records(400):
+            counts[shard_of(rec, 4)] += 1
+        self.assertEqual(sum(counts), 400)
+        self.assertTrue(all(count > 50 for count in counts))
+
+
+class ShardedSyncTest(unittest.TestCase):
+
+    def test_shards_cover_dataset(self):
+        src = make_records(20, val='new') | make_records(3, start=50)
+        dst = make_records(20, start=3)
+        applied = {}
+        for index in range(3):
+            sync = StoreSync(src, dst, argv=['--shard', '{}/3'.format(index)])
+            self.addCleanup(sync.cleanup)
+            self.assertTrue(sync.run_sync())
+            self.assertEqual(sync.report.info['shard'], '{}/3'.format(index))
+            for key, rec in sync.store.committed.items():
+                if shard_of(rec, 3) == index:
+                    applied[key] = rec
+        self.assertEqual(sorted(applied), list(range(20)) + [50, 51, 52])
+        self.assertEqual(applied, {rec.primary_key: rec for rec in src})
+
+    def test_full_sync_refused(self):
+        sync = StoreSync(make_records(2), (), argv=['--shard', '0/2'])
+        self.addCleanup(sync.cleanup)
+        with self.assertRaises(SyncException):
+            sync.run_sync('full')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+"""Tests of jh_recsynclib.spill"""
+
+# Standard library imports
+import os
+import unittest
+
+# Local imports
+from fakes import StoreSync, make_records
+from jh_recsynclib.spill import (
+    SpilledDatasets, SpillException, FootprintEstimator, parse_size)
+
+
+class ParseSizeTest(unittest.TestCase):
+
+    def test_sizes(self):
+        self.assertEqual(parse_size(100), 100)
+        self.assertEqual(parse_size('512'), 512)
+        self.assertEqual(parse_size('2k'), 2048)
+        self.assertEqual(parse_size('1.5M'), 1536 * 1024)
+        self.assertEqual(parse_size(' 1 GB '), 1024 ** 3)
+
+    def test_invalid(self):
+        for value in ('', 'M', '1T', '-1k'):
+            with self.assertRaises(SpillException):
+                parse_size(value)
+
+
+class SpilledDatasetsTest(unittest.TestCase):
+
+    def test_partitions_pair_records(self):
+        src, dst = make_records(50, val='new'), make_records(50, start=25)
+        spill = SpilledDatasets(4)
+        self.addCleanup(spill.close)
+        for rec in src:
+            spill.add('source', rec)
+        for rec in dst:
+            spill.add('destination', rec)
+        self.assertEqual(spill.counts, {'source': 50, 'destination': 50})
+        seen_src, seen_dst = set(), set()
+        for p_src, p_dst in spill.partitions():
+            keys = {rec.primary_key for rec in p_src} & {rec.primary_key for rec in p_dst}
+            # every key in both datasets lands in one partition
+            self.assertEqual(keys, {rec.primary_key for rec in p_src if rec.primary_key >= 25})
+            seen_src |= p_src
+            seen_dst |= p_dst
+        self.assertEqual(seen_src, src)
+        self.assertEqual(seen_dst, dst)
+
+    def test_close_removes_files(self):
+        spill = SpilledDatasets(2)
+        spill.add('source', make_records(1).pop())
+        directory = spill._dir
+        spill.close()
+        self.assertFalse(os.path.exists(directory))
+
+    def test_estimator(self):
+        estimator = FootprintEstimator(measure_first=2, sample_every=10)
+        for rec in make_records(40):
+            estimator.add(rec)
+        self.assertEqual(estimator.count, 40)
+        self.assertGreater(estimator.total, 0)
+
+
+class MemoryBudgetSyncTest(unittest.TestCase):
+
+    def test_partitioned_sync(self):
+        sync = StoreSync(
+            make_records(30, val='new') | make_records(5, start=100),
+            make_records(30, start=10), conf={'memory_budget': 1})
+        self.addCleanup(sync.cleanup)
+        self.assertTrue(sync.run_sync())
+        self.assertEqual(sync.report.info['memory_strategy'], 'partitioned')
+        self.assertEqual(
+            sorted(sync.store.committed),
+            list(range(30)) + list(range(100, 105)))
+        self.assertEqual(sync.store.committed[15]['val'], 'new')
+
+
+if __name__ == '__main__':
+    unittest.main()
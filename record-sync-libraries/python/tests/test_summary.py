@@ -0,0 +1,47 @@
+"""Tests of jh_recsynclib.summary"""
+
+# Standard library imports
+import unittest
+
+# Local imports
+from fakes import FACTORY
+from jh_recsynclib.summary import ChangeSummary
+
+
+class ChangeSummaryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.summary = ChangeSummary('thing', sample_size=1)
+        self.summary.add(FACTORY.create(id=1, name='a'))
+        self.summary.add(FACTORY.create(id=2, name='b'))
+        self.summary.remove(FACTORY.create(id=3, name='c'))
+        self.summary.modify(
+            FACTORY.create(id=4, name='new', val='x'), FACTORY.create(id=4, name='old', val='x'))
+
+    def test_counts(self):
+        self.assertEqual(self.summary.total, 4)
+        summary = self.summary.as_dict()
+        self.assertEqual(summary['counts'], {'add': 2, 'remove': 1, 'modify': 1})
+        self.assertEqual(dict(summary['attributes']), {'name': 1})
+        self.assertEqual(summary['samples']['add'], ['1'])
+        self.assertEqual(summary['samples']['modify'],
+                         [{'key': '4', 'changes': {'name': ['old', 'new']}}])
+
+    def test_lines(self):
+        lines = self.summary.lines('memory')
+        self.assertEqual(
+            lines[0], 'Change summary for thing in memory: added 2, removed 1, modified 1')
+        self.assertIn('thing.name changed on 1 records', lines)
+        self.assertIn('Sample: Modified thing:4 name from old to new', lines)
+        self.assertEqual(lines[-1], 'Samples limited to 1 records per operation')
+
+    def test_precomputed_changes(self):
+        summary = ChangeSummary('thing')
+        s_rec = FACTORY.create(id=1, name='a', val='new')
+        summary.modify(s_rec, FACTORY.create(id=1, name='a'), changed={'val': 'new'})
+        self.assertEqual(summary.attributes, {'val': 1})
+        self.assertNotIn('Samples limited', ' '.join(summary.lines('memory')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+"""Tests of the JHRecordFactory"""
+
+# Standard library imports
+import unittest
+
+# Local imports
+from fakes import FACTORY
+
+
+class CreateManyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rows = [{'id': num, 'name': 'n{}'.format(num), 'val': None} for num in range(3)]
+
+    def test_dict_rows(self):
+        recs = FACTORY.create_many(self.rows)
+        self.assertEqual(recs, [FACTORY.create(row) for row in self.rows])
+        self.assertEqual(recs[1].primary_key, 1)
+
+    def test_columns(self):
+        columns = ['val', 'id', 'name']
+        rows = [tuple(row[col] for col in columns) for row in self.rows]
+        recs = FACTORY.create_many(rows, columns)
+        self.assertEqual(recs, [FACTORY.create(row) for row in self.rows])
+        self.assertEqual(recs[2]['name'], 'n2')
+        self.assertIs(recs[0].factory, FACTORY)
+
+    def test_columns_generator(self):
+        recs = FACTORY.create_many(((num, 'n') for num in range(2)), iter(['id', 'name']))
+        self.assertEqual(recs, [FACTORY.create(id=num, name='n') for num in range(2)])
+
+    def test_empty(self):
+        self.assertEqual(FACTORY.create_many([], ['id']), [])
+
+
+if __name__ == '__main__':
+    unittest.main()